@@ -4,10 +4,10 @@ import uuid
 import time
 import os
 import json
-from chatbot import load_faq
-from nlp_agent import get_best_match
-from database import init_db, log_interaction, log_feedback, log_escalation
-from gtts import gTTS
+from chatbot import KnowledgeBase
+from nlp_agent import EMBEDDING_CACHE_DIR, warmup
+from database import init_db, enable_async_logging, log_interaction, log_feedback, log_escalation
+from tts import TTSService, remove_legacy_audio
 import base64
 
 # --- PAGE CONFIG ---
@@ -434,10 +434,60 @@ if not st.session_state.bookmarks:
     st.session_state.bookmarks = load_bookmarks()
 
 # --- INIT DB & FAQ ---
+FAQ_PATH = os.path.join(os.path.dirname(__file__), '../data/faq.json')
+
+@st.cache_resource
+def load_knowledge_base():
+    """Load the FAQ index once per process; it reloads itself when faq.json changes"""
+    return KnowledgeBase(FAQ_PATH, cache_dir=EMBEDDING_CACHE_DIR)
+
 init_db()
-faq = load_faq()
-all_patterns = [pattern for item in faq for pattern in item.get("patterns", [])]
-pattern_to_response = {pattern: item.get("response", "") for item in faq for pattern in item.get("patterns", [])}
+# Commit interactions on a background writer so replies don't wait on disk
+enable_async_logging()
+knowledge_base = load_knowledge_base()
+# Edits to faq.json swap in a new index (with fresh caches) between reruns
+pattern_index = knowledge_base.index
+# Without the embedding model the index answers from BM25 alone; a failed
+# load is retried every MODEL_RETRY_INTERVAL, and once the model is back the
+# pattern matrix and its search index are built here rather than on a query
+if not pattern_index.prepared and pattern_index.semantic_available():
+    pattern_index.prepare()
+    warmup()
+
+@st.cache_resource
+def load_tts_service():
+    """Shared TTS service; renders audio in the background into a size-capped store"""
+    # Older versions wrote a response_<uuid>.mp3 per answer into the working directory
+    remove_legacy_audio(os.getcwd())
+    return TTSService()
+
+@st.cache_resource(max_entries=1)
+def prerender_audio(faq_version):
+    """Queue audio for every FAQ answer once per knowledge base version"""
+    # FAQ answers are a small fixed set, so they are all rendered ahead of time
+    return tts_service.prerender(pattern_index.table.responses)
+
+tts_service = load_tts_service()
+prerender_audio(knowledge_base.version)
+
+def show_audio(text):
+    """Play the audio for a reply, or wait for it while it is still rendering"""
+    path = tts_service.get(text)
+    if path:
+        st.audio(path, format=tts_service.engine.mime)
+    elif tts_service.is_pending(text):
+        poll_audio(text)
+
+@st.fragment(run_every=1)
+def poll_audio(text):
+    # Reruns only this fragment while the background render is in flight.
+    # The store is written before the job leaves the pending set, so once it
+    # has left, one full rerun draws the static player (or nothing, if the
+    # render failed) and this fragment stops being scheduled.
+    if tts_service.is_pending(text):
+        st.caption("🔊 Preparing audio...")
+    else:
+        st.rerun()
 
 # --- SIDEBAR ---
 with st.sidebar:
@@ -539,6 +589,15 @@ if st.session_state.user_name:
                 if st.button(suggestion, key=f"suggestion_{i}"):
                     st.session_state.pending_suggestion = suggestion
 
+def option_answer(option):
+    """Response and intent name for a "Did you mean" option"""
+    table = pattern_index.table
+    intent_id = option["intent_id"]
+    if intent_id < len(table) and table.names[intent_id] == option["intent"]:
+        return table.responses[intent_id], option["intent"]
+    # faq.json was reloaded since the options were offered
+    return pattern_index.response_for(option["pattern"]), pattern_index.intent_for(option["pattern"])
+
 # --- CHAT HISTORY ---
 for i, message in enumerate(st.session_state.history):
     with st.chat_message(message["role"]):
@@ -556,8 +615,8 @@ for i, message in enumerate(st.session_state.history):
                 st.success("🔖 Bookmarked!")
 
         # Display audio for assistant responses
-        if message["role"] == "assistant" and message.get("type") == "answer" and "audio_file" in message:
-            st.audio(message["audio_file"], format="audio/mp3")
+        if message["role"] == "assistant" and message.get("type") == "answer" and "audio_text" in message:
+            show_audio(message["audio_text"])
 
         # Handle feedback for answers
         if message.get("type") == "answer" and "interaction_id" in message:
@@ -591,23 +650,21 @@ for i, message in enumerate(st.session_state.history):
             options = message["options"]
             original_prompt = st.session_state.history[i-1]['content']
             
-            for option in options:
-                if st.button(option, key=f"option_{i}_{option}"):
-                    response = pattern_to_response[option]
+            for j, option in enumerate(options):
+                if st.button(option["pattern"], key=f"option_{i}_{j}"):
+                    response, intent = option_answer(option)
+                    # Audio renders in the background; the reply shows right away
+                    tts_service.request(response)
                     
-                    # Generate audio for the response
-                    tts = gTTS(text=response, lang='en')
-                    audio_file = f"response_{uuid.uuid4()}.mp3"
-                    tts.save(audio_file)
-                    
-                    st.session_state.history.append({"role": "user", "content": option})
-                    interaction_id = log_interaction(st.session_state.session_id, original_prompt, response, 0.85)
+                    st.session_state.history.append({"role": "user", "content": option["pattern"]})
+                    interaction_id = log_interaction(st.session_state.session_id, original_prompt, response, 0.85,
+                                                    option["pattern"], intent)
                     st.session_state.history.append({
                         "role": "assistant",
                         "content": response,
                         "type": "answer",
                         "interaction_id": interaction_id,
-                        "audio_file": audio_file
+                        "audio_text": response
                     })
                     
                     st.session_state.history[i]["selection_made"] = True
@@ -622,39 +679,32 @@ for i, message in enumerate(st.session_state.history):
                 st.rerun()
 
 # --- HANDLE PENDING SUGGESTIONS ---
-if st.session_state.pending_suggestion:
-    prompt = st.session_state.pending_suggestion
-    st.session_state.pending_suggestion = None
-    
-    # Add user message
-    st.session_state.history.append({"role": "user", "content": prompt})
-    
+def respond_to(prompt):
+    """Answer a prompt, or offer the closest patterns when unsure"""
     with st.spinner("🤔 Thinking..."):
-        best_q, best_score = get_best_match(prompt, all_patterns)
-
-        if best_q and best_score >= 0.5:  # Reduced from 0.75
-            response = pattern_to_response[best_q]
-            # Generate audio for the response
-            tts = gTTS(text=response, lang='en')
-            audio_file = f"response_{uuid.uuid4()}.mp3"
-            tts.save(audio_file)
+        # One scoring pass yields both the best intent and the fallback options
+        matches = pattern_index.rank_intents(prompt, k=3, min_score=0.3)
+
+        if matches and matches[0].score >= 0.5:  # Reduced from 0.75
+            best = matches[0]
+            response = pattern_index.table.responses[best.intent_id]
+            # Audio renders in the background; the reply shows right away
+            tts_service.request(response)
             
-            interaction_id = log_interaction(st.session_state.session_id, prompt, response, best_score)
+            interaction_id = log_interaction(st.session_state.session_id, prompt, response, best.score,
+                                            best.pattern, best.name)
             st.session_state.history.append({
                 "role": "assistant",
                 "content": response,
                 "type": "answer",
                 "interaction_id": interaction_id,
-                "audio_file": audio_file
+                "audio_text": response
             })
         else:
-            scored = []
-            for p in all_patterns:
-                _, score = get_best_match(prompt, [p])
-                scored.append((p, score))
-            
-            scored.sort(key=lambda x: x[1], reverse=True)
-            options = [q for q, s in scored[:3] if s > 0.3]
+            # Offer the closest pattern of each of the nearest intents; two
+            # intents may share a pattern, so the intent travels with it
+            options = [{"intent_id": match.intent_id, "intent": match.name, "pattern": match.pattern}
+                       for match in matches]
 
             if options:
                 response = "I'm not sure I understood. Did you mean one of these?"
@@ -663,6 +713,15 @@ if st.session_state.pending_suggestion:
                 response = "I'm not sure how to answer that. This query has been escalated to a human agent."
                 st.session_state.history.append({"role": "assistant", "content": response, "type": "escalated"})
                 log_escalation(prompt)
+
+if st.session_state.pending_suggestion:
+    prompt = st.session_state.pending_suggestion
+    st.session_state.pending_suggestion = None
+    
+    # Add user message
+    st.session_state.history.append({"role": "user", "content": prompt})
+    
+    respond_to(prompt)
     
     st.rerun()
 
@@ -676,40 +735,6 @@ if prompt:
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    with st.spinner("🤔 Thinking..."):
-        best_q, best_score = get_best_match(prompt, all_patterns)
-
-        if best_q and best_score >= 0.5:
-            response = pattern_to_response[best_q]
-            # Generate audio for the response
-            tts = gTTS(text=response, lang='en')
-            audio_file = f"response_{uuid.uuid4()}.mp3"
-            tts.save(audio_file)
-            
-            interaction_id = log_interaction(st.session_state.session_id, prompt, response, best_score)
-            st.session_state.history.append({
-                "role": "assistant",
-                "content": response,
-                "type": "answer",
-                "interaction_id": interaction_id,
-                "audio_file": audio_file
-            })
-        else:
-            # Generate options for unclear queries with more lenient scoring
-            scored = []
-            for p in all_patterns:
-                _, score = get_best_match(prompt, [p])
-                scored.append((p, score))
-            
-            scored.sort(key=lambda x: x[1], reverse=True)
-            options = [q for q, s in scored[:3] if s > 0.3] 
-
-            if options:
-                response = "I'm not sure I understood. Did you mean one of these?"
-                st.session_state.history.append({"role": "assistant", "content": response, "type": "options", "options": options})
-            else:
-                response = "I'm not sure how to answer that. This query has been escalated to a human agent."
-                st.session_state.history.append({"role": "assistant", "content": response, "type": "escalated"})
-                log_escalation(prompt)
+    respond_to(prompt)
     
     st.rerun()
\ No newline at end of file
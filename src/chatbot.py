@@ -1,6 +1,14 @@
+import hashlib
 import json
+import logging
 import os
-from nlp_agent import get_best_match
+import threading
+import time
+from nlp_agent import EMBEDDING_CACHE_DIR, EmbeddingStore, PatternIndex, get_best_match
+
+FAQ_CHECK_INTERVAL = float(os.environ.get("FAQ_CHECK_INTERVAL", "2"))  # seconds between faq.json stat() calls
+
+logger = logging.getLogger(__name__)
 
 def load_faq(path=None):
     if path is None:
@@ -8,20 +16,112 @@ def load_faq(path=None):
     with open(path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
-from nlp_agent import get_best_match
+def build_index(faq=None, cache_dir=None, encoder=None):
+    """Build a PatternIndex over the FAQ patterns.
 
-def get_answer(user_query, faq=None):
+    With cache_dir set, pattern embeddings are persisted there and reused by
+    later processes as long as the model and patterns are unchanged.
+    """
     if faq is None:
         faq = load_faq()
-    all_patterns = []
-    pattern_to_response = {}
-    for item in faq:
-        for pattern in item.get("patterns", []):
-            all_patterns.append(pattern)
-            pattern_to_response[pattern] = item.get("response", "")
-    best_q, score = get_best_match(user_query, all_patterns)
-    if best_q:
-        return pattern_to_response[best_q]
-    return None
+    store = EmbeddingStore(os.path.join(cache_dir, 'faq_embeddings')) if cache_dir else None
+    return PatternIndex.from_faq(faq, encoder=encoder, store=store)
+
+class KnowledgeBase:
+    """FAQ pattern index that follows edits to faq.json without a restart.
+
+    The file is stat()ed at most every check_interval seconds. When its
+    mtime or size moves and the content hash really changed, a new index is
+    built next to the live one, reusing the embeddings of unchanged
+    patterns, and then swapped in with a single assignment. Readers always
+    see either the old or the new index, never a half-built one, and only
+    the first load makes them wait: while one thread rebuilds, the others
+    keep answering from the live index. If the edited file does not parse,
+    the previous index stays live.
+    """
+
+    def __init__(self, path=None, cache_dir=None, check_interval=FAQ_CHECK_INTERVAL, encoder=None):
+        self.path = path or os.path.join(os.path.dirname(__file__), '../data/faq.json')
+        self.cache_dir = cache_dir
+        self.encoder = encoder
+        self.check_interval = check_interval
+        self.version = 0
+        self.last_encoded = None
+        self._index = None
+        self._stamp = None
+        self._digest = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
 
+    @property
+    def index(self):
+        """The current PatternIndex, reloaded first if faq.json changed"""
+        self.refresh()
+        return self._index
 
+    def refresh(self, force=False):
+        """Reload if faq.json changed; returns True when a new index was swapped in.
+
+        Unless this is the first load or force is set, a reload already in
+        progress on another thread is not waited for.
+        """
+        now = time.monotonic()
+        if self._index is not None and not force and now - self._checked < self.check_interval:
+            return False
+        if not self._lock.acquire(blocking=self._index is None or force):
+            return False
+        try:
+            self._checked = now
+            try:
+                stat = os.stat(self.path)
+                stamp = (stat.st_mtime_ns, stat.st_size)
+                if self._index is not None and stamp == self._stamp:
+                    return False
+                with open(self.path, 'rb') as f:
+                    data = f.read()
+                digest = hashlib.sha256(data).hexdigest()
+                if self._index is not None and digest == self._digest:
+                    # Touched but not edited
+                    self._stamp = stamp
+                    return False
+                faq = json.loads(data.decode('utf-8'))
+                index = build_index(faq, cache_dir=self.cache_dir, encoder=self.encoder)
+            except (OSError, ValueError):
+                if self._index is None:
+                    raise
+                logger.warning("Keeping the current FAQ; could not reload %s", self.path, exc_info=True)
+                return False
+            if self._index is not None:
+                self.last_encoded = index.reuse_embeddings(self._index)
+            self._index, self._stamp, self._digest = index, stamp, digest
+            self.version += 1
+            return True
+        finally:
+            self._lock.release()
+
+    def get_answer(self, user_query):
+        """Answer a query from the current index"""
+        return get_answer(user_query, index=self.index)
+
+_knowledge_base = None
+_knowledge_base_lock = threading.Lock()
+
+def get_knowledge_base():
+    """The process-wide KnowledgeBase over data/faq.json"""
+    global _knowledge_base
+    with _knowledge_base_lock:
+        if _knowledge_base is None:
+            _knowledge_base = KnowledgeBase(cache_dir=EMBEDDING_CACHE_DIR)
+        return _knowledge_base
+
+def get_answer(user_query, faq=None, index=None):
+    if index is None:
+        if faq is None:
+            # Loaded once per process instead of re-reading faq.json per call
+            index = get_knowledge_base().index
+        else:
+            index = build_index(faq)
+    best_q, score = get_best_match(user_query, index)
+    if best_q:
+        return index.response_for(best_q)
+    return None
\ No newline at end of file
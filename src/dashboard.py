@@ -2,16 +2,37 @@ import streamlit as st
 import sqlite3
 import pandas as pd
 import os
+import re
+import io
+import tempfile
+import threading
 from datetime import datetime
 import plotly.express as px
 import plotly.graph_objects as go
+from database import get_connection, migrate, refresh_rollups, SCORE_BUCKETS
 
 # Database path
 DB_PATH = os.path.join(os.path.dirname(__file__), '../data/chatbot.db')
 
+PAGE_SIZES = [10, 25, 50, 100]
+EXPORT_CHUNK_SIZE = 5000  # rows fetched per query while writing a CSV export
+# st.download_button holds the whole file in memory, so exports are capped
+EXPORT_MAX_ROWS = int(os.environ.get("EXPORT_MAX_ROWS", 200000))
+ROWID_COLUMN = "_rowid"
+READ_CHUNK_SIZE = 5000  # rows per DataFrame when streaming large reads
+
+# SQLite can't bind identifiers, so table names are checked before they reach SQL
+TABLE_NAME_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+def validate_table_name(table_name):
+    """Return table_name if it is a plain identifier, else raise ValueError"""
+    if not isinstance(table_name, str) or not TABLE_NAME_RE.match(table_name):
+        raise ValueError(f"Invalid table name: {table_name!r}")
+    return table_name
+
 def get_db_connection():
-    """Get database connection"""
-    return sqlite3.connect(DB_PATH)
+    """Get a pooled database connection; close() returns it to the pool"""
+    return get_connection(DB_PATH)
 
 def get_table_names():
     """Get all table names from the database"""
@@ -24,6 +45,7 @@ def get_table_names():
 
 def get_table_data(table_name):
     """Get all data from a specific table"""
+    table_name = validate_table_name(table_name)
     conn = get_db_connection()
     df = pd.read_sql_query(f"SELECT * FROM {table_name}", conn)
     conn.close()
@@ -31,6 +53,7 @@ def get_table_data(table_name):
 
 def get_table_info(table_name):
     """Get table schema information"""
+    table_name = validate_table_name(table_name)
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(f"PRAGMA table_info({table_name})")
@@ -40,6 +63,7 @@ def get_table_info(table_name):
 
 def get_table_count(table_name):
     """Get row count for a table"""
+    table_name = validate_table_name(table_name)
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
@@ -47,6 +71,175 @@ def get_table_count(table_name):
     conn.close()
     return count
 
+def get_table_stats():
+    """Row count and schema of every table, read on one connection.
+
+    Returns {table: {"count": ..., "columns": [...]}} where columns holds
+    PRAGMA table_info rows, in sqlite_master order.
+    """
+    conn = get_db_connection()
+    try:
+        columns = {}
+        rows = conn.execute(
+            "SELECT m.name, p.cid, p.name, p.type, p.\"notnull\", p.dflt_value, p.pk "
+            "FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p WHERE m.type = 'table'"
+        )
+        for row in rows:
+            if TABLE_NAME_RE.match(row[0]):
+                columns.setdefault(row[0], []).append(tuple(row[1:]))
+        counts = {}
+        if columns:
+            # One statement counts every table
+            counts = dict(conn.execute(" UNION ALL ".join(
+                f"SELECT '{table}', COUNT(*) FROM {table}" for table in columns
+            )))
+    finally:
+        conn.close()
+    return {table: {"count": counts[table], "columns": cols} for table, cols in columns.items()}
+
+_version_conn = None
+_version_lock = threading.Lock()
+
+def get_data_version():
+    """Token that changes whenever the database is committed to.
+
+    PRAGMA data_version only moves when *other* connections commit, and is
+    only comparable on one connection, so a dedicated read-only connection
+    is kept for it. The path and inode are part of the token so a replaced
+    file is never mistaken for the old one.
+    """
+    global _version_conn
+    stat = os.stat(DB_PATH)
+    file_id = (DB_PATH, stat.st_dev, stat.st_ino)
+    with _version_lock:
+        if _version_conn is None or _version_conn[0] != file_id:
+            if _version_conn is not None:
+                _version_conn[1].close()
+            conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False)
+            _version_conn = (file_id, conn)
+        version = _version_conn[1].execute("PRAGMA data_version").fetchone()[0]
+    return file_id + (version,)
+
+# Cached loaders: the version argument is only the cache key, so reruns that
+# see no new commits are answered from memory
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_table_stats(version):
+    return get_table_stats()
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def load_table_page(version, table_name, after, limit):
+    return get_table_page(table_name, after, limit)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_analytics(version):
+    try:
+        return get_rollup_data()
+    except sqlite3.OperationalError:
+        # Read-only or locked database: aggregate in SQL without writing rollups
+        return get_live_analytics()
+
+def get_table_page(table_name, after=0, limit=10):
+    """Get up to limit rows with rowid greater than after, and the last rowid read.
+
+    Keyset pagination: each page is an index range scan on the rowid, so
+    reading page N costs the same as reading page 1.
+    """
+    table_name = validate_table_name(table_name)
+    conn = get_db_connection()
+    df = pd.read_sql_query(
+        f"SELECT rowid AS {ROWID_COLUMN}, * FROM {table_name} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+        conn, params=(after, limit)
+    )
+    conn.close()
+    last = int(df[ROWID_COLUMN].iloc[-1]) if not df.empty else None
+    return df.drop(columns=ROWID_COLUMN), last
+
+def iter_table_chunks(table_name, chunk_size=READ_CHUNK_SIZE, max_rows=None):
+    """Yield a table (or its first max_rows rows) as DataFrames of at most chunk_size rows"""
+    table_name = validate_table_name(table_name)
+    conn = get_db_connection()
+    try:
+        # LIMIT -1 is no limit in SQLite
+        yield from pd.read_sql_query(f"SELECT * FROM {table_name} ORDER BY rowid LIMIT ?", conn,
+                                     params=(-1 if max_rows is None else max_rows,), chunksize=chunk_size)
+    finally:
+        conn.close()
+
+def iter_table_csv(table_name, chunk_size=EXPORT_CHUNK_SIZE, max_rows=None):
+    """Yield a table as CSV text, one chunk at a time"""
+    for i, df in enumerate(iter_table_chunks(table_name, chunk_size, max_rows)):
+        yield df.to_csv(index=False, header=i == 0)
+
+def export_table_csv(table_name, chunk_size=EXPORT_CHUNK_SIZE, max_rows=EXPORT_MAX_ROWS):
+    """Write up to max_rows rows of a table as CSV to a temporary file on disk.
+
+    Returns a reader positioned at the start, a type st.download_button
+    accepts; the file is deleted once the reader is closed. Streamlit
+    still reads the whole file into memory to serve it, hence max_rows.
+    """
+    raw = tempfile.TemporaryFile(buffering=0)
+    out = io.BufferedWriter(raw)
+    try:
+        for chunk in iter_table_csv(table_name, chunk_size, max_rows):
+            out.write(chunk.encode("utf-8"))
+        out.flush()
+    except BaseException:
+        out.close()
+        raise
+    out.detach()
+    raw.seek(0)
+    return io.BufferedReader(raw)
+
+def get_daily_counts(table_name):
+    """Rows per day, counted in SQL"""
+    table_name = validate_table_name(table_name)
+    conn = get_db_connection()
+    df = pd.read_sql_query(
+        f"SELECT date(timestamp) AS day, COUNT(*) AS count FROM {table_name} GROUP BY day ORDER BY day", conn
+    )
+    conn.close()
+    return df
+
+def get_score_distribution():
+    """Interaction match scores bucketed in SQL, one row per non-empty bucket"""
+    conn = get_db_connection()
+    histogram = pd.read_sql_query(
+        f"SELECT MIN(CAST(match_score * {SCORE_BUCKETS} AS INT), {SCORE_BUCKETS - 1}) AS bucket, COUNT(*) AS count "
+        "FROM interactions WHERE match_score IS NOT NULL GROUP BY bucket ORDER BY bucket", conn
+    )
+    conn.close()
+    histogram['match_score'] = histogram['bucket'] / SCORE_BUCKETS
+    return histogram
+
+def get_live_analytics():
+    """Same frames as get_rollup_data, aggregated from the raw tables in SQL"""
+    conn = get_db_connection()
+    daily = pd.read_sql_query(
+        "SELECT date(timestamp) AS day, COUNT(*) AS interactions, "
+        "SUM(feedback IS 1) AS feedback_up, SUM(feedback IS -1) AS feedback_down "
+        "FROM interactions GROUP BY day ORDER BY day", conn
+    )
+    conn.close()
+    escalations = get_daily_counts("escalations").rename(columns={'count': 'escalations'})
+    daily = daily.merge(escalations, on='day', how='outer').fillna(0).sort_values('day', ignore_index=True)
+    return daily, get_score_distribution()
+
+def get_rollup_data():
+    """Bring the rollup tables up to date and return (daily totals, score histogram)"""
+    conn = get_db_connection()
+    try:
+        # The dashboard may open a database the app hasn't migrated yet
+        migrate(conn)
+        refresh_rollups(conn)
+        daily = pd.read_sql_query("SELECT * FROM daily_rollup ORDER BY day", conn)
+        histogram = pd.read_sql_query(
+            "SELECT bucket, SUM(count) AS count FROM score_histogram GROUP BY bucket ORDER BY bucket", conn
+        )
+    finally:
+        conn.close()
+    histogram['match_score'] = histogram['bucket'] / SCORE_BUCKETS
+    return daily, histogram
+
 def main():
     st.set_page_config(
         page_title="Database Dashboard",
@@ -97,10 +290,12 @@ def main():
     
     # Get tables
     try:
-        tables = get_table_names()
+        version = get_data_version()
+        stats = load_table_stats(version)
     except Exception as e:
         st.error(f"❌ Error connecting to database: {e}")
         return
+    tables = list(stats)
     
     if not tables:
         st.warning("⚠️ No tables found in the database.")
@@ -111,11 +306,11 @@ def main():
     selected_table = st.sidebar.selectbox("Select a table:", ["Overview"] + tables)
     
     if selected_table == "Overview":
-        show_overview(tables)
+        show_overview(stats, version)
     else:
-        show_table_details(selected_table)
+        show_table_details(selected_table, stats, version)
 
-def show_overview(tables):
+def show_overview(stats, version):
     """Show overview of all tables"""
     st.header("📋 Database Overview")
     
@@ -123,15 +318,9 @@ def show_overview(tables):
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        st.metric("📊 Total Tables", len(tables))
+        st.metric("📊 Total Tables", len(stats))
     
-    total_records = 0
-    for table in tables:
-        try:
-            count = get_table_count(table)
-            total_records += count
-        except:
-            continue
+    total_records = sum(info["count"] for info in stats.values())
     
     with col2:
         st.metric("📝 Total Records", total_records)
@@ -143,69 +332,73 @@ def show_overview(tables):
     st.subheader("📊 Tables Summary")
     
     table_data = []
-    for table in tables:
-        try:
-            count = get_table_count(table)
-            columns = get_table_info(table)
-            table_data.append({
-                "Table Name": table,
-                "Records": count,
-                "Columns": len(columns)
-            })
-        except Exception as e:
-            table_data.append({
-                "Table Name": table,
-                "Records": "Error",
-                "Columns": "Error"
-            })
+    for table, info in stats.items():
+        table_data.append({
+            "Table Name": table,
+            "Records": info["count"],
+            "Columns": len(info["columns"])
+        })
     
     df_summary = pd.DataFrame(table_data)
     st.dataframe(df_summary, use_container_width=True)
     
     # Charts for interactions table if it exists
-    if "interactions" in tables:
-        show_interactions_analytics()
+    if "interactions" in stats:
+        show_interactions_analytics(version)
 
-def show_interactions_analytics():
+def show_interactions_analytics(version):
     """Show analytics for interactions table"""
     st.subheader("📈 Interactions Analytics")
     
     try:
-        df = get_table_data("interactions")
+        # Charts read the per-day rollups, not the raw interactions
+        daily, histogram = load_analytics(version)
         
-        if not df.empty:
+        if not daily.empty:
             col1, col2 = st.columns(2)
             
             with col1:
                 # Interactions over time
-                if 'timestamp' in df.columns:
-                    df['timestamp'] = pd.to_datetime(df['timestamp'])
-                    df['date'] = df['timestamp'].dt.date
-                    daily_counts = df.groupby('date').size().reset_index(name='count')
-                    
-                    fig = px.line(daily_counts, x='date', y='count', 
-                                title="Interactions Over Time")
-                    fig.update_layout(height=300)
-                    st.plotly_chart(fig, use_container_width=True)
+                fig = px.line(daily, x='day', y='interactions',
+                            title="Interactions Over Time")
+                fig.update_layout(height=300)
+                st.plotly_chart(fig, use_container_width=True)
             
             with col2:
                 # Match scores distribution
-                if 'match_score' in df.columns and df['match_score'].notna().any():
-                    fig = px.histogram(df, x='match_score', nbins=20,
-                                     title="Match Score Distribution")
-                    fig.update_layout(height=300)
+                if not histogram.empty:
+                    fig = px.bar(histogram, x='match_score', y='count',
+                               title="Match Score Distribution")
+                    fig.update_traces(width=1 / SCORE_BUCKETS, offset=0)
+                    fig.update_layout(height=300, bargap=0)
                     st.plotly_chart(fig, use_container_width=True)
+            
+            col3, col4 = st.columns(2)
+            
+            with col3:
+                # Feedback over time
+                fig = px.bar(daily, x='day', y=['feedback_up', 'feedback_down'],
+                           title="Feedback Over Time", barmode='group')
+                fig.update_layout(height=300)
+                st.plotly_chart(fig, use_container_width=True)
+            
+            with col4:
+                # Escalations over time
+                fig = px.line(daily, x='day', y='escalations',
+                            title="Escalations Over Time")
+                fig.update_layout(height=300)
+                st.plotly_chart(fig, use_container_width=True)
     except Exception as e:
         st.error(f"Error loading analytics: {e}")
 
-def show_table_details(table_name):
+def show_table_details(table_name, stats, version):
     """Show detailed view of a specific table"""
     st.header(f"📊 Table: {table_name}")
     
     try:
         # Table info
-        columns = get_table_info(table_name)
-        count = get_table_count(table_name)
+        columns = stats[table_name]["columns"]
+        count = stats[table_name]["count"]
         
         # Metrics
         col1, col2 = st.columns(2)
@@ -234,30 +427,41 @@ def show_table_details(table_name):
         
         if count > 0:
             # Pagination
-            page_size = st.selectbox("Rows per page:", [10, 25, 50, 100], index=0)
-            
-            # Get data
-            df = get_table_data(table_name)
-            
+            page_size = st.selectbox("Rows per page:", PAGE_SIZES, index=0)
+            total_pages = (count - 1) // page_size + 1
+
+            # Start rowid of every page visited so far; the last entry is the current page
+            page_keys = st.session_state.setdefault(f"page_keys_{table_name}_{page_size}", [0])
+            df, last = load_table_page(version, table_name, page_keys[-1], page_size)
+
             if not df.empty:
-                total_pages = (len(df) - 1) // page_size + 1
-                page = st.number_input("Page:", min_value=1, max_value=total_pages, value=1)
-                
-                start_idx = (page - 1) * page_size
-                end_idx = start_idx + page_size
-                
-                st.dataframe(df.iloc[start_idx:end_idx], use_container_width=True)
-                
-                # Download option
-                csv = df.to_csv(index=False)
-                st.download_button(
-                    label=f"📥 Download {table_name} as CSV",
-                    data=csv,
-                    file_name=f"{table_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                    mime="text/csv"
-                )
+                st.dataframe(df, use_container_width=True)
             else:
-                st.info("No data available in this table.")
+                st.info("No more rows in this table.")
+
+            col1, col2, col3 = st.columns([1, 2, 1])
+            with col1:
+                if st.button("⬅️ Previous", disabled=len(page_keys) == 1):
+                    page_keys.pop()
+                    st.rerun()
+            with col2:
+                st.caption(f"Page {len(page_keys)} of {total_pages}")
+            with col3:
+                at_end = last is None or len(df) < page_size or len(page_keys) >= total_pages
+                if st.button("Next ➡️", disabled=at_end):
+                    page_keys.append(last)
+                    st.rerun()
+
+            # Download option; the CSV is only built when the button is clicked
+            if count > EXPORT_MAX_ROWS:
+                st.warning(f"Only the first {EXPORT_MAX_ROWS:,} of {count:,} rows are included in the CSV download "
+                           "(EXPORT_MAX_ROWS); export larger tables with the sqlite3 command-line tool.")
+            st.download_button(
+                label=f"📥 Download {table_name} as CSV",
+                data=lambda: export_table_csv(table_name),
+                file_name=f"{table_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                mime="text/csv"
+            )
         else:
             st.info("This table is empty.")
             
@@ -1,12 +1,268 @@
 import sqlite3
 import os
+import threading
+import atexit
+import queue
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+from itertools import groupby
 
 DB_PATH = os.path.join(os.path.dirname(__file__), '../data/chatbot.db')
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
+BUSY_TIMEOUT = 5.0  # seconds a writer waits on a locked database before failing
+POOL_SIZE = 8  # idle connections kept per database file
+STATEMENT_CACHE_SIZE = 128
+
+# Async logging: queued records are flushed every LOG_BATCH_SIZE rows or LOG_FLUSH_INTERVAL seconds
+LOG_QUEUE_SIZE = 1000
+LOG_BATCH_SIZE = 50
+LOG_FLUSH_INTERVAL = 0.2
+
+SCORE_BUCKETS = 20  # match_score histogram bins of width 1/SCORE_BUCKETS
+
+INSERT_INTERACTION_SQL = (
+    "INSERT INTO interactions (session_id, user_query, bot_response, match_score, client_id, matched_pattern, matched_intent) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+UPDATE_FEEDBACK_SQL = "UPDATE interactions SET feedback = ? WHERE id = ?"
+UPDATE_FEEDBACK_BY_CLIENT_ID_SQL = "UPDATE interactions SET feedback = ? WHERE client_id = ?"
+INSERT_ESCALATION_SQL = "INSERT INTO escalations (user_query, suggested_answer) VALUES (?, ?)"
+
+def connect(db_path=None, **kwargs):
+    """Open a connection configured for concurrent use (WAL, NORMAL sync, busy timeout)"""
+    conn = sqlite3.connect(db_path or DB_PATH, timeout=BUSY_TIMEOUT,
+                           cached_statements=STATEMENT_CACHE_SIZE, **kwargs)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(BUSY_TIMEOUT * 1000)}")
+    return conn
+
+def _file_id(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino)
+
+class PooledConnection(sqlite3.Connection):
+    """Connection whose close() hands it back to its pool instead of closing it"""
+
+    pool = None
+    file_id = None
+
+    def close(self):
+        if self.pool is None or not self.pool.release(self):
+            super().close()
+
+class ConnectionPool:
+    """Idle SQLite connections to one database file, shared between threads.
+
+    Streamlit runs every rerun on a fresh thread, so connections are pooled
+    rather than kept per thread. Each connection keeps its own prepared
+    statement cache, which the constant SQL strings above reuse.
+    """
+
+    def __init__(self, db_path, size=POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Return an idle connection, or open a new one"""
+        file_id = _file_id(self.db_path)
+        with self._lock:
+            while self._idle:
+                conn = self._idle.pop()
+                # The file was deleted or replaced; the old handle points at the stale inode
+                if conn.file_id == file_id:
+                    return conn
+                sqlite3.Connection.close(conn)
+        conn = connect(self.db_path, factory=PooledConnection, check_same_thread=False)
+        conn.pool = self
+        conn.file_id = _file_id(self.db_path)
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool; False if the pool is full"""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return True
+        return False
+
+    def close(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            sqlite3.Connection.close(conn)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_connection(db_path=None):
+    """Borrow a pooled connection; conn.close() returns it to the pool"""
+    path = db_path or DB_PATH
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = ConnectionPool(path)
+    return pool.acquire()
+
+@atexit.register
+def close_connections():
+    """Close all pooled connections"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
+
+logger = logging.getLogger(__name__)
+
+class AsyncLogWriter:
+    """Background thread that writes queued log statements in batches.
+
+    Records are (sql, params) pairs kept in a bounded queue. The writer
+    collects up to batch_size records or whatever arrives within
+    flush_interval seconds, then commits them in one transaction, running
+    consecutive records of the same statement through a single executemany.
+    put() blocks while the queue is full, so a slow disk pushes back on
+    callers instead of growing memory without bound.
+    """
+
+    _STOP = object()
+
+    def __init__(self, db_path=None, maxsize=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize)
+        self.written = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def put(self, sql, params):
+        """Queue a statement, blocking while the queue is full"""
+        record = (sql, params)
+        while True:
+            if not self.alive:
+                # Nobody will drain the queue; write on the caller's thread instead
+                self._write([record])
+                return
+            try:
+                self.queue.put(record, timeout=self.flush_interval)
+                return
+            except queue.Full:
+                pass
+
+    def flush(self):
+        """Block until every queued record has been written"""
+        if self.alive:
+            self.queue.join()
+
+    def stop(self, timeout=None):
+        """Write the remaining records and stop the writer thread"""
+        if self.alive:
+            self.queue.put(self._STOP)
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while record is not self._STOP:
+                batch.append(record)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    record = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self._write(batch)
+                finally:
+                    for _ in batch:
+                        self.queue.task_done()
+            if record is self._STOP:
+                self.queue.task_done()
+                return
+
+    def _write(self, batch):
+        # Any error, opening the database included, costs this batch only;
+        # letting it escape would kill the writer thread
+        conn = None
+        try:
+            conn = get_connection(self.db_path)
+            with conn:
+                for sql, records in groupby(batch, key=lambda record: record[0]):
+                    conn.executemany(sql, [params for _, params in records])
+            self.written += len(batch)
+        except Exception:
+            self.failed += len(batch)
+            logger.exception("Failed to write %d queued log records", len(batch))
+        finally:
+            if conn is not None:
+                conn.close()
+
+_log_writer = None
+_log_writer_lock = threading.Lock()
+
+def enable_async_logging(**kwargs):
+    """Route log writes through a background AsyncLogWriter"""
+    global _log_writer
+    with _log_writer_lock:
+        if _log_writer is None or not _log_writer.alive:
+            _log_writer = AsyncLogWriter(**kwargs)
+        return _log_writer
+
+@atexit.register
+def disable_async_logging():
+    """Flush queued records and go back to synchronous writes"""
+    global _log_writer
+    with _log_writer_lock:
+        writer, _log_writer = _log_writer, None
+    if writer is not None:
+        writer.stop()
+
+def flush_logs():
+    """Wait for queued log records to reach the database"""
+    writer = _log_writer
+    if writer is not None:
+        writer.flush()
+
+def _execute(sql, params):
+    writer = _log_writer
+    if writer is not None:
+        writer.put(sql, params)
+        return None
+    conn = get_connection()
+    with conn:
+        c = conn.execute(sql, params)
+    conn.close()
+    return c.lastrowid
+
+def _add_column(conn, table, column, decl):
+    # Databases created before migrations may already have some columns
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def _create_tables(conn):
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS interactions (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
@@ -17,7 +273,7 @@ def init_db():
             session_id TEXT
         )
     ''')
-    c.execute('''
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS escalations (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
@@ -25,29 +281,175 @@ def init_db():
             suggested_answer TEXT
         )
     ''')
-    conn.commit()
-    conn.close()
 
-def log_interaction(session_id, query, response, score):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT INTO interactions (session_id, user_query, bot_response, match_score) VALUES (?, ?, ?, ?)",
-              (session_id, query, response, score))
-    conn.commit()
-    interaction_id = c.lastrowid
-    conn.close()
-    return interaction_id
+def _add_client_id(conn):
+    _add_column(conn, "interactions", "client_id", "TEXT")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_interactions_client_id ON interactions(client_id)")
+
+def _add_query_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_interactions_timestamp ON interactions(timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_interactions_session_id ON interactions(session_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_interactions_feedback_timestamp ON interactions(feedback, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_escalations_timestamp ON escalations(timestamp)")
+
+def _add_match_columns(conn):
+    _add_column(conn, "interactions", "matched_pattern", "TEXT")
+    _add_column(conn, "interactions", "matched_intent", "TEXT")
+
+def _add_rollups(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_rollup (
+            day TEXT PRIMARY KEY,
+            interactions INTEGER NOT NULL DEFAULT 0,
+            feedback_up INTEGER NOT NULL DEFAULT 0,
+            feedback_down INTEGER NOT NULL DEFAULT 0,
+            escalations INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS score_histogram (
+            day TEXT,
+            bucket INTEGER,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, bucket)
+        )
+    ''')
+    # Highest source id already folded into the rollups
+    conn.execute("CREATE TABLE IF NOT EXISTS rollup_state (source TEXT PRIMARY KEY, last_id INTEGER NOT NULL)")
+    conn.executemany("INSERT OR IGNORE INTO rollup_state (source, last_id) VALUES (?, 0)",
+                     [("interactions",), ("escalations",)])
+    # Feedback arrives after the row was rolled up, so adjust those rows' day in place
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS rollup_feedback AFTER UPDATE OF feedback ON interactions
+        WHEN NEW.id <= (SELECT last_id FROM rollup_state WHERE source = 'interactions')
+        BEGIN
+            UPDATE daily_rollup SET
+                feedback_up = feedback_up + (NEW.feedback IS 1) - (OLD.feedback IS 1),
+                feedback_down = feedback_down + (NEW.feedback IS -1) - (OLD.feedback IS -1)
+            WHERE day = date(NEW.timestamp);
+        END
+    ''')
+
+# Schema version N is reached by applying MIGRATIONS[:N] in order. Only ever
+# append here; released migrations must not change.
+MIGRATIONS = [
+    _create_tables,
+    _add_client_id,
+    _add_query_indexes,
+    _add_match_columns,
+    _add_rollups,
+]
+
+def get_schema_version(conn):
+    """Return the highest migration applied to the database"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+@contextmanager
+def _write_transaction(conn):
+    # IMMEDIATE takes the write lock up front, so read-then-write steps can't race
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+def _applied_version(conn):
+    # A plain read: no write lock, and no schema_version table created
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'").fetchone() is None:
+        return 0
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+def migrate(conn, migrations=MIGRATIONS):
+    """Apply pending migrations in one transaction; returns the new version"""
+    # init_db runs on every Streamlit rerun; an up-to-date database is only read
+    version = _applied_version(conn)
+    if version >= len(migrations):
+        return version
+    with _write_transaction(conn):
+        version = get_schema_version(conn)
+        for number, migration in enumerate(migrations[version:], start=version + 1):
+            migration(conn)
+            conn.execute("INSERT INTO schema_version (version) VALUES (?)", (number,))
+            version = number
+    return version
+
+ROLLUP_INTERACTIONS_SQL = '''
+    INSERT INTO daily_rollup (day, interactions, feedback_up, feedback_down)
+    SELECT date(timestamp), COUNT(*), SUM(feedback IS 1), SUM(feedback IS -1)
+    FROM interactions WHERE id > ? AND id <= ? GROUP BY date(timestamp)
+    ON CONFLICT(day) DO UPDATE SET
+        interactions = interactions + excluded.interactions,
+        feedback_up = feedback_up + excluded.feedback_up,
+        feedback_down = feedback_down + excluded.feedback_down
+'''
+ROLLUP_SCORES_SQL = f'''
+    INSERT INTO score_histogram (day, bucket, count)
+    SELECT date(timestamp), MIN(MAX(CAST(match_score * {SCORE_BUCKETS} AS INTEGER), 0), {SCORE_BUCKETS - 1}) AS b, COUNT(*)
+    FROM interactions WHERE id > ? AND id <= ? AND match_score IS NOT NULL GROUP BY date(timestamp), b
+    ON CONFLICT(day, bucket) DO UPDATE SET count = count + excluded.count
+'''
+ROLLUP_ESCALATIONS_SQL = '''
+    INSERT INTO daily_rollup (day, escalations)
+    SELECT date(timestamp), COUNT(*)
+    FROM escalations WHERE id > ? AND id <= ? GROUP BY date(timestamp)
+    ON CONFLICT(day) DO UPDATE SET escalations = escalations + excluded.escalations
+'''
+
+def refresh_rollups(conn=None):
+    """Fold rows added since the last refresh into the rollup tables.
+
+    Only ids past each source's high-water mark in rollup_state are read,
+    so a refresh costs O(new rows) however large the tables grow. Returns
+    the number of source rows folded in.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+    folded = 0
+    try:
+        with _write_transaction(conn):
+            marks = dict(conn.execute("SELECT source, last_id FROM rollup_state"))
+            for source, statements in (("interactions", (ROLLUP_INTERACTIONS_SQL, ROLLUP_SCORES_SQL)),
+                                       ("escalations", (ROLLUP_ESCALATIONS_SQL,))):
+                top = conn.execute(f"SELECT MAX(id) FROM {source}").fetchone()[0]
+                if top is None or top <= marks[source]:
+                    continue
+                for sql in statements:
+                    conn.execute(sql, (marks[source], top))
+                folded += conn.execute(f"SELECT COUNT(*) FROM {source} WHERE id > ?", (marks[source],)).fetchone()[0]
+                conn.execute("UPDATE rollup_state SET last_id = ? WHERE source = ?", (top, source))
+    finally:
+        if own_conn:
+            conn.close()
+    return folded
+
+def init_db():
+    conn = get_connection()
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
+
+def log_interaction(session_id, query, response, score, pattern=None, intent=None):
+    """Log an interaction; returns its row id, or its client id when logging is async"""
+    client_id = uuid.uuid4().hex
+    row_id = _execute(INSERT_INTERACTION_SQL, (session_id, query, response, score, client_id, pattern, intent))
+    return client_id if row_id is None else row_id
 
 def log_feedback(interaction_id, feedback):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("UPDATE interactions SET feedback = ? WHERE id = ?", (feedback, interaction_id))
-    conn.commit()
-    conn.close()
+    """Record feedback by row id or by the client id from async log_interaction"""
+    if isinstance(interaction_id, str):
+        _execute(UPDATE_FEEDBACK_BY_CLIENT_ID_SQL, (feedback, interaction_id))
+    else:
+        _execute(UPDATE_FEEDBACK_SQL, (feedback, interaction_id))
 
 def log_escalation(query, suggestion=None):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT INTO escalations (user_query, suggested_answer) VALUES (?, ?)", (query, suggestion))
-    conn.commit()
-    conn.close()
+    _execute(INSERT_ESCALATION_SQL, (query, suggestion))
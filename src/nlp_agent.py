@@ -1,32 +1,285 @@
-import spacy
-import streamlit as st
-from sentence_transformers import SentenceTransformer, util
+from collections import OrderedDict, namedtuple
 from difflib import SequenceMatcher
+from functools import lru_cache
+import glob
+import hashlib
+import importlib
+import json
+import logging
+import numpy as np
+import os
 import re
+import threading
+import time
+from vector_index import ANN_CANDIDATES, VECTOR_INDEX, ExactIndex, Int8Matrix, build_vector_index, top_k
+
+SEMANTIC_WEIGHT = 0.6
+FUZZY_WEIGHT = 0.25
+OVERLAP_WEIGHT = 0.15
+
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", 1024))
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", 3600))
+# Share of the semantic signal taken by BM25 (0 = embeddings only)
+LEXICAL_WEIGHT = float(os.environ.get("LEXICAL_WEIGHT", 0.0))
+# "int8" keeps pattern embeddings as int8 codes plus a scale per row
+EMBEDDING_PRECISION = os.environ.get("EMBEDDING_PRECISION", "float32")
+# With int8, best rows re-scored against the float32 matrix (0 = no float32 copy kept)
+RESCORE_CANDIDATES = int(os.environ.get("RESCORE_CANDIDATES", 0))
+# Candidates fuzzy-scored before the pruning bound decides whether more are needed
+RERANK_DEPTH = int(os.environ.get("RERANK_DEPTH", 8))
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+# "torch" (sentence-transformers) or "onnx" (ONNX Runtime, falls back to torch)
+ENCODER_BACKEND = os.environ.get("ENCODER_BACKEND", "torch")
+ONNX_MODEL_DIR = os.environ.get(
+    "ONNX_MODEL_DIR", os.path.join(os.path.dirname(__file__), '../models', MODEL_NAME + '-onnx'))
+ONNX_QUANTIZED = os.environ.get("ONNX_QUANTIZED", "false").lower() in ("1", "true", "yes")
+SPACY_MODEL = os.environ.get("SPACY_MODEL", "en_core_web_md")
+# Lemmas only need the tagger/attribute_ruler/lemmatizer; the parser and NER
+# are never used, so they are not loaded
+SPACY_EXCLUDE = ["parser", "ner", "senter"]
+PREPROCESS_BATCH_SIZE = 64
+# Seconds a failed model load is remembered before it is attempted again
+MODEL_RETRY_INTERVAL = float(os.environ.get("MODEL_RETRY_INTERVAL", 300))
+EMBEDDING_CACHE_DIR = os.environ.get(
+    "EMBEDDING_CACHE_DIR", os.path.join(os.path.dirname(__file__), '../data/cache'))
+
+logger = logging.getLogger(__name__)
+
+class LazyResource:
+    """Thread-safe handle that loads a heavy object on first use.
+
+    Attribute access and calls are forwarded to the loaded object, so the
+    handle can stand in for the model itself. A failed load is remembered:
+    for retry_interval seconds get() re-raises it instead of loading again,
+    so every new PatternIndex does not repeat a slow failing download.
+    """
+
+    def __init__(self, loader, retry_interval=MODEL_RETRY_INTERVAL, timer=time.monotonic):
+        self._loader = loader
+        self._value = None
+        self._lock = threading.Lock()
+        self.retry_interval = retry_interval
+        self.timer = timer
+        self._error = None
+        self._traceback = None
+        self._failed_at = None
+
+    def get(self):
+        """Return the loaded object, loading it once if needed"""
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    error = self._error
+                    if error is not None and self.timer() - self._failed_at < self.retry_interval:
+                        raise error.with_traceback(self._traceback)
+                    try:
+                        self._value = self._loader()
+                    except Exception as e:
+                        self._error, self._traceback, self._failed_at = e, e.__traceback__, self.timer()
+                        raise
+                    self._error = self._traceback = None
+        return self._value
+
+    @property
+    def loaded(self):
+        return self._value is not None
+
+    def __getattr__(self, name):
+        # Introspection (mock, copy, pickle) probes private names; those must
+        # not trigger a model load
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self.get()(*args, **kwargs)
 
-@st.cache_resource
 def load_sentence_transformer():
-    """Loads the SentenceTransformer model and caches it."""
-    return SentenceTransformer('all-MiniLM-L6-v2')
+    """Loads the SentenceTransformer model."""
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(MODEL_NAME)
+
+class OnnxEncoder:
+    """Sentence encoder running an exported transformer with ONNX Runtime.
+
+    Reproduces the sentence-transformers pipeline (tokenize, transformer,
+    mean pooling, optional L2 normalization) without importing torch.
+    model_dir holds model.onnx (and model_quantized.onnx when exported with
+    quantize=True), tokenizer.json and encoder.json, as written by
+    export_onnx_model(). Only onnxruntime and tokenizers are required.
+    """
 
-model = load_sentence_transformer()
+    def __init__(self, model_dir=ONNX_MODEL_DIR, quantized=ONNX_QUANTIZED, threads=None):
+        import onnxruntime
+        from tokenizers import Tokenizer
 
-try:
-    nlp = spacy.load("en_core_web_md")
-except OSError:
-    nlp = spacy.blank("en")
+        path = os.path.join(model_dir, "model_quantized.onnx" if quantized else "model.onnx")
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"No exported ONNX model at {path}")
+        with open(os.path.join(model_dir, "encoder.json"), "r", encoding="utf-8") as f:
+            config = json.load(f)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {node.name for node in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(config["max_length"])
+        self.tokenizer.enable_padding(pad_id=config["pad_id"], pad_token=config["pad_token"])
+        self.model_id = config["model"] + (":onnx-int8" if quantized else ":onnx")
+
+    def encode(self, texts, convert_to_numpy=True, normalize_embeddings=False, batch_size=32, **kwargs):
+        """Embed text(s) like SentenceTransformer.encode; always returns NumPy arrays"""
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feeds = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": mask,
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            hidden = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+            weights = mask[:, :, None].astype(np.float32)
+            batches.append((hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9))
+        dim = self.session.get_outputs()[0].shape[-1]
+        embeddings = np.concatenate(batches) if batches else np.zeros((0, dim if isinstance(dim, int) else 0))
+        embeddings = embeddings.astype(np.float32)
+        if normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings[0] if single else embeddings
+
+def export_onnx_model(model_dir=ONNX_MODEL_DIR, sentence_model=None, quantize=False, opset=17):
+    """Export the sentence transformer to model_dir for OnnxEncoder.
+
+    Needs torch and onnx at export time only. With quantize=True a
+    dynamically int8-quantized copy (model_quantized.onnx) is written too.
+    """
+    import torch
+
+    if sentence_model is None:
+        sentence_model = load_sentence_transformer()
+    transformer = sentence_model[0]
+    tokenizer = transformer.tokenizer
+    os.makedirs(model_dir, exist_ok=True)
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, *inputs):
+            return self.auto_model(**dict(zip(names, inputs))).last_hidden_state
+
+    axes = {name: {0: "batch", 1: "sequence"} for name in names + ["last_hidden_state"]}
+    path = os.path.join(model_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            LastHiddenState(transformer.auto_model.eval()), tuple(sample[name] for name in names), path,
+            input_names=names, output_names=["last_hidden_state"], dynamic_axes=axes,
+            opset_version=opset, dynamo=False,
+        )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(path, os.path.join(model_dir, "model_quantized.onnx"), weight_type=QuantType.QInt8)
+
+    tokenizer.backend_tokenizer.save(os.path.join(model_dir, "tokenizer.json"))
+    config = {
+        "model": getattr(sentence_model, "model_id", MODEL_NAME),
+        "max_length": transformer.max_seq_length,
+        "pad_id": tokenizer.pad_token_id,
+        "pad_token": tokenizer.pad_token,
+    }
+    with open(os.path.join(model_dir, "encoder.json"), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    return model_dir
+
+def load_encoder(backend=None):
+    """Load the sentence encoder for ENCODER_BACKEND, falling back to PyTorch"""
+    backend = backend or ENCODER_BACKEND
+    if backend == "onnx":
+        try:
+            return OnnxEncoder(ONNX_MODEL_DIR, quantized=ONNX_QUANTIZED)
+        except Exception:
+            # onnxruntime and tokenizers raise their own types (InvalidProtobuf,
+            # a bare Exception) for corrupt or missing files
+            logger.warning("ONNX encoder unavailable; falling back to PyTorch", exc_info=True)
+    elif backend != "torch":
+        raise ValueError(f"Unknown encoder backend {backend!r}; choose 'torch' or 'onnx'")
+    return load_sentence_transformer()
+
+def compare_encoders(reference, candidate, texts, repeats=5):
+    """Embedding parity and per-text latency of two encoders on the same texts.
+
+    Returns the smallest cosine similarity between paired embeddings, the
+    largest absolute component difference, and the mean milliseconds per
+    single-text encode for each encoder.
+    """
+    texts = list(texts)
+    expected = _encode(reference, texts)
+    actual = _encode(candidate, texts)
+    result = {
+        "min_cosine": float(np.min(np.sum(expected * actual, axis=1))) if texts else 1.0,
+        "max_abs_diff": float(np.max(np.abs(expected - actual))) if texts else 0.0,
+    }
+    for name, encoder in (("reference_ms", reference), ("candidate_ms", candidate)):
+        started = time.perf_counter()
+        for _ in range(repeats):
+            for text in texts:
+                _encode(encoder, text)
+        result[name] = (time.perf_counter() - started) * 1000 / max(1, repeats * len(texts))
+    return result
+
+def load_spacy_pipeline():
+    """Loads the spaCy pipeline, falling back to a blank English model."""
+    import spacy
+    for name in dict.fromkeys([SPACY_MODEL, "en_core_web_sm"]):
+        try:
+            return spacy.load(name, exclude=SPACY_EXCLUDE)
+        except OSError:
+            continue
+    return spacy.blank("en")
+
+# Models load on first use rather than at import, so importing this module
+# for the lightweight helpers does not pull in torch or spaCy.
+model = LazyResource(load_encoder)
+nlp = LazyResource(load_spacy_pipeline)
+util = LazyResource(lambda: importlib.import_module("sentence_transformers.util"))
+
+def warmup(spacy_pipeline=False):
+    """Load the models up front and run one encode so the first query is fast"""
+    model.encode("warmup", convert_to_numpy=True)
+    if spacy_pipeline:
+        nlp.get()
+
+def _normalize_text(text):
+    text = re.sub(r'[^\w\s]', '', text.lower())
+    return re.sub(r'\s+', ' ', text).strip()
 
 def preprocess(text):
     """Enhanced preprocessing with better text normalization"""
-    text = re.sub(r'[^\w\s]', '', text.lower())
-    text = re.sub(r'\s+', ' ', text).strip()
-    
-    if nlp.lang == "en":
-        doc = nlp(text)
-        return " ".join([token.lemma_ for token in doc if not token.is_stop and token.is_alpha])
-    else:
-        # Fallback for blank model
-        return text
+    return preprocess_batch([text])[0]
+
+def preprocess_batch(texts, batch_size=PREPROCESS_BATCH_SIZE):
+    """Preprocess many texts, streaming them through nlp.pipe in batches"""
+    texts = [_normalize_text(text) for text in texts]
+
+    if "lemmatizer" in nlp.pipe_names:
+        return [
+            " ".join([token.lemma_ for token in doc if not token.is_stop and token.is_alpha])
+            for doc in nlp.pipe(texts, batch_size=batch_size)
+        ]
+    # Fallback for blank model
+    return texts
 
 def fuzzy_match_score(a, b):
     """Calculate fuzzy matching score using SequenceMatcher"""
@@ -47,104 +300,1177 @@ def enhanced_similarity(query, pattern):
     
     # Weighted combination - prioritize semantic similarity but boost fuzzy for typos
     final_score = (
-        semantic_score * 0.6 +  # Primary: semantic understanding
-        fuzzy_score * 0.25 +    # Secondary: typo tolerance
-        overlap_score * 0.15    # Tertiary: keyword overlap
+        semantic_score * SEMANTIC_WEIGHT +  # Primary: semantic understanding
+        fuzzy_score * FUZZY_WEIGHT +        # Secondary: typo tolerance
+        overlap_score * OVERLAP_WEIGHT      # Tertiary: keyword overlap
     )
     
     return final_score
 
+COMMON_TYPOS = {
+    'attendce': 'attendance',
+    'mandtory': 'mandatory',
+    'compulsry': 'compulsory',
+    'registrtion': 'registration',
+    'pyment': 'payment',
+    'instllments': 'installments',
+    'transcrit': 'transcript',
+    'collge': 'college',
+    'univrsity': 'university',
+    'stuent': 'student',
+    'clas': 'class',
+    'cours': 'course',
+    'fee': 'fees',
+    'requirment': 'requirement',
+    'semster': 'semester',
+    'graduat': 'graduation',
+    'advisr': 'advisor',
+    'exempton': 'exemption',
+    'repetition': 'repeat'
+}
+# English word list ("word" or "word count" per line); tokens found in it
+# are never corrected. Set to an empty string to correct towards the FAQ only.
+TYPO_VOCABULARY_PATH = os.environ.get(
+    "TYPO_VOCABULARY_PATH", os.path.join(os.path.dirname(__file__), '../data/words_en.txt'))
+
+_WORD_RE = re.compile(r"[a-z]+")
+_TOKEN_RE = re.compile(r"^(\W*)(.*?)(\W*)$")
+
+def _edit_distance(a, b, max_distance):
+    """Optimal string alignment distance, or max_distance + 1 if it is exceeded"""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+def _deletes(word, max_distance):
+    """Every string reachable from word by deleting up to max_distance characters"""
+    results = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        results |= frontier
+    return results
+
+def load_word_list(path):
+    """Lowercase words of a word list file, or an empty set without one"""
+    if not path:
+        return frozenset()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return frozenset(line.split()[0].lower() for line in f if line.strip())
+    except OSError:
+        logger.warning("Typo word list %s not found; correcting towards the FAQ vocabulary only", path)
+        return frozenset()
+
+english_words = LazyResource(lambda: load_word_list(TYPO_VOCABULARY_PATH))
+
+class TypoCorrector:
+    """Typo correction from a curated map plus a SymSpell-style vocabulary lookup.
+
+    Every vocabulary word is indexed under the strings obtained by deleting
+    up to max_distance characters. An unknown token is corrected by looking
+    up its own deletes, which bounds the work per token by its length rather
+    than the vocabulary size. Short tokens are left alone, and tokens up to
+    7 characters allow a single edit.
+
+    With a dictionary of real words, tokens found in it are never corrected,
+    and vocabulary words missing from it that are one edit from a dictionary
+    word (or too short to tell) are kept as typed but never suggested.
+    """
+
+    def __init__(self, corrections=None, vocabulary=(), dictionary=frozenset(), max_distance=2, min_length=5):
+        self.corrections = dict(corrections or {})
+        self.dictionary = dictionary
+        self.max_distance = max_distance
+        self.min_length = min_length
+        self.counts = {}
+        self.unlisted = set()
+        self._deletes = {}
+        self._lock = threading.Lock()
+        self._lookups = {}
+        self.add_words(vocabulary)
+
+    @classmethod
+    def from_file(cls, path, corrections=COMMON_TYPOS, **kwargs):
+        """Build a corrector from a word list ("word" or "word count" per line)"""
+        corrector = cls(corrections, **kwargs)
+        corrector.load(path)
+        return corrector
+
+    def load(self, path):
+        """Add the words listed in a vocabulary file"""
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                if parts:
+                    count = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 1
+                    self.add_words([parts[0]], count)
+
+    def add_words(self, words, count=1):
+        """Add words to the vocabulary that unknown tokens are corrected towards"""
+        with self._lock:
+            unlisted = []
+            for word in words:
+                word = word.lower()
+                # Known misspellings must never become correction targets
+                if not word.isalpha() or word in self.corrections:
+                    continue
+                if self.dictionary and word not in self.dictionary:
+                    unlisted.append(word)
+                    continue
+                self._add(word, count)
+            # Domain words (names, jargon) are still targets, but not a
+            # word one edit away from a dictionary word (or too short to tell)
+            for word in unlisted:
+                if word in self.counts or (self.allowed_distance(word) and self._closest(word, 1) == word):
+                    self._add(word, count)
+                else:
+                    self.unlisted.add(word)
+            self._lookups.clear()
+
+    def _add(self, word, count):
+        if word not in self.counts:
+            self.unlisted.discard(word)
+            for delete in _deletes(word, self.max_distance):
+                self._deletes.setdefault(delete, set()).add(word)
+        self.counts[word] = self.counts.get(word, 0) + count
+
+    def _closest(self, word, max_distance):
+        best, best_key = word, None
+        for delete in _deletes(word, max_distance):
+            for candidate in self._deletes.get(delete, ()):
+                distance = _edit_distance(word, candidate, max_distance)
+                if distance > max_distance:
+                    continue
+                key = (distance, -self.counts[candidate], candidate)
+                if best_key is None or key < best_key:
+                    best, best_key = candidate, key
+        return best
+
+    def allowed_distance(self, word):
+        if len(word) < self.min_length:
+            return 0
+        return 1 if len(word) < 8 else self.max_distance
+
+    def correct_word(self, word):
+        """Return the correction for a lowercase word, or the word itself"""
+        if word in self.corrections:
+            return self.corrections[word]
+        max_distance = self.allowed_distance(word)
+        if (not max_distance or word in self.counts or word in self.dictionary
+                or word in self.unlisted or not word.isalpha()):
+            return word
+
+        with self._lock:
+            cached = self._lookups.get(word)
+            if cached is not None:
+                return cached
+            best = self._closest(word, max_distance)
+            if len(self._lookups) >= 4096:
+                self._lookups.clear()
+            self._lookups[word] = best
+            return best
+
+    def correct(self, text):
+        """Correct each whitespace-separated token, keeping its surrounding punctuation"""
+        corrected_words = []
+        for word in text.split():
+            word_lower = word.lower()
+            if word_lower in self.corrections:
+                corrected_words.append(self.corrections[word_lower])
+                continue
+            prefix, core, suffix = _TOKEN_RE.match(word).groups()
+            corrected = self.correct_word(core.lower())
+            corrected_words.append(prefix + corrected + suffix if corrected != core.lower() else word)
+        return ' '.join(corrected_words)
+
+def _vocabulary(texts):
+    return [word for text in texts if text for word in _WORD_RE.findall(text.lower())]
+
+def build_typo_corrector(texts=()):
+    """Corrector towards the words of texts, leaving real English words alone"""
+    return TypoCorrector(COMMON_TYPOS, vocabulary=list(COMMON_TYPOS.values()) + _vocabulary(texts),
+                         dictionary=english_words.get())
+
+typo_corrector = LazyResource(build_typo_corrector)
+
 def correct_common_typos(text):
     """Fix common typos and spelling mistakes"""
-    corrections = {
-        'attendce': 'attendance',
-        'mandtory': 'mandatory',
-        'compulsry': 'compulsory',
-        'registrtion': 'registration',
-        'pyment': 'payment',
-        'instllments': 'installments',
-        'transcrit': 'transcript',
-        'collge': 'college',
-        'univrsity': 'university',
-        'stuent': 'student',
-        'clas': 'class',
-        'cours': 'course',
-        'fee': 'fees',
-        'requirment': 'requirement',
-        'semster': 'semester',
-        'graduat': 'graduation',
-        'advisr': 'advisor',
-        'exempton': 'exemption',
-        'repetition': 'repeat'
-    }
-    
-    words = text.split()
-    corrected_words = []
-    
-    for word in words:
-        word_lower = word.lower()
-        corrected = corrections.get(word_lower, word)
-        corrected_words.append(corrected)
-    
-    return ' '.join(corrected_words)
+    return typo_corrector.correct(text)
+
+def normalize_query(text):
+    """Typo-corrected, lowercased text with punctuation stripped"""
+    return _normalize_text(correct_common_typos(text))
 
 def token_overlap(a, b):
     set_a = set(a.lower().split())
     set_b = set(b.lower().split())
     return len(set_a & set_b) / max(1, len(set_a | set_b))
 
+class LRUCache:
+    """Thread-safe LRU cache with an optional time-to-live and hit/miss counters"""
+
+    def __init__(self, maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if not self.ttl or self.timer() - stored_at < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """Store value under key, evicting the least recently used entry if full"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, self.timer())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Drop every entry and reset the counters"""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Return size and hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+# Query embeddings only depend on the encoder, so they are shared by every index
+query_embedding_cache = LRUCache()
+
+def _encode(encoder, texts):
+    """Encode text(s) into L2-normalized float32 embeddings"""
+    embeddings = encoder.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+    return np.asarray(embeddings, dtype=np.float32)
+
+@lru_cache(maxsize=8)
+def _embed_patterns(encoder, patterns):
+    """Encode a tuple of patterns once and share the matrix between indexes"""
+    if not patterns:
+        return np.zeros((0, 0), dtype=np.float32)
+    return _encode(encoder, list(patterns))
+
+def pattern_content_hash(patterns):
+    """Stable hash of the pattern list used to validate cached embeddings"""
+    payload = json.dumps(list(patterns), ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+class EmbeddingStore:
+    """On-disk pattern embedding matrix (.npy) plus a JSON manifest.
+
+    The manifest records the model id, the pattern content hash and the
+    embedding dimension. A matching matrix is opened with mmap_mode='r', so
+    worker processes share one page-cached copy instead of re-encoding.
+    Each matrix file is named after its model and content hash, so
+    replacing the manifest publishes a new matrix in one step and a reader
+    never pairs a manifest with another version's matrix.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest_path = path + ".json"
+
+    def matrix_path(self, model_id, content_hash):
+        """File holding the matrix of one model and pattern set"""
+        key = hashlib.sha256(f"{model_id}\0{content_hash}".encode("utf-8")).hexdigest()[:16]
+        return f"{self.path}.{key}.npy"
+
+    def load(self, model_id, content_hash):
+        """Return the memory-mapped matrix, or None if missing or stale"""
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("model") != model_id or manifest.get("content_hash") != content_hash:
+                return None
+            embeddings = np.load(self.matrix_path(model_id, content_hash), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        if embeddings.dtype != np.float32 or embeddings.shape != (manifest.get("count"), manifest.get("dim")):
+            return None
+        return embeddings
+
+    def save(self, embeddings, model_id, content_hash):
+        """Write the matrix under its own name, then publish it by replacing the manifest"""
+        matrix_path = self.matrix_path(model_id, content_hash)
+        os.makedirs(os.path.dirname(matrix_path) or ".", exist_ok=True)
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        manifest = {
+            "model": model_id,
+            "content_hash": content_hash,
+            "count": int(embeddings.shape[0]),
+            "dim": int(embeddings.shape[1]),
+        }
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(matrix_path + suffix, "wb") as f:
+            np.save(f, embeddings)
+        os.replace(matrix_path + suffix, matrix_path)
+        with open(self.manifest_path + suffix, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(self.manifest_path + suffix, self.manifest_path)
+        # Superseded matrices; a reader that still opens one just misses
+        for stale in glob.glob(glob.escape(self.path) + ".*.npy"):
+            if stale != matrix_path:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+class HybridScorer:
+    """Batch version of enhanced_similarity for one query against many patterns.
+
+    Lowercased patterns, their token sets (as an inverted index) and a
+    SequenceMatcher per pattern are prepared once, so scoring a query only
+    does the per-query work.
+    """
+
+    def __init__(self, patterns):
+        self.lowered = [pattern.lower() for pattern in patterns]
+        token_sets = [set(pattern.split()) for pattern in self.lowered]
+        self.token_counts = np.array([len(tokens) for tokens in token_sets], dtype=np.float64)
+
+        postings = {}
+        for i, tokens in enumerate(token_sets):
+            for token in tokens:
+                postings.setdefault(token, []).append(i)
+        self.postings = {token: np.array(ids, dtype=np.int32) for token, ids in postings.items()}
+
+        # SequenceMatcher caches its analysis of the second sequence, so each
+        # pattern is analysed once and only the query is swapped in per call.
+        self._matchers = [SequenceMatcher(None, "", pattern) for pattern in self.lowered]
+        self._lock = threading.Lock()
+
+        # Character counts per pattern, for a vectorized quick_ratio bound
+        self._chars = {c: i for i, c in enumerate(sorted(set("".join(self.lowered))))}
+        self.char_counts = np.zeros((len(self.lowered), len(self._chars)), dtype=np.int32)
+        for i, pattern in enumerate(self.lowered):
+            for c in pattern:
+                self.char_counts[i, self._chars[c]] += 1
+        self.lengths = np.array([len(pattern) for pattern in self.lowered], dtype=np.float64)
+
+    def overlap_scores(self, query, rows=None):
+        """Jaccard token overlap of the query against every pattern (or just rows)"""
+        query_tokens = set(query.lower().split())
+        intersection = np.zeros(len(self.lowered), dtype=np.float64)
+        for token in query_tokens:
+            ids = self.postings.get(token)
+            if ids is not None:
+                intersection[ids] += 1
+        token_counts = self.token_counts
+        if rows is not None:
+            intersection = intersection[rows]
+            token_counts = token_counts[rows]
+        union = len(query_tokens) + token_counts - intersection
+        return intersection / np.maximum(1, union)
+
+    def fuzzy_scores(self, query, rows=None):
+        """SequenceMatcher ratio of the query against every pattern (or just rows)"""
+        query = query.lower()
+        if rows is None:
+            rows = range(len(self._matchers))
+        scores = np.empty(len(rows), dtype=np.float64)
+        with self._lock:
+            for i, row in enumerate(rows):
+                matcher = self._matchers[row]
+                matcher.set_seq1(query)
+                scores[i] = matcher.ratio()
+        return scores
+
+    def fuzzy_bounds(self, query, rows=None):
+        """Upper bound on fuzzy_scores from shared character counts (SequenceMatcher.quick_ratio)"""
+        query = query.lower()
+        counts = self.char_counts if rows is None else self.char_counts[rows]
+        lengths = self.lengths if rows is None else self.lengths[rows]
+        query_counts = np.zeros(len(self._chars), dtype=np.int32)
+        for c in query:
+            i = self._chars.get(c)
+            if i is not None:
+                query_counts[i] += 1
+        matches = np.minimum(counts, query_counts).sum(axis=1)
+        total = len(query) + lengths
+        return np.where(total > 0, 2.0 * matches / np.maximum(total, 1), 1.0)
+
+    @staticmethod
+    def combine(semantic, fuzzy, overlap):
+        """Weighted sum of semantic, fuzzy and overlap score vectors"""
+        return (
+            np.asarray(semantic, dtype=np.float64) * SEMANTIC_WEIGHT +
+            fuzzy * FUZZY_WEIGHT +
+            overlap * OVERLAP_WEIGHT
+        )
+
+    def score(self, query, semantic, rows=None):
+        """Combine a semantic score vector with fuzzy and overlap scores.
+
+        With rows given, semantic holds the scores of those pattern rows only
+        and the result is aligned with rows.
+        """
+        return self.combine(semantic, self.fuzzy_scores(query, rows), self.overlap_scores(query, rows))
+
+def _kth_group_score(scores, groups, k):
+    """k-th highest per-group maximum of scores, or -inf with fewer than k groups"""
+    if not len(scores):
+        return -np.inf
+    maxes = np.full(int(groups.max()) + 1, -np.inf)
+    np.maximum.at(maxes, groups, scores)
+    maxes = maxes[np.isfinite(maxes)]
+    if len(maxes) < k:
+        return -np.inf
+    return float(np.partition(maxes, len(maxes) - k)[len(maxes) - k])
+
+def _descending(scores):
+    """Indices of the finite scores, best first (earlier index wins ties)"""
+    finite = np.flatnonzero(np.isfinite(scores))
+    return finite[np.argsort(-scores[finite], kind="stable")]
+
+class StageStats:
+    """Cumulative per-stage timings of the retrieve-then-rerank matcher"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def add(self, retrieve, rerank, reranked):
+        with self._lock:
+            self.queries += 1
+            self.retrieve_seconds += retrieve
+            self.rerank_seconds += rerank
+            self.reranked += reranked
+            self.last = {"retrieve_ms": retrieve * 1000, "rerank_ms": rerank * 1000, "reranked": reranked}
+
+    def clear(self):
+        with self._lock:
+            self.queries = 0
+            self.retrieve_seconds = 0.0
+            self.rerank_seconds = 0.0
+            self.reranked = 0
+            self.last = None
+
+    def stats(self):
+        """Mean milliseconds per stage and patterns fuzzy-scored per query"""
+        with self._lock:
+            n = self.queries or 1
+            return {
+                "queries": self.queries,
+                "retrieve_ms": self.retrieve_seconds * 1000 / n,
+                "rerank_ms": self.rerank_seconds * 1000 / n,
+                "reranked": self.reranked / n,
+                "last": self.last,
+            }
+
+_TERM_RE = re.compile(r"[a-z0-9]+")
+
+def lexical_terms(text):
+    """Lowercased word and number tokens used by the BM25 index"""
+    return _TERM_RE.findall(text.lower())
+
+class BM25Index:
+    """Okapi BM25 over token lists, stored as an inverted index.
+
+    Each term's postings hold its document rows and their precomputed
+    BM25 weights, so scoring a query only touches the postings of the
+    query's own terms. Scores are divided by the score of a document of
+    average length containing each query term once, and capped at 1, so
+    they sit in [0, 1] next to cosine similarity. Query terms missing from
+    the index still count in that ideal, so unmatched words lower the
+    score.
+    """
+
+    def __init__(self, documents, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        documents = [list(doc) for doc in documents]
+        self.size = len(documents)
+        lengths = np.array([len(doc) for doc in documents], dtype=np.float64)
+        average = lengths.mean() if self.size and lengths.mean() > 0 else 1.0
+        norms = 1 - b + b * lengths / average
+
+        postings = {}
+        for row, doc in enumerate(documents):
+            counts = {}
+            for term in doc:
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(row)
+                postings[term][1].append(tf)
+
+        self.idf = {}
+        self.postings = {}
+        for term, (rows, tfs) in postings.items():
+            rows = np.array(rows, dtype=np.int32)
+            tfs = np.array(tfs, dtype=np.float64)
+            idf = self._idf(len(rows))
+            self.idf[term] = idf
+            self.postings[term] = (rows, idf * tfs * (k1 + 1) / (tfs + k1 * norms[rows]))
+
+    def _idf(self, df):
+        return float(np.log(1 + (self.size - df + 0.5) / (df + 0.5)))
+
+    def __len__(self):
+        return self.size
+
+    def raw_scores(self, query):
+        """Unnormalized BM25 score of the query against every document"""
+        scores = np.zeros(self.size, dtype=np.float64)
+        for term in set(lexical_terms(query)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                scores[posting[0]] += posting[1]
+        return scores
+
+    def scores(self, query, rows=None):
+        """BM25 score of the query against every document (or just rows), scaled to [0, 1]"""
+        terms = set(lexical_terms(query))
+        ideal = sum(self.idf.get(term, self._idf(0)) for term in terms)
+        scores = self.raw_scores(query)
+        if ideal > 0:
+            scores = np.minimum(scores / ideal, 1.0)
+        return scores if rows is None else scores[rows]
+
+IntentMatch = namedtuple("IntentMatch", ["intent_id", "name", "score", "pattern"])
+
+class IntentTable:
+    """FAQ intents stored once, plus the intent id of every pattern row.
+
+    pattern_intents is an int32 array aligned with the pattern embedding
+    matrix, so a per-pattern score vector reduces to per-intent scores in
+    one vectorized step. Two intents sharing a pattern keep separate rows
+    instead of overwriting each other.
+    """
+
+    AGGREGATES = ("max", "mean")
+
+    def __init__(self, names, responses, pattern_intents):
+        self.names = list(names)
+        self.responses = list(responses)
+        self.pattern_intents = np.asarray(pattern_intents, dtype=np.int32)
+        self.counts = np.bincount(self.pattern_intents, minlength=len(self.names))
+        # Rows grouped by intent, for segment-wise reductions
+        self._order = np.argsort(self.pattern_intents, kind="stable")
+        self._present = np.flatnonzero(self.counts)
+        self._starts = np.concatenate(([0], np.cumsum(self.counts[self._present])[:-1])).astype(np.intp)
+
+    @classmethod
+    def from_faq(cls, faq):
+        """Return (patterns, table) for the FAQ items in faq.json, one intent per item"""
+        patterns = []
+        names = []
+        responses = []
+        pattern_intents = []
+        for intent_id, item in enumerate(faq):
+            names.append(item.get("intent"))
+            responses.append(item.get("response", ""))
+            for pattern in item.get("patterns", []):
+                patterns.append(pattern)
+                pattern_intents.append(intent_id)
+        return patterns, cls(names, responses, pattern_intents)
+
+    @classmethod
+    def from_mappings(cls, patterns, responses=None, intents=None):
+        """Build a table from pattern->response and pattern->intent name dicts.
+
+        Patterns are grouped by intent name when known, else by response.
+        """
+        responses = responses or {}
+        intents = intents or {}
+        ids = {}
+        names = []
+        intent_responses = []
+        pattern_intents = []
+        for pattern in patterns:
+            response = responses.get(pattern)
+            name = intents.get(pattern)
+            key = ("intent", name) if name is not None else ("response", response)
+            if key not in ids:
+                ids[key] = len(names)
+                names.append(name)
+                intent_responses.append(response)
+            pattern_intents.append(ids[key])
+        return cls(names, intent_responses, pattern_intents)
+
+    def __len__(self):
+        return len(self.names)
+
+    def aggregate(self, scores, how="max"):
+        """Per-intent score: max or mean over the intent's pattern scores.
+
+        Intents without patterns score -inf.
+        """
+        if how not in self.AGGREGATES:
+            raise ValueError(f"Unknown aggregate {how!r}; choose from {self.AGGREGATES}")
+        scores = np.asarray(scores, dtype=np.float64)
+        out = np.full(len(self.names), -np.inf)
+        if not len(scores):
+            return out
+        if how == "max":
+            out[self._present] = np.maximum.reduceat(scores[self._order], self._starts)
+        else:
+            sums = np.bincount(self.pattern_intents, weights=scores, minlength=len(self.names))
+            out[self._present] = sums[self._present] / self.counts[self._present]
+        return out
+
+    def best_rows(self, scores):
+        """Highest-scoring pattern row of each intent (-1 for intents without patterns)"""
+        rows = np.full(len(self.names), -1, dtype=np.intp)
+        if len(scores):
+            # Sort by intent, then score descending (earlier row wins ties)
+            order = np.lexsort((np.arange(len(scores)), -np.asarray(scores), self.pattern_intents))
+            rows[self._present] = order[self._starts]
+        return rows
+
+class PatternIndex:
+    """Precomputed embedding matrix over FAQ patterns.
+
+    Patterns are encoded once (on first use) into a normalized float32
+    matrix, so scoring a query costs one query encode plus one
+    matrix-vector product instead of a forward pass per pattern.
+
+    With an approximate vector index (vector_index="ivf") only the
+    `candidates` nearest patterns are looked up and hybrid-scored; every
+    other pattern scores 0. The default "exact" backend scores them all.
+
+    Ranking runs in two stages. Retrieval computes the cheap vectorized
+    signals (semantic and token overlap) plus an upper bound on each
+    pattern's final score. Reranking then computes the SequenceMatcher
+    score only for the rerank_depth best-bounded patterns, and for any
+    others whose bound still reaches the k-th best score found. Patterns
+    that cannot make the top k are never fuzzy-matched, and the result is
+    the same as scoring every pattern.
+
+    A BM25 index over each pattern and its intent's response is built
+    alongside. lexical_weight blends it into the semantic signal, and if
+    the embedding model cannot be loaded the index falls back to BM25
+    alone, so the chatbot keeps answering in a degraded, lexical mode.
+
+    With precision="int8" the semantic stage scores against an Int8Matrix
+    (a quarter of the float32 size) and the float32 matrix is released.
+    rescore > 0 keeps it instead, and the top `rescore` rows by int8 score
+    are re-scored in float32.
+    """
+
+    def __init__(self, patterns, responses=None, encoder=None,
+                 cache_size=QUERY_CACHE_SIZE, cache_ttl=QUERY_CACHE_TTL, store=None,
+                 intents=None, table=None, vector_index=None, candidates=ANN_CANDIDATES,
+                 vector_index_options=None, rerank_depth=RERANK_DEPTH, lexical_weight=LEXICAL_WEIGHT,
+                 precision=EMBEDDING_PRECISION, rescore=RESCORE_CANDIDATES):
+        self.patterns = list(patterns)
+        self.table = table if table is not None else IntentTable.from_mappings(self.patterns, responses, intents)
+        # First row of each distinct pattern text
+        self._rows = {}
+        for i, pattern in enumerate(self.patterns):
+            self._rows.setdefault(pattern, i)
+        self._text_ids = np.array([self._rows[pattern] for pattern in self.patterns], dtype=np.intp)
+        self.encoder = encoder
+        self.store = store
+        self.scorer = HybridScorer(self.patterns)
+        self.lexical = BM25Index(
+            lexical_terms(pattern) + lexical_terms(self.table.responses[intent_id] or "")
+            for pattern, intent_id in zip(self.patterns, self.table.pattern_intents)
+        )
+        self.lexical_weight = lexical_weight
+        self._semantic = None
+        self.vector_index_kind = vector_index or VECTOR_INDEX
+        self.vector_index_options = vector_index_options or {}
+        self.candidates = candidates
+        self.rerank_depth = rerank_depth
+        self.stage_stats = StageStats()
+        if precision not in ("float32", "int8"):
+            raise ValueError(f"Unknown embedding precision {precision!r}; choose 'float32' or 'int8'")
+        self.precision = precision
+        self.rescore = rescore
+        self._embeddings = None
+        self._quantized = None
+        self._vector_index = None
+        self._preprocessed = None
+        self._lock = threading.Lock()
+        # Match results are tied to this index, so rebuilding it invalidates them
+        self.result_cache = LRUCache(cache_size, cache_ttl)
+        # Each index corrects towards its own FAQ, so reloads and throwaway
+        # indexes never change another index's corrections or exact keys
+        self.typo_corrector = build_typo_corrector(self.patterns + [r for r in self.table.responses if r])
+        # Literal pattern text (quick actions, option buttons) is answered
+        # from this hash index without touching the model
+        self.exact_index = {}
+        for i, pattern in enumerate(self.patterns):
+            self.exact_index.setdefault(_normalize_text(self.correct(pattern)), i)
+        self.exact_hits = 0
+
+    @classmethod
+    def from_faq(cls, faq, encoder=None, **kwargs):
+        """Build an index from the list of FAQ items in faq.json"""
+        patterns, table = IntentTable.from_faq(faq)
+        return cls(patterns, encoder=encoder, table=table, **kwargs)
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def _get_encoder(self):
+        return self.encoder if self.encoder is not None else model
+
+    def semantic_available(self):
+        """Whether the embedding model loads; without it matching is BM25 only.
+
+        The encoder handle is asked on every call: it remembers a failed
+        load and retries it once MODEL_RETRY_INTERVAL has passed, so a
+        long-lived index switches back to semantic scoring on recovery.
+        """
+        encoder = self._get_encoder()
+        try:
+            if isinstance(encoder, LazyResource):
+                encoder.get()
+        except Exception:
+            if self._semantic is not False:
+                logger.warning("Embedding model unavailable; falling back to lexical matching", exc_info=True)
+            self._semantic = False
+            return False
+        if self._semantic is False:
+            logger.info("Embedding model loaded; semantic matching restored")
+            # Results cached while matching was BM25 only are stale now
+            self.result_cache.clear()
+        self._semantic = True
+        return True
+
+    def _model_id(self):
+        if self.encoder is None:
+            # Cached embeddings from another backend are not reused
+            encoder = model.get() if isinstance(model, LazyResource) else model
+            return encoder.model_id if isinstance(encoder, OnnxEncoder) else MODEL_NAME
+        return getattr(self.encoder, "model_id", None)
+
+    @property
+    def embeddings(self):
+        """Normalized (n_patterns, dim) float32 pattern embedding matrix.
+
+        Once an int8 index has released its float32 matrix, this returns
+        the dequantized codes (re-quantizing them gives the same codes).
+        """
+        embeddings = self._embeddings
+        if embeddings is not None:
+            return embeddings
+        with self._lock:
+            if self._embeddings is None:
+                if self._quantized is not None:
+                    return self._quantized.dequantize()
+                self._embeddings = self._load_embeddings()
+            return self._embeddings
+
+    @property
+    def matrix(self):
+        """Matrix the semantic stage scores against: the float32 embeddings or an Int8Matrix"""
+        if self.precision == "float32":
+            return self.embeddings
+        if self._quantized is None:
+            embeddings = self.embeddings
+            with self._lock:
+                if self._quantized is None:
+                    self._quantized = Int8Matrix.from_float(embeddings)
+                    if not self.rescore:
+                        self._embeddings = None
+        return self._quantized
+
+    @property
+    def prepared(self):
+        """Whether the scoring matrix and vector index have been built"""
+        built = self._quantized is not None if self.precision == "int8" else self._embeddings is not None
+        return built and (self.vector_index_kind == ExactIndex.name or self._vector_index is not None)
+
+    def prepare(self):
+        """Build the scoring matrix and vector index now rather than on the first query"""
+        self.matrix
+        if self.vector_index_kind != ExactIndex.name:
+            self.vector_index
+
+    @property
+    def vector_index(self):
+        """Search structure over the embeddings, built on first use.
+
+        With int8 precision it is built from the quantized matrix, so its
+        lists hold int8 codes rather than another float32 copy.
+        """
+        if self._vector_index is None:
+            matrix = self.matrix
+            with self._lock:
+                if self._vector_index is None:
+                    self._vector_index = build_vector_index(
+                        matrix, self.vector_index_kind, **self.vector_index_options)
+        return self._vector_index
+
+    def _encode_patterns(self):
+        if self.precision == "int8" and self.patterns:
+            # The float32 matrix is only needed until it is quantized, so it
+            # is not pinned in the shared _embed_patterns cache
+            return _encode(self._get_encoder(), self.patterns)
+        return _embed_patterns(self._get_encoder(), tuple(self.patterns))
+
+    def _load_embeddings(self):
+        model_id = self._model_id()
+        if self.store is None or model_id is None or not self.patterns:
+            return self._encode_patterns()
+
+        content_hash = pattern_content_hash(self.patterns)
+        embeddings = self.store.load(model_id, content_hash)
+        if embeddings is None:
+            embeddings = self._encode_patterns()
+            try:
+                self.store.save(embeddings, model_id, content_hash)
+            except OSError:
+                # A read-only cache directory only costs us the warm start
+                pass
+        return embeddings
+
+    def reuse_embeddings(self, previous):
+        """Fill this index's matrix from previous, encoding only patterns it lacks.
+
+        Used when the FAQ is edited: unchanged patterns keep their rows, so
+        the cost is proportional to the edit. Returns the number of patterns
+        encoded, or None when previous has no usable embeddings (different
+        encoder, never encoded, or only int8 codes while this index needs
+        float32), in which case loading stays lazy.
+        """
+        old = previous._embeddings
+        # Rows dequantized from int8 codes are only good enough to quantize again
+        lossy = old is None
+        if lossy and (previous._quantized is None or self.precision != "int8" or self.rescore):
+            return None
+        if previous._get_encoder() is not self._get_encoder():
+            return None
+        if lossy:
+            old = previous.embeddings
+        rows = {pattern: i for i, pattern in enumerate(previous.patterns)}
+        missing = [pattern for pattern in dict.fromkeys(self.patterns) if pattern not in rows]
+        if missing:
+            added = _encode(self._get_encoder(), missing)
+            dim = added.shape[1]
+        else:
+            added = None
+            dim = old.shape[1] if old.ndim == 2 else 0
+        added_rows = {pattern: i for i, pattern in enumerate(missing)}
+
+        embeddings = np.empty((len(self.patterns), dim), dtype=np.float32)
+        for i, pattern in enumerate(self.patterns):
+            if pattern in rows:
+                embeddings[i] = old[rows[pattern]]
+            else:
+                embeddings[i] = added[added_rows[pattern]]
+
+        model_id = self._model_id()
+        # The store holds float32 embeddings, never an int8 approximation
+        if not lossy and self.store is not None and model_id is not None and len(self.patterns):
+            try:
+                self.store.save(embeddings, model_id, pattern_content_hash(self.patterns))
+            except OSError:
+                pass
+        with self._lock:
+            self._embeddings = embeddings
+        return len(missing)
+
+    @property
+    def preprocessed(self):
+        """Lemmatized, stopword-free pattern text, computed once in one batch"""
+        if self._preprocessed is None:
+            with self._lock:
+                if self._preprocessed is None:
+                    self._preprocessed = preprocess_batch(self.patterns)
+        return self._preprocessed
+
+    @property
+    def responses(self):
+        """pattern -> response dict, built on demand from the intent table"""
+        return {pattern: self.response_for(pattern) for pattern in self._rows}
+
+    def intent_id_for(self, pattern):
+        """Intent id of a pattern's first row, or None for unknown text"""
+        row = self._rows.get(pattern)
+        return None if row is None else int(self.table.pattern_intents[row])
+
+    def response_for(self, pattern):
+        """Return the FAQ response for a matched pattern"""
+        intent_id = self.intent_id_for(pattern)
+        return None if intent_id is None else self.table.responses[intent_id]
+
+    def intent_for(self, pattern):
+        """Return the FAQ intent name for a matched pattern"""
+        intent_id = self.intent_id_for(pattern)
+        return None if intent_id is None else self.table.names[intent_id]
+
+    def encode_query(self, query):
+        """Encode a single query into a normalized float32 vector"""
+        encoder = self._get_encoder()
+        key = (encoder, query)
+        embedding = query_embedding_cache.get(key)
+        if embedding is None:
+            embedding = _encode(encoder, query)
+            embedding.setflags(write=False)
+            query_embedding_cache.put(key, embedding)
+        return embedding
+
+    def cache_stats(self):
+        """Hit/miss counters for the result and query embedding caches"""
+        return {
+            "exact": {"hits": self.exact_hits, "size": len(self.exact_index)},
+            "results": self.result_cache.stats(),
+            "embeddings": query_embedding_cache.stats(),
+        }
+
+    def correct(self, user_query):
+        """Query with common typos fixed, then corrected towards this FAQ's words"""
+        return self.typo_corrector.correct(correct_common_typos(user_query))
+
+    def exact_match(self, query):
+        """Index of the pattern whose normalized text equals the query's, or None"""
+        idx = self.exact_index.get(_normalize_text(query))
+        if idx is not None:
+            self.exact_hits += 1
+        return idx
+
+    def semantic_scores(self, query):
+        """Cosine similarity of the query against every pattern, blended with BM25.
+
+        Without the embedding model this is the BM25 score alone.
+        """
+        if not self.patterns:
+            return np.zeros(0, dtype=np.float32)
+        if not self.semantic_available():
+            return self.lexical.scores(query)
+        return self._blend(query, self._dense_scores(self.encode_query(query)))
+
+    def _dense_scores(self, query_embedding):
+        semantic = self.matrix @ query_embedding
+        if self.precision == "int8" and self.rescore:
+            rows = top_k(semantic, self.rescore)
+            semantic[rows] = self.embeddings[rows] @ query_embedding
+        return semantic
+
+    def _blend(self, query, semantic, rows=None):
+        if not self.lexical_weight:
+            return semantic
+        return (1 - self.lexical_weight) * semantic + self.lexical_weight * self.lexical.scores(query, rows)
+
+    def _candidates(self, query):
+        """Rows to score (None = all) and their semantic signal"""
+        if not self.semantic_available():
+            return None, self.lexical.scores(query)
+        query_embedding = self.encode_query(query)
+        if self.vector_index_kind == ExactIndex.name:
+            return None, self._blend(query, self._dense_scores(query_embedding))
+        rows, semantic = self.vector_index.search(query_embedding, self.candidates)
+        return rows, self._blend(query, semantic, rows)
+
+    def hybrid_scores(self, query):
+        """Weighted semantic, fuzzy and overlap score against every pattern"""
+        semantic = self.semantic_scores(query)
+        return self.scorer.score(query, semantic), semantic
+
+    def scores(self, user_query):
+        """Score of the typo-corrected query against every pattern"""
+        return self._scores(self.correct(user_query))
+
+    def _scores(self, query):
+        if not self.patterns:
+            return np.zeros(0)
+        rows, semantic = self._candidates(query)
+        final = np.maximum(np.maximum(self.scorer.score(query, semantic, rows), semantic), 0)
+        if rows is None:
+            return final
+        scores = np.zeros(len(self.patterns))
+        scores[rows] = final
+        return scores
+
+    def _retrieve(self, query):
+        """Stage 1: candidate rows (None = all) with semantic, overlap and score-bound vectors"""
+        rows, semantic = self._candidates(query)
+        semantic = np.asarray(semantic, dtype=np.float64)
+        overlap = self.scorer.overlap_scores(query, rows)
+        bound = HybridScorer.combine(semantic, self.scorer.fuzzy_bounds(query, rows), overlap)
+        # Final scores are max(hybrid, semantic, 0), so bound that too
+        return rows, semantic, overlap, np.maximum(np.maximum(bound, semantic), 0)
+
+    def _staged_scores(self, query, groups, k, min_score=0.0):
+        """Scores exact for every row that can reach the top k groups, -inf elsewhere.
+
+        groups maps each pattern row to the unit being ranked (pattern text
+        or intent); the top k groups and their scores match _scores().
+        """
+        started = time.perf_counter()
+        rows, semantic, overlap, bound = self._retrieve(query)
+        retrieved = time.perf_counter()
+
+        candidate_groups = groups if rows is None else groups[rows]
+        scores = np.full(len(bound), -np.inf)
+        order = np.argsort(-bound, kind="stable")
+
+        def rerank(idx):
+            fuzzy = self.scorer.fuzzy_scores(query, idx if rows is None else rows[idx])
+            hybrid = HybridScorer.combine(semantic[idx], fuzzy, overlap[idx])
+            scores[idx] = np.maximum(np.maximum(hybrid, semantic[idx]), 0)
+
+        first = order[:self.rerank_depth]
+        rerank(first)
+        # Unscored rows can only matter if their bound reaches the k-th best
+        # group score so far; scoring them can only raise that threshold.
+        threshold = max(min_score, _kth_group_score(scores[first], candidate_groups[first], k))
+        rest = order[self.rerank_depth:]
+        rest = rest[bound[rest] >= threshold - 1e-9]
+        rerank(rest)
+        self.stage_stats.add(retrieved - started, time.perf_counter() - retrieved, len(first) + len(rest))
+
+        if rows is None:
+            return scores
+        out = np.full(len(self.patterns), -np.inf)
+        out[rows] = scores
+        return out
+
+    @staticmethod
+    def _cache_key(query):
+        """Normalized (typo-corrected, lowercased) form of the query"""
+        return " ".join(query.lower().split())
+
+    def rank(self, user_query, k=3, min_score=0.0):
+        """Return up to k (pattern, score) pairs, best first, from one scoring pass.
+
+        A query that normalizes to a pattern's text returns just that pattern
+        with a score of 1.0.
+        """
+        if not self.patterns or k <= 0:
+            return []
+        query = self.correct(user_query)
+        exact = self.exact_match(query)
+        if exact is not None:
+            return [(self.patterns[exact], 1.0)]
+        key = ("rank", self._cache_key(query), k, min_score)
+        ranked = self.result_cache.get(key)
+        if ranked is None:
+            ranked = self._rank(query, k, min_score)
+            self.result_cache.put(key, ranked)
+        return list(ranked)
+
+    def _rank(self, query, k, min_score):
+        scores = self._staged_scores(query, self._text_ids, k, min_score)
+        ranked = []
+        seen = set()
+        for i in _descending(scores):
+            score = float(scores[i])
+            if score < min_score or len(ranked) == k:
+                break
+            pattern = self.patterns[i]
+            if pattern not in seen:
+                seen.add(pattern)
+                ranked.append((pattern, score))
+        return ranked
+
+    def rank_intents(self, user_query, k=3, min_score=0.0, aggregate="max"):
+        """Return up to k IntentMatch tuples, best first, one per intent.
+
+        Pattern scores are reduced per intent with aggregate ("max" or
+        "mean"); each match carries the intent's best-scoring pattern.
+        """
+        if not self.patterns or k <= 0:
+            return []
+        query = self.correct(user_query)
+        exact = self.exact_match(query)
+        if exact is not None:
+            intent_id = int(self.table.pattern_intents[exact])
+            return [IntentMatch(intent_id, self.table.names[intent_id], 1.0, self.patterns[exact])]
+        key = ("intents", self._cache_key(query), k, min_score, aggregate)
+        ranked = self.result_cache.get(key)
+        if ranked is None:
+            if aggregate == "max":
+                scores = self._staged_scores(query, self.table.pattern_intents, k, min_score)
+            else:
+                # A mean needs every pattern score of an intent
+                scores = self._scores(query)
+            intent_scores = self.table.aggregate(scores, aggregate)
+            rows = self.table.best_rows(scores)
+            ranked = []
+            for intent_id in np.argsort(-intent_scores, kind="stable")[:k]:
+                score = float(intent_scores[intent_id])
+                if score < min_score:
+                    break
+                ranked.append(IntentMatch(int(intent_id), self.table.names[intent_id], score,
+                                          self.patterns[rows[intent_id]]))
+            self.result_cache.put(key, ranked)
+        return list(ranked)
+
+    def best_match(self, user_query, threshold=0.45):
+        """Return (pattern, score) for the best match, or (None, score) below threshold"""
+        if not self.patterns:
+            return None, 0
+        query = self.correct(user_query)
+        exact = self.exact_match(query)
+        if exact is not None:
+            return self.patterns[exact], 1.0
+        key = ("best", self._cache_key(query))
+        best = self.result_cache.get(key)
+        if best is None:
+            scores = self._staged_scores(query, self._text_ids, 1)
+            best_idx = int(np.argmax(scores))
+            best = (best_idx, float(scores[best_idx]))
+            self.result_cache.put(key, best)
+        best_idx, best_score = best
+        if best_score >= threshold:
+            return self.patterns[best_idx], best_score
+        return None, best_score
+
 def get_best_match(user_query, questions, threshold=0.45):
     """Enhanced matching with typo correction and multiple scoring methods"""
-    corrected_query = correct_common_typos(user_query)
-    
-    best_score = 0
-    best_question = None
-    best_idx = -1
-    
-    queries_to_try = [user_query, corrected_query] if corrected_query != user_query else [user_query]
-    
-    for query in queries_to_try:
-        for i, question in enumerate(questions):
-            score = enhanced_similarity(query, question)
-            if score > best_score:
-                best_score = score
-                best_question = question
-                best_idx = i
-        
-        query_embedding = model.encode(query, convert_to_tensor=True)
-        question_embeddings = model.encode(questions, convert_to_tensor=True)
-        cosine_scores = util.cos_sim(query_embedding, question_embeddings)
-        max_score, max_idx = cosine_scores[0].max(dim=0)
-        
-        if max_score.item() > best_score:
-            best_score = max_score.item()
-            best_question = questions[max_idx]
-            best_idx = max_idx
-    
-    if best_score >= threshold:
-        return best_question, best_score
-    
-    return None, best_score
+    index = questions if isinstance(questions, PatternIndex) else PatternIndex(questions)
+    return index.best_match(user_query, threshold)
 
 def get_all_matches(user_query, questions):
     """Enhanced matching that returns all matches with improved scoring"""
-    corrected_query = correct_common_typos(user_query)
-    
-    matches = []
-    
-    queries_to_try = [user_query, corrected_query] if corrected_query != user_query else [user_query]
-    
-    for query in queries_to_try:
-        for question in questions:
-            score = enhanced_similarity(query, question)
-            matches.append((question, score))
-    
-    unique_matches = {}
-    for question, score in matches:
-        if question not in unique_matches or score > unique_matches[question]:
-            unique_matches[question] = score
-    
-    final_matches = [(q, s) for q, s in unique_matches.items()]
-    final_matches.sort(key=lambda x: x[1], reverse=True)
-    
+    index = questions if isinstance(questions, PatternIndex) else PatternIndex(questions)
+    if not index.patterns:
+        return []
+
+    scores, _ = index.hybrid_scores(index.correct(user_query))
+
+    final_matches = []
+    seen = set()
+    for i in np.argsort(-scores, kind="stable"):
+        question = index.patterns[i]
+        if question not in seen:
+            seen.add(question)
+            final_matches.append((question, float(scores[i])))
+
     return final_matches
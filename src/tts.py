@@ -0,0 +1,273 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+import wave
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+TTS_LANGUAGE = os.environ.get("TTS_LANGUAGE", "en")
+TTS_ENGINE = os.environ.get("TTS_ENGINE", "gtts")
+TTS_WORKERS = int(os.environ.get("TTS_WORKERS", "2"))
+AUDIO_CACHE_DIR = os.environ.get(
+    "AUDIO_CACHE_DIR", os.path.join(os.path.dirname(__file__), '../data/audio')
+)
+AUDIO_STORE = os.environ.get("AUDIO_STORE", "disk")  # "disk" or "memory"
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get("AUDIO_CACHE_MAX_MB", "64")) * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+class GTTSEngine:
+    """Google Translate speech through gTTS; needs network access"""
+
+    name = "gtts"
+    extension = "mp3"
+    mime = "audio/mp3"
+
+    def synthesize(self, text, lang):
+        from gtts import gTTS
+        buf = io.BytesIO()
+        gTTS(text=text, lang=lang).write_to_fp(buf)
+        return buf.getvalue()
+
+class SilenceEngine:
+    """Offline engine producing silent WAV audio, about 0.3s per word.
+
+    Useful for tests and air-gapped deployments: the audio pipeline runs
+    end to end without network access.
+    """
+
+    name = "silence"
+    extension = "wav"
+    mime = "audio/wav"
+    sample_rate = 8000
+
+    def synthesize(self, text, lang):
+        frames = int(self.sample_rate * 0.3 * max(1, len(text.split())))
+        buf = io.BytesIO()
+        with wave.open(buf, "wb") as out:
+            out.setnchannels(1)
+            out.setsampwidth(2)
+            out.setframerate(self.sample_rate)
+            out.writeframes(b"\x00\x00" * frames)
+        return buf.getvalue()
+
+ENGINES = {
+    GTTSEngine.name: GTTSEngine,
+    SilenceEngine.name: SilenceEngine,
+}
+
+def get_engine(name=None):
+    """Instantiate the TTS engine registered under name (default TTS_ENGINE)"""
+    name = name or TTS_ENGINE
+    try:
+        return ENGINES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown TTS engine {name!r}; choose from {sorted(ENGINES)}") from None
+
+def audio_key(text, lang):
+    """Content address of a response's audio: (sha256 of the text, lang)"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest(), lang
+
+class DiskAudioStore:
+    """Audio files in one directory, evicted least recently used past max_bytes.
+
+    Files are named by content, so identical answers share one file. Use
+    order is kept in memory and mirrored to file mtimes, so it survives a
+    restart.
+    """
+
+    def __init__(self, directory=AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._sizes = OrderedDict()
+        self.total_bytes = 0
+        if os.path.isdir(directory):
+            entries = []
+            for entry in os.scandir(directory):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+            for _, name, size in sorted(entries):
+                self._sizes[name] = size
+                self.total_bytes += size
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._sizes
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def get(self, name):
+        """Return the stored bytes and mark them recently used, or None"""
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self._forget(name)
+            return None
+        with self._lock:
+            if name in self._sizes:
+                self._sizes.move_to_end(name)
+        return data
+
+    def put(self, name, data):
+        """Store bytes under name, then evict old entries over the size cap"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        # Readers only ever see complete files
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.total_bytes += len(data) - self._sizes.pop(name, 0)
+            self._sizes[name] = len(data)
+            evicted = self._evict()
+        for old in evicted:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except FileNotFoundError:
+                pass
+
+    def _evict(self):
+        evicted = []
+        # Never evict the entry just written
+        while self.total_bytes > self.max_bytes and len(self._sizes) > 1:
+            name, size = self._sizes.popitem(last=False)
+            self.total_bytes -= size
+            evicted.append(name)
+        return evicted
+
+    def _forget(self, name):
+        with self._lock:
+            self.total_bytes -= self._sizes.pop(name, 0)
+
+class MemoryAudioStore:
+    """Audio bytes held in process memory, evicted least recently used past max_bytes"""
+
+    def __init__(self, max_bytes=AUDIO_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self.total_bytes = 0
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, name):
+        """Return the stored bytes and mark them recently used, or None"""
+        with self._lock:
+            data = self._data.get(name)
+            if data is not None:
+                self._data.move_to_end(name)
+            return data
+
+    def put(self, name, data):
+        """Store bytes under name, then evict old entries over the size cap"""
+        with self._lock:
+            old = self._data.pop(name, None)
+            self.total_bytes += len(data) - (len(old) if old is not None else 0)
+            self._data[name] = data
+            while self.total_bytes > self.max_bytes and len(self._data) > 1:
+                _, evicted = self._data.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+def get_store(kind=None):
+    """Build the audio store selected by AUDIO_STORE"""
+    kind = kind or AUDIO_STORE
+    if kind == "memory":
+        return MemoryAudioStore()
+    if kind == "disk":
+        return DiskAudioStore()
+    raise ValueError(f"Unknown audio store {kind!r}; choose 'disk' or 'memory'")
+
+class TTSService:
+    """Renders response audio on a background thread pool and caches it.
+
+    Audio is content-addressed by (text hash, lang) in an audio store, so
+    each distinct FAQ response is synthesized once per engine and language
+    however often it is answered. request() never blocks: it returns a
+    Future, and the caller renders the reply immediately and picks the audio
+    bytes up with get() once they are ready. Concurrent requests for the
+    same text share one job.
+    """
+
+    def __init__(self, engine=None, store=None, lang=TTS_LANGUAGE, workers=TTS_WORKERS):
+        self.engine = engine if engine is not None else get_engine()
+        self.store = store if store is not None else get_store()
+        self.lang = lang
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts")
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def name_for(self, text, lang=None):
+        """Store key for the audio of text"""
+        digest, lang = audio_key(text, lang or self.lang)
+        return f"{self.engine.name}_{lang}_{digest}.{self.engine.extension}"
+
+    def get(self, text, lang=None):
+        """Return the audio bytes for text, or None if not rendered yet"""
+        return self.store.get(self.name_for(text, lang))
+
+    def is_pending(self, text, lang=None):
+        """True while a render for text is queued or running"""
+        with self._lock:
+            return audio_key(text, lang or self.lang) in self._pending
+
+    def request(self, text, lang=None):
+        """Start rendering text unless cached or already in flight; returns a Future of the bytes"""
+        lang = lang or self.lang
+        data = self.get(text, lang)
+        if data is not None:
+            future = Future()
+            future.set_result(data)
+            return future
+        key = audio_key(text, lang)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = self._executor.submit(self._render, key, text, lang)
+        return future
+
+    def prerender(self, texts, lang=None):
+        """Queue every distinct text for rendering; returns the futures"""
+        return [self.request(text, lang) for text in dict.fromkeys(texts)]
+
+    def _render(self, key, text, lang):
+        try:
+            name = self.name_for(text, lang)
+            data = self.store.get(name)
+            if data is None:
+                data = self.engine.synthesize(text, lang)
+                self.store.put(name, data)
+            return data
+        except Exception:
+            logger.warning("Text-to-speech failed for %s/%s", lang, key[0][:12], exc_info=True)
+            raise
+        finally:
+            # A failed render is not cached, so a later request retries it
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads"""
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+def remove_legacy_audio(directory="."):
+    """Delete response_<uuid>.mp3 files left behind by older versions; returns the count"""
+    removed = 0
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.startswith("response_") and entry.name.endswith(".mp3"):
+            os.remove(entry.path)
+            removed += 1
+    return removed
@@ -0,0 +1,218 @@
+import math
+import os
+import numpy as np
+
+VECTOR_INDEX = os.environ.get("VECTOR_INDEX", "exact")  # "exact" or "ivf"
+IVF_NLIST = int(os.environ.get("IVF_NLIST", "0"))  # 0 = about sqrt(n_patterns)
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", "16"))
+# Nearest patterns handed to the hybrid scorer per query by an approximate index
+ANN_CANDIDATES = int(os.environ.get("ANN_CANDIDATES", "64"))
+
+def top_k(scores, k):
+    """Positions of the k largest scores, best first (earlier position wins ties)"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.intp)
+    if k < len(scores):
+        part = np.argpartition(-scores, k - 1)[:k]
+        # argpartition breaks ties arbitrarily; widen to every score at the cut-off
+        part = np.flatnonzero(scores >= scores[part].min())
+    else:
+        part = np.arange(len(scores))
+    order = np.lexsort((part, -scores[part]))
+    return part[order[:k]]
+
+class Int8Matrix:
+    """Embedding matrix stored as int8 codes with one float32 scale per row.
+
+    Row i is approximately codes[i] * scales[i] (symmetric scalar
+    quantization), a quarter of the float32 size. Inner products are
+    computed block by block, so only a small float32 block exists at a
+    time while scoring.
+    """
+
+    block_rows = 4096
+
+    def __init__(self, codes, scales):
+        self.codes = codes
+        self.scales = scales
+
+    @classmethod
+    def from_float(cls, matrix):
+        """Quantize each row so its largest absolute component maps to 127"""
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if matrix.ndim != 2:
+            matrix = matrix.reshape(len(matrix), -1)
+        scales = np.abs(matrix).max(axis=1) / 127 if matrix.size else np.zeros(len(matrix), dtype=np.float32)
+        safe = np.where(scales > 0, scales, 1)[:, None]
+        codes = np.clip(np.rint(matrix / safe), -127, 127).astype(np.int8)
+        return cls(codes, scales.astype(np.float32))
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scales.nbytes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, rows):
+        return Int8Matrix(self.codes[rows], self.scales[rows])
+
+    def __matmul__(self, query):
+        """Approximate inner product of every row with a float query vector"""
+        query = np.asarray(query, dtype=np.float32)
+        out = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), self.block_rows):
+            block = self.codes[start:start + self.block_rows]
+            out[start:start + len(block)] = block.astype(np.float32) @ query
+        out *= self.scales
+        return out
+
+    def dequantize(self, rows=None):
+        """Float32 approximation of the matrix (or of the given rows)"""
+        codes = self.codes if rows is None else self.codes[rows]
+        scales = self.scales if rows is None else self.scales[rows]
+        return codes.astype(np.float32) * scales[:, None]
+
+def _float_rows(embeddings, rows):
+    """Float32 rows of a float matrix or an Int8Matrix"""
+    if isinstance(embeddings, Int8Matrix):
+        return embeddings.dequantize(rows)
+    return embeddings[rows]
+
+class ExactIndex:
+    """Brute-force inner-product search over a normalized embedding matrix"""
+
+    name = "exact"
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def search(self, query, k):
+        """Return (rows, similarities) of the k nearest rows, best first"""
+        if not len(self.embeddings):
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.float32)
+        scores = self.embeddings @ query
+        rows = top_k(scores, k)
+        return rows, scores[rows]
+
+class IVFIndex:
+    """Inverted-file index: spherical k-means lists searched nprobe at a time.
+
+    Rows are clustered around nlist centroids once at build time and stored
+    contiguously per list. A query is compared with the centroids and only
+    the rows of the nprobe closest lists are scored, so the cost per query
+    falls from n to roughly n * nprobe / nlist dot products. Raising nprobe
+    trades latency for recall; nprobe == nlist is exact search.
+
+    Given an Int8Matrix, the lists keep the int8 codes rather than a
+    float32 copy; only training and assignment work on dequantized blocks.
+    """
+
+    name = "ivf"
+
+    def __init__(self, embeddings, nlist=IVF_NLIST, nprobe=IVF_NPROBE,
+                 iterations=10, train_size=64, seed=0):
+        if not isinstance(embeddings, Int8Matrix):
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        n = len(embeddings)
+        self.nlist = max(1, min(nlist or int(round(math.sqrt(n))), n))
+        self.nprobe = nprobe
+        self._train(embeddings, iterations, train_size, seed)
+
+        assignments = self._assign(embeddings)
+        # Rows of each list are stored contiguously so a probe is one slice
+        self.order = np.argsort(assignments, kind="stable").astype(np.intp)
+        self.vectors = embeddings[self.order]
+        counts = np.bincount(assignments, minlength=self.nlist)
+        self.offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.intp)
+
+    def __len__(self):
+        return len(self.order)
+
+    def _assign(self, embeddings):
+        # Chunked so the (rows, nlist) similarity block stays small
+        out = np.empty(len(embeddings), dtype=np.intp)
+        for start in range(0, len(embeddings), 4096):
+            block = _float_rows(embeddings, slice(start, start + 4096))
+            out[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return out
+
+    def _train(self, embeddings, iterations, train_size, seed):
+        if not len(embeddings):
+            self.centroids = np.zeros((0, embeddings.shape[1] if len(embeddings.shape) == 2 else 0), dtype=np.float32)
+            return
+        rng = np.random.default_rng(seed)
+        n = len(embeddings)
+        # A sample of train_size rows per list is plenty to place the centroids
+        rows = slice(None)
+        if n > train_size * self.nlist:
+            rows = np.sort(rng.choice(n, train_size * self.nlist, replace=False))
+        sample = _float_rows(embeddings, rows)
+        self.centroids = sample[rng.choice(len(sample), self.nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = self._assign(sample)
+            order = np.argsort(assignments, kind="stable")
+            present, starts = np.unique(assignments[order], return_index=True)
+            sums = np.zeros_like(self.centroids)
+            sums[present] = np.add.reduceat(sample[order], starts)
+            norms = np.linalg.norm(sums, axis=1)
+            # An empty list keeps its previous centroid
+            filled = norms > 0
+            self.centroids[filled] = sums[filled] / norms[filled, None]
+
+    def search(self, query, k, nprobe=None):
+        """Return (rows, similarities) of the k nearest rows in the probed lists, best first"""
+        if not len(self.order):
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.float32)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        lists = top_k(self.centroids @ query, nprobe)
+        positions = np.concatenate([
+            np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists
+        ])
+        scores = self.vectors[positions] @ query
+        best = top_k(scores, k)
+        rows = self.order[positions[best]]
+        # Same tie order as exact search: lower row first among equal scores
+        order = np.lexsort((rows, -scores[best]))
+        return rows[order], scores[best][order]
+
+INDEXES = {
+    ExactIndex.name: ExactIndex,
+    IVFIndex.name: IVFIndex,
+}
+
+def build_vector_index(embeddings, kind=None, **kwargs):
+    """Build the vector index registered under kind (default VECTOR_INDEX)"""
+    kind = kind or VECTOR_INDEX
+    try:
+        cls = INDEXES[kind]
+    except KeyError:
+        raise ValueError(f"Unknown vector index {kind!r}; choose from {sorted(INDEXES)}") from None
+    return cls(embeddings, **kwargs)
+
+def recall_at_k(index, exact, queries, k=10):
+    """Mean fraction of exact's top-k rows that index also returns in its top k"""
+    queries = np.atleast_2d(queries)
+    found = 0
+    expected = 0
+    for query in queries:
+        truth = set(exact.search(query, k)[0].tolist())
+        found += len(truth.intersection(index.search(query, k)[0].tolist()))
+        expected += len(truth)
+    return found / expected if expected else 1.0
+
+def top1_agreement(reference, candidate, queries):
+    """Fraction of queries whose best-scoring row is the same under both matrices"""
+    queries = np.atleast_2d(queries)
+    if not len(queries) or not len(reference):
+        return 1.0
+    agree = sum(int(np.argmax(reference @ query) == np.argmax(candidate @ query)) for query in queries)
+    return agree / len(queries)
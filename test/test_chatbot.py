@@ -3,12 +3,33 @@ import json
 import os
 import tempfile
 import sys
+import threading
 from unittest.mock import patch, mock_open, MagicMock
 
 # Add the src directory to the path to import modules
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-from chatbot import load_faq, get_answer
+import numpy as np
+from chatbot import load_faq, get_answer, KnowledgeBase
+
+class WordEncoder:
+    """Deterministic bag-of-words encoder that records what it encodes"""
+
+    model_id = "word-encoder"
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts, convert_to_numpy=True, normalize_embeddings=True):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        self.encoded.extend(texts)
+        vectors = np.zeros((len(texts), 64), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, sum(map(ord, word)) % 64] += 1.0
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors[0] if single else vectors
 
 class TestChatbot(unittest.TestCase):
     
@@ -110,19 +131,20 @@ class TestChatbot(unittest.TestCase):
         self.assertIsNone(answer)
         mock_get_best_match.assert_called_once()
     
-    @patch('chatbot.load_faq')
     @patch('chatbot.get_best_match')
-    def test_get_answer_without_faq_parameter(self, mock_get_best_match, mock_load_faq):
-        """Test getting answer without providing FAQ parameter."""
-        mock_load_faq.return_value = self.sample_faq
+    def test_get_answer_without_faq_parameter(self, mock_get_best_match):
+        """Test that without a FAQ parameter the shared knowledge base answers, loaded once."""
+        knowledge_base = KnowledgeBase(self.test_faq_path, encoder=WordEncoder())
         mock_get_best_match.return_value = ("How to register?", 0.90)
         
-        answer = get_answer("Registration process")
+        with patch('chatbot.get_knowledge_base', return_value=knowledge_base):
+            answer = get_answer("Registration process")
+            get_answer("Registration process")
         
         expected_answer = "To register, visit the student portal and complete the online registration form."
         self.assertEqual(answer, expected_answer)
-        mock_load_faq.assert_called_once()
-        mock_get_best_match.assert_called_once()
+        self.assertEqual(knowledge_base.version, 1)
+        self.assertEqual(mock_get_best_match.call_count, 2)
     
     def test_get_answer_with_real_nlp(self):
         """Test get_answer with real NLP processing (integration test)."""
@@ -222,5 +244,124 @@ class TestChatbot(unittest.TestCase):
         mock_join.assert_called_once_with("/fake/src", '../data/faq.json')
         self.assertEqual(len(faq), 3)
 
+class TestKnowledgeBase(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a FAQ file and a knowledge base that checks it on every access."""
+        self.faq = [
+            {"intent": "fees", "patterns": ["What are the fees?", "How much does it cost?"],
+             "response": "Fees are $10,000."},
+            {"intent": "register", "patterns": ["How to register?"],
+             "response": "Use the student portal."},
+        ]
+        self.test_faq_fd, self.test_faq_path = tempfile.mkstemp(suffix='.json')
+        os.close(self.test_faq_fd)
+        self.mtime = 1_700_000_000
+        self.write_faq()
+        self.encoder = WordEncoder()
+        self.knowledge_base = KnowledgeBase(self.test_faq_path, check_interval=0, encoder=self.encoder)
+
+    def tearDown(self):
+        """Remove the FAQ file."""
+        os.unlink(self.test_faq_path)
+
+    def write_faq(self, text=None):
+        with open(self.test_faq_path, 'w', encoding='utf-8') as f:
+            f.write(text if text is not None else json.dumps(self.faq))
+        # Step the mtime so edits are visible even on coarse-mtime filesystems
+        self.mtime += 1
+        os.utime(self.test_faq_path, (self.mtime, self.mtime))
+
+    def encode_all(self):
+        """Load the index and force its embeddings, clearing the encoder log."""
+        index = self.knowledge_base.index
+        index.embeddings
+        self.encoder.encoded.clear()
+        return index
+
+    def test_loads_once_while_unchanged(self):
+        """Test that repeated access reuses the same index."""
+        first = self.knowledge_base.index
+        self.assertIs(self.knowledge_base.index, first)
+        self.assertFalse(self.knowledge_base.refresh(force=True))
+        self.assertEqual(self.knowledge_base.version, 1)
+
+    def test_response_edit_reloads_without_encoding(self):
+        """Test that changing only an answer swaps the index and encodes nothing."""
+        old = self.encode_all()
+        self.faq[1]["response"] = "Register online."
+        self.write_faq()
+
+        index = self.knowledge_base.index
+        self.assertIsNot(index, old)
+        self.assertEqual(self.knowledge_base.version, 2)
+        self.assertEqual(self.knowledge_base.last_encoded, 0)
+        self.assertEqual(index.response_for("How to register?"), "Register online.")
+        self.assertEqual(self.encoder.encoded, [])
+
+    def test_added_pattern_is_the_only_one_encoded(self):
+        """Test that a new pattern is embedded alone and rows line up with patterns."""
+        self.encode_all()
+        self.faq[1]["patterns"].insert(0, "Where do I enroll?")
+        self.write_faq()
+
+        index = self.knowledge_base.index
+        self.assertEqual(self.knowledge_base.last_encoded, 1)
+        self.assertEqual(self.encoder.encoded, ["Where do I enroll?"])
+        expected = WordEncoder().encode(index.patterns)
+        np.testing.assert_allclose(index.embeddings, expected, rtol=1e-6)
+
+    def test_touch_without_edit_does_not_reload(self):
+        """Test that a new mtime with identical content keeps the index."""
+        old = self.knowledge_base.index
+        self.write_faq()
+        self.assertIs(self.knowledge_base.index, old)
+        self.assertEqual(self.knowledge_base.version, 1)
+
+    def test_invalid_edit_keeps_previous_index(self):
+        """Test that a half-saved or broken file does not take answers down."""
+        old = self.knowledge_base.index
+        self.write_faq('[{"patterns": ["broken"')
+
+        self.assertIs(self.knowledge_base.index, old)
+        self.assertEqual(self.knowledge_base.get_answer("What are the fees?"), "Fees are $10,000.")
+
+    def test_check_interval_limits_stat_calls(self):
+        """Test that edits are picked up only once the check interval has passed."""
+        knowledge_base = KnowledgeBase(self.test_faq_path, check_interval=3600, encoder=self.encoder)
+        old = knowledge_base.index
+        self.faq[0]["response"] = "Changed."
+        self.write_faq()
+
+        self.assertIs(knowledge_base.index, old)
+        self.assertTrue(knowledge_base.refresh(force=True))
+        self.assertEqual(knowledge_base.index.response_for("What are the fees?"), "Changed.")
+
+    def test_reload_does_not_block_readers(self):
+        """Test that other threads keep the live index while one thread rebuilds."""
+        import chatbot
+        old = self.knowledge_base.index
+        started, release = threading.Event(), threading.Event()
+        build_index = chatbot.build_index
+
+        def slow_build(*args, **kwargs):
+            started.set()
+            release.wait(10)
+            return build_index(*args, **kwargs)
+
+        self.faq[0]["response"] = "Changed."
+        self.write_faq()
+        with patch('chatbot.build_index', side_effect=slow_build):
+            reloader = threading.Thread(target=self.knowledge_base.refresh)
+            reloader.start()
+            self.assertTrue(started.wait(10))
+
+            self.assertIs(self.knowledge_base.index, old)
+            self.assertFalse(self.knowledge_base.refresh())
+            release.set()
+            reloader.join(10)
+
+        self.assertEqual(self.knowledge_base.index.response_for("What are the fees?"), "Changed.")
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
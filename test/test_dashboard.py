@@ -1,4 +1,5 @@
 import unittest
+import io
 import sqlite3
 import pandas as pd
 import os
@@ -14,7 +15,19 @@ from dashboard import (
     get_table_names,
     get_table_data,
     get_table_info,
-    get_table_count
+    get_table_count,
+    get_table_page,
+    iter_table_csv,
+    export_table_csv,
+    get_rollup_data,
+    validate_table_name,
+    iter_table_chunks,
+    get_daily_counts,
+    get_score_distribution,
+    get_live_analytics,
+    get_table_stats,
+    get_data_version,
+    load_table_stats
 )
 
 class TestDashboard(unittest.TestCase):
@@ -218,6 +231,150 @@ class TestDashboard(unittest.TestCase):
             self.assertIn('user_query', column_names)
             self.assertIn('bot_response', column_names)
     
+    def test_get_table_page_with_real_db(self):
+        """Test that keyset pages follow on from the last rowid read."""
+        with patch('dashboard.DB_PATH', self.test_db_path):
+            first, last = get_table_page('interactions', 0, 1)
+            self.assertEqual(list(first['user_query']), ['What are the fees?'])
+            self.assertNotIn('_rowid', first.columns)
+
+            second, last = get_table_page('interactions', last, 1)
+            self.assertEqual(list(second['user_query']), ['How to register?'])
+
+            rest, last = get_table_page('interactions', last, 1)
+            self.assertTrue(rest.empty)
+            self.assertIsNone(last)
+
+    def test_iter_table_csv_matches_full_export(self):
+        """Test that chunked CSV output equals a single full-table export."""
+        with patch('dashboard.DB_PATH', self.test_db_path):
+            chunks = list(iter_table_csv('interactions', chunk_size=1))
+            expected = get_table_data('interactions').to_csv(index=False)
+
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(''.join(chunks), expected)
+
+    def test_export_table_csv_with_empty_table(self):
+        """Test that exporting an empty table yields just the header."""
+        conn = sqlite3.connect(self.test_db_path)
+        conn.execute("DELETE FROM escalations")
+        conn.commit()
+        conn.close()
+
+        with patch('dashboard.DB_PATH', self.test_db_path):
+            data = export_table_csv('escalations').read().decode('utf-8')
+
+        self.assertEqual(data.strip(), 'id,timestamp,user_query,suggested_answer')
+
+    def test_export_table_csv_accepted_by_download_button(self):
+        """Test that Streamlit can turn the export into download bytes."""
+        from streamlit.runtime.download_data_util import convert_data_to_bytes_and_infer_mime
+
+        with patch('dashboard.DB_PATH', self.test_db_path):
+            expected = ''.join(iter_table_csv('interactions')).encode('utf-8')
+            data, _ = convert_data_to_bytes_and_infer_mime(export_table_csv('interactions'), TypeError("unsupported"))
+
+        self.assertEqual(data, expected)
+
+    def test_export_table_csv_is_capped_and_on_disk(self):
+        """Test that the export stops at max_rows and is served from a file, not a memory buffer."""
+        with patch('dashboard.DB_PATH', self.test_db_path):
+            with export_table_csv('interactions', chunk_size=1, max_rows=1) as out:
+                self.assertNotIsInstance(out, io.BytesIO)
+                lines = out.read().decode('utf-8').strip().splitlines()
+
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(out.closed)
+
+    def test_get_rollup_data_with_real_db(self):
+        """Test that analytics come from rollups built on an unmigrated database."""
+        with patch('dashboard.DB_PATH', self.test_db_path):
+            daily, histogram = get_rollup_data()
+
+        self.assertEqual(daily['interactions'].sum(), 2)
+        self.assertEqual(daily['feedback_up'].sum(), 2)
+        self.assertEqual(daily['escalations'].sum(), 1)
+        self.assertEqual(list(histogram['match_score']), [0.85, 0.9])
+
+    def test_validate_table_name(self):
+        """Test that only plain identifiers are accepted as table names."""
+        self.assertEqual(validate_table_name('interactions'), 'interactions')
+        for name in ('interactions; DROP TABLE escalations', 'a b', '"quoted"', '', None):
+            with self.assertRaises(ValueError):
+                validate_table_name(name)
+
+    @patch('dashboard.get_db_connection')
+    def test_invalid_table_name_rejected_before_query(self, mock_get_conn):
+        """Test that a malicious table name never reaches the database."""
+        with self.assertRaises(ValueError):
+            get_table_count('interactions; DROP TABLE escalations')
+        with self.assertRaises(ValueError):
+            get_table_page('x) --', 0, 10)
+        mock_get_conn.assert_not_called()
+
+    def test_iter_table_chunks_with_real_db(self):
+        """Test that large reads are streamed in bounded chunks."""
+        with patch('dashboard.DB_PATH', self.test_db_path):
+            chunks = list(iter_table_chunks('interactions', chunk_size=1))
+
+        self.assertEqual([len(chunk) for chunk in chunks], [1, 1])
+        self.assertEqual(list(pd.concat(chunks)['user_query']), ['What are the fees?', 'How to register?'])
+
+    def test_sql_aggregates_with_real_db(self):
+        """Test per-day counts and score buckets computed in SQL."""
+        with patch('dashboard.DB_PATH', self.test_db_path):
+            daily = get_daily_counts('interactions')
+            histogram = get_score_distribution()
+
+        self.assertEqual(daily['count'].sum(), 2)
+        self.assertEqual(list(histogram['bucket']), [17, 18])
+        self.assertEqual(list(histogram['count']), [1, 1])
+
+    def test_live_analytics_match_rollups(self):
+        """Test that the SQL fallback agrees with the rollup tables."""
+        with patch('dashboard.DB_PATH', self.test_db_path):
+            live_daily, live_histogram = get_live_analytics()
+            daily, histogram = get_rollup_data()
+
+        columns = ['day', 'interactions', 'feedback_up', 'feedback_down', 'escalations']
+        self.assertEqual(live_daily[columns].astype({c: int for c in columns[1:]}).values.tolist(),
+                         daily[columns].values.tolist())
+        self.assertEqual(list(live_histogram['count']), list(histogram['count']))
+
+    def test_get_table_stats_with_real_db(self):
+        """Test that batched stats match the per-table count and schema queries."""
+        with patch('dashboard.DB_PATH', self.test_db_path):
+            stats = get_table_stats()
+            for table in ('interactions', 'escalations'):
+                self.assertEqual(stats[table]['count'], get_table_count(table))
+                self.assertEqual(stats[table]['columns'], get_table_info(table))
+            self.assertEqual(list(stats), [t for t in get_table_names() if t in stats])
+
+    def test_data_version_changes_only_on_commit(self):
+        """Test that the cache key moves when another connection commits."""
+        with patch('dashboard.DB_PATH', self.test_db_path):
+            before = get_data_version()
+            self.assertEqual(get_data_version(), before)
+
+            conn = sqlite3.connect(self.test_db_path)
+            conn.execute("INSERT INTO escalations (user_query) VALUES ('new')")
+            conn.commit()
+            conn.close()
+
+            self.assertNotEqual(get_data_version(), before)
+
+    def test_load_table_stats_cached_per_version(self):
+        """Test that unchanged reruns are served from the cache."""
+        load_table_stats.clear()
+        with patch('dashboard.DB_PATH', self.test_db_path), \
+                patch('dashboard.get_table_stats', return_value={}) as mock_stats:
+            load_table_stats(('v', 1))
+            load_table_stats(('v', 1))
+            self.assertEqual(mock_stats.call_count, 1)
+            load_table_stats(('v', 2))
+            self.assertEqual(mock_stats.call_count, 2)
+        load_table_stats.clear()
+
     @patch('dashboard.get_db_connection')
     def test_database_connection_error(self, mock_get_conn):
         """Test handling of database connection errors."""
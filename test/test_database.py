@@ -3,12 +3,18 @@ import sqlite3
 import os
 import tempfile
 import sys
+import time
 from unittest.mock import patch, MagicMock
 
 # Add the src directory to the path to import modules
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-from database import init_db, log_interaction, log_feedback, log_escalation
+from database import (
+    init_db, log_interaction, log_feedback, log_escalation,
+    get_connection, ConnectionPool, AsyncLogWriter, MIGRATIONS, migrate, get_schema_version,
+    refresh_rollups,
+    enable_async_logging, disable_async_logging, flush_logs
+)
 
 class TestDatabase(unittest.TestCase):
     
@@ -334,5 +340,377 @@ class TestDatabase(unittest.TestCase):
         self.assertEqual(count, 1)
         conn.close()
 
+class TestMigrations(unittest.TestCase):
+
+    def setUp(self):
+        """Set up an empty temporary database."""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        os.close(self.test_db_fd)
+        self.db_path_patcher = patch('database.DB_PATH', self.test_db_path)
+        self.db_path_patcher.start()
+
+    def tearDown(self):
+        """Remove the temporary database."""
+        self.db_path_patcher.stop()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.test_db_path + suffix):
+                os.unlink(self.test_db_path + suffix)
+
+    def connect(self):
+        conn = sqlite3.connect(self.test_db_path)
+        self.addCleanup(conn.close)
+        return conn
+
+    def test_init_db_records_latest_version(self):
+        """Test that a fresh database is migrated to the latest version."""
+        init_db()
+        self.assertEqual(get_schema_version(self.connect()), len(MIGRATIONS))
+
+    def test_init_db_is_idempotent(self):
+        """Test that running init_db again applies nothing twice."""
+        init_db()
+        init_db()
+        rows = self.connect().execute("SELECT version FROM schema_version ORDER BY version").fetchall()
+        self.assertEqual([row[0] for row in rows], list(range(1, len(MIGRATIONS) + 1)))
+
+    def test_up_to_date_database_takes_no_write_lock(self):
+        """Test that init_db on a migrated database succeeds while another writer holds the lock."""
+        init_db()
+        writer = self.connect()
+        writer.execute("BEGIN IMMEDIATE")
+
+        conn = sqlite3.connect(self.test_db_path, timeout=0.1)
+        self.addCleanup(conn.close)
+        self.assertEqual(migrate(conn), len(MIGRATIONS))
+        writer.rollback()
+
+    def test_indexes_created(self):
+        """Test that the dashboard and session lookups have indexes."""
+        init_db()
+        names = {row[0] for row in self.connect().execute("SELECT name FROM sqlite_master WHERE type='index'")}
+        for name in ('idx_interactions_timestamp', 'idx_interactions_session_id',
+                     'idx_interactions_feedback_timestamp', 'idx_escalations_timestamp'):
+            self.assertIn(name, names)
+
+    def test_session_lookup_uses_index(self):
+        """Test that filtering by session_id does not scan the table."""
+        init_db()
+        plan = self.connect().execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM interactions WHERE session_id = ?", ("s1",)).fetchall()
+        self.assertIn("idx_interactions_session_id", " ".join(str(row[-1]) for row in plan))
+
+    def test_legacy_database_upgraded_in_place(self):
+        """Test that a database created before migrations keeps its rows and gains new columns."""
+        conn = self.connect()
+        conn.execute('''
+            CREATE TABLE interactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                user_query TEXT, bot_response TEXT, match_score REAL,
+                feedback INTEGER, session_id TEXT
+            )
+        ''')
+        conn.execute("INSERT INTO interactions (user_query, bot_response, match_score) VALUES ('q', 'r', 0.7)")
+        conn.commit()
+
+        init_db()
+
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(interactions)")]
+        for col in ('client_id', 'matched_pattern', 'matched_intent'):
+            self.assertIn(col, columns)
+        self.assertEqual(conn.execute("SELECT user_query, match_score FROM interactions").fetchall(), [('q', 0.7)])
+
+    def test_failed_migration_rolls_back(self):
+        """Test that a failing migration leaves neither its changes nor its version behind."""
+        def broken(conn):
+            conn.execute("CREATE TABLE half_done (x)")
+            raise sqlite3.OperationalError("boom")
+
+        conn = get_connection(self.test_db_path)
+        with self.assertRaises(sqlite3.OperationalError):
+            migrate(conn, MIGRATIONS[:1] + [broken])
+        conn.close()
+
+        check = self.connect()
+        self.assertEqual(get_schema_version(check), 0)
+        self.assertIsNone(check.execute("SELECT name FROM sqlite_master WHERE name='half_done'").fetchone())
+
+    def test_log_interaction_stores_match(self):
+        """Test that the matched pattern and intent are stored with the interaction."""
+        init_db()
+        interaction_id = log_interaction("s1", "fees?", "Fees are...", 0.8, "What are the fees?", "fees")
+        row = self.connect().execute(
+            "SELECT matched_pattern, matched_intent FROM interactions WHERE id = ?", (interaction_id,)).fetchone()
+        self.assertEqual(row, ("What are the fees?", "fees"))
+
+class TestRollups(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a migrated temporary database."""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        os.close(self.test_db_fd)
+        self.db_path_patcher = patch('database.DB_PATH', self.test_db_path)
+        self.db_path_patcher.start()
+        init_db()
+        self.conn = sqlite3.connect(self.test_db_path)
+
+    def tearDown(self):
+        """Remove the temporary database."""
+        self.conn.close()
+        self.db_path_patcher.stop()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.test_db_path + suffix):
+                os.unlink(self.test_db_path + suffix)
+
+    def add_interaction(self, timestamp, score, feedback=None):
+        c = self.conn.execute(
+            "INSERT INTO interactions (timestamp, user_query, match_score, feedback) VALUES (?, 'q', ?, ?)",
+            (timestamp, score, feedback))
+        self.conn.commit()
+        return c.lastrowid
+
+    def daily(self):
+        return self.conn.execute(
+            "SELECT day, interactions, feedback_up, feedback_down, escalations FROM daily_rollup ORDER BY day").fetchall()
+
+    def test_refresh_counts_per_day(self):
+        """Test that interactions, feedback and escalations are totalled per day."""
+        self.add_interaction('2025-01-01 09:00:00', 0.9, 1)
+        self.add_interaction('2025-01-01 17:30:00', 0.4, -1)
+        self.add_interaction('2025-01-02 08:00:00', 0.7)
+        self.conn.execute("INSERT INTO escalations (timestamp, user_query) VALUES ('2025-01-02 10:00:00', 'q')")
+        self.conn.commit()
+
+        self.assertEqual(refresh_rollups(), 4)
+        self.assertEqual(self.daily(), [('2025-01-01', 2, 1, 1, 0), ('2025-01-02', 1, 0, 0, 1)])
+
+    def test_refresh_is_incremental(self):
+        """Test that a second refresh folds in only rows added since the first."""
+        self.add_interaction('2025-01-01 09:00:00', 0.9)
+        refresh_rollups()
+        self.assertEqual(refresh_rollups(), 0)
+
+        self.add_interaction('2025-01-01 10:00:00', 0.8)
+        self.assertEqual(refresh_rollups(), 1)
+        self.assertEqual(self.daily(), [('2025-01-01', 2, 0, 0, 0)])
+
+    def test_feedback_after_refresh_updates_rollup(self):
+        """Test that feedback on an already rolled-up row is reflected, including changes of mind."""
+        row_id = self.add_interaction('2025-01-01 09:00:00', 0.9)
+        refresh_rollups()
+
+        log_feedback(row_id, 1)
+        self.assertEqual(self.daily(), [('2025-01-01', 1, 1, 0, 0)])
+        log_feedback(row_id, -1)
+        self.assertEqual(self.daily(), [('2025-01-01', 1, 0, 1, 0)])
+
+    def test_feedback_before_refresh_counted_once(self):
+        """Test that feedback on a row not yet rolled up is counted by the refresh only."""
+        row_id = self.add_interaction('2025-01-01 09:00:00', 0.9)
+        log_feedback(row_id, 1)
+        refresh_rollups()
+        self.assertEqual(self.daily(), [('2025-01-01', 1, 1, 0, 0)])
+
+    def test_score_histogram_buckets(self):
+        """Test that scores are bucketed into twentieths, with 1.0 in the top bucket."""
+        for score in (0.0, 0.04, 0.5, 1.0, None):
+            self.add_interaction('2025-01-01 09:00:00', score)
+        refresh_rollups()
+
+        rows = self.conn.execute("SELECT bucket, count FROM score_histogram ORDER BY bucket").fetchall()
+        self.assertEqual(rows, [(0, 2), (10, 1), (19, 1)])
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a pool over a temporary database."""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        os.close(self.test_db_fd)
+        self.pool = ConnectionPool(self.test_db_path, size=2)
+
+    def tearDown(self):
+        """Close pooled connections and remove the database."""
+        self.pool.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.test_db_path + suffix):
+                os.unlink(self.test_db_path + suffix)
+
+    def test_close_returns_connection_to_pool(self):
+        """Test that a closed connection is reused by the next caller."""
+        conn = self.pool.acquire()
+        conn.close()
+        self.assertIs(self.pool.acquire(), conn)
+
+    def test_connections_use_wal_and_busy_timeout(self):
+        """Test that pooled connections are configured for concurrency."""
+        conn = self.pool.acquire()
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)  # NORMAL
+        self.assertGreater(conn.execute("PRAGMA busy_timeout").fetchone()[0], 0)
+        conn.close()
+
+    def test_pool_size_bounds_idle_connections(self):
+        """Test that connections beyond the pool size are really closed."""
+        conns = [self.pool.acquire() for _ in range(3)]
+        for conn in conns:
+            conn.close()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conns[2].execute("SELECT 1")
+
+    def test_replaced_database_file_gets_fresh_connection(self):
+        """Test that a connection to a deleted file is not handed out again."""
+        conn = self.pool.acquire()
+        conn.close()
+        os.unlink(self.test_db_path)
+        open(self.test_db_path, 'w').close()
+
+        self.assertIsNot(self.pool.acquire(), conn)
+
+    def test_connection_usable_from_another_thread(self):
+        """Test that a pooled connection can be used by a later thread."""
+        import threading
+        conn = self.pool.acquire()
+        conn.close()
+        results = []
+        worker = threading.Thread(target=lambda: results.append(self.pool.acquire().execute("SELECT 1").fetchone()))
+        worker.start()
+        worker.join()
+        self.assertEqual(results, [(1,)])
+
+    def test_get_connection_uses_db_path(self):
+        """Test that get_connection opens the configured database."""
+        with patch('database.DB_PATH', self.test_db_path):
+            conn = get_connection()
+            conn.execute("CREATE TABLE t (x)")
+            conn.close()
+        check = sqlite3.connect(self.test_db_path)
+        self.assertIsNotNone(check.execute("SELECT name FROM sqlite_master WHERE name='t'").fetchone())
+        check.close()
+
+class TestAsyncLogging(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a temporary database with async logging enabled."""
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        os.close(self.test_db_fd)
+        self.db_path_patcher = patch('database.DB_PATH', self.test_db_path)
+        self.db_path_patcher.start()
+        init_db()
+        self.writer = enable_async_logging()
+
+    def tearDown(self):
+        """Stop the writer and remove the database."""
+        disable_async_logging()
+        self.db_path_patcher.stop()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.test_db_path + suffix):
+                os.unlink(self.test_db_path + suffix)
+
+    def fetch(self, sql, params=()):
+        conn = sqlite3.connect(self.test_db_path)
+        rows = conn.execute(sql, params).fetchall()
+        conn.close()
+        return rows
+
+    def test_log_interaction_returns_client_id(self):
+        """Test that async log_interaction returns a UUID that identifies the row."""
+        client_id = log_interaction("s1", "query", "response", 0.9)
+        self.assertIsInstance(client_id, str)
+        self.assertEqual(len(client_id), 32)
+
+        flush_logs()
+        rows = self.fetch("SELECT user_query, match_score FROM interactions WHERE client_id = ?", (client_id,))
+        self.assertEqual(rows, [("query", 0.9)])
+
+    def test_feedback_by_client_id(self):
+        """Test that feedback queued after its interaction is applied to it."""
+        client_id = log_interaction("s1", "query", "response", 0.9)
+        log_feedback(client_id, -1)
+        flush_logs()
+
+        rows = self.fetch("SELECT feedback FROM interactions WHERE client_id = ?", (client_id,))
+        self.assertEqual(rows, [(-1,)])
+
+    def test_escalations_are_queued(self):
+        """Test that escalations go through the async writer."""
+        log_escalation("help", "try this")
+        flush_logs()
+        self.assertEqual(self.fetch("SELECT user_query, suggested_answer FROM escalations"), [("help", "try this")])
+
+    def test_records_written_in_order_and_batches(self):
+        """Test that many queued records are all written in insertion order."""
+        ids = [log_interaction("s1", f"query {i}", "response", 0.5) for i in range(120)]
+        flush_logs()
+
+        rows = self.fetch("SELECT client_id FROM interactions ORDER BY id")
+        self.assertEqual([row[0] for row in rows], ids)
+        self.assertEqual(self.writer.written, 120)
+
+    def test_disable_flushes_pending_records(self):
+        """Test that disabling async logging writes what is still queued."""
+        for i in range(10):
+            log_interaction("s1", f"query {i}", "response", 0.5)
+        disable_async_logging()
+
+        self.assertEqual(self.fetch("SELECT COUNT(*) FROM interactions"), [(10,)])
+        self.assertFalse(self.writer.alive)
+
+    def test_sync_mode_after_disable(self):
+        """Test that log_interaction returns row ids again once async logging is off."""
+        disable_async_logging()
+        self.assertIsInstance(log_interaction("s1", "query", "response", 0.5), int)
+
+    def test_full_queue_blocks_until_drained(self):
+        """Test that put() waits for space instead of dropping records."""
+        writer = AsyncLogWriter(self.test_db_path, maxsize=2, batch_size=1, flush_interval=0.01)
+        conn = sqlite3.connect(self.test_db_path)
+        conn.execute("BEGIN EXCLUSIVE")  # stall the writer so the queue fills up
+        import threading
+        producer = threading.Thread(target=lambda: [
+            writer.put("INSERT INTO escalations (user_query) VALUES (?)", (f"q{i}",)) for i in range(5)
+        ])
+        producer.start()
+        time.sleep(0.2)
+        self.assertTrue(producer.is_alive())
+        conn.rollback()
+        conn.close()
+
+        producer.join(10)
+        writer.stop()
+        self.assertFalse(producer.is_alive())
+        self.assertEqual(self.fetch("SELECT COUNT(*) FROM escalations"), [(5,)])
+
+    def test_failed_batch_does_not_stop_writer(self):
+        """Test that a bad record is counted and later records are still written."""
+        self.writer.put("INSERT INTO missing_table VALUES (?)", (1,))
+        flush_logs()
+        log_escalation("after failure")
+        flush_logs()
+
+        self.assertEqual(self.writer.failed, 1)
+        self.assertEqual(self.fetch("SELECT user_query FROM escalations"), [("after failure",)])
+
+    def test_unreachable_database_does_not_stop_writer(self):
+        """Test that a failed connect is counted and the writer keeps running."""
+        writer = AsyncLogWriter(os.path.join(self.test_db_path, 'missing', 'chatbot.db'), flush_interval=0.01)
+        writer.put("INSERT INTO escalations (user_query) VALUES (?)", ("lost",))
+        writer.flush()
+
+        self.assertTrue(writer.alive)
+        self.assertEqual(writer.failed, 1)
+        writer.db_path = self.test_db_path
+        writer.put("INSERT INTO escalations (user_query) VALUES (?)", ("kept",))
+        writer.stop()
+        self.assertEqual(self.fetch("SELECT user_query FROM escalations"), [("kept",)])
+
+    def test_put_after_writer_died_writes_synchronously(self):
+        """Test that records are not queued for a writer thread that is gone."""
+        writer = AsyncLogWriter(self.test_db_path, flush_interval=0.01)
+        writer.stop()
+        writer.put("INSERT INTO escalations (user_query) VALUES (?)", ("direct",))
+
+        self.assertEqual(writer.queue.qsize(), 0)
+        self.assertEqual(self.fetch("SELECT user_query FROM escalations"), [("direct",)])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,22 +1,70 @@
 import unittest
 import sys
 import os
+import tempfile
+import shutil
+import json
+import importlib.util
+import threading
 from unittest.mock import patch, MagicMock
 import numpy as np
 
 # Add the src directory to the path to import modules
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
+from vector_index import Int8Matrix
 from nlp_agent import (
     preprocess,
+    preprocess_batch,
     fuzzy_match_score,
     enhanced_similarity,
     correct_common_typos,
     token_overlap,
     get_best_match,
-    get_all_matches
+    get_all_matches,
+    PatternIndex,
+    IntentTable,
+    BM25Index,
+    lexical_terms,
+    OnnxEncoder,
+    export_onnx_model,
+    load_encoder,
+    compare_encoders,
+    normalize_query,
+    HybridScorer,
+    LRUCache,
+    query_embedding_cache,
+    EmbeddingStore,
+    pattern_content_hash,
+    LazyResource,
+    warmup,
+    TypoCorrector,
+    load_word_list,
+    TYPO_VOCABULARY_PATH,
+    COMMON_TYPOS
 )
 
+class CountingEncoder:
+    """Deterministic bag-of-words encoder that counts encode calls."""
+
+    def __init__(self, dim=32):
+        self.dim = dim
+        self.calls = 0
+
+    def _vector(self, text):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for word in text.lower().split():
+            vec[sum(ord(c) for c in word.strip('?!.,')) % self.dim] += 1.0
+        return vec
+
+    def encode(self, texts, convert_to_numpy=True, normalize_embeddings=False, **kwargs):
+        self.calls += 1
+        single = isinstance(texts, str)
+        vectors = np.stack([self._vector(t) for t in ([texts] if single else texts)])
+        if normalize_embeddings:
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors[0] if single else vectors
+
 class TestNLPAgent(unittest.TestCase):
     
     def setUp(self):
@@ -75,6 +123,29 @@ class TestNLPAgent(unittest.TestCase):
         self.assertIsInstance(result, str)
         self.assertTrue(len(result) >= 0)
     
+    def test_preprocess_batch_matches_single(self):
+        """Test that batch preprocessing agrees with preprocess."""
+        texts = ["Hello World! How are you?", "What's the cost?", ""]
+        self.assertEqual(preprocess_batch(texts), [preprocess(t) for t in texts])
+
+    def test_preprocess_batch_uses_pipe(self):
+        """Test that a lemmatizing pipeline is run once over the whole batch."""
+        def token(text, is_stop=False):
+            return MagicMock(lemma_=text, is_stop=is_stop, is_alpha=text.isalpha())
+
+        with patch('nlp_agent.nlp') as mock_nlp:
+            mock_nlp.pipe_names = ["tagger", "attribute_ruler", "lemmatizer"]
+            mock_nlp.pipe.return_value = [
+                [token("student"), token("be", is_stop=True), token("register")],
+                [token("pay"), token("fee")],
+            ]
+
+            result = preprocess_batch(["Students are registering!", "Pay fees"])
+
+        self.assertEqual(result, ["student register", "pay fee"])
+        mock_nlp.pipe.assert_called_once()
+        self.assertEqual(list(mock_nlp.pipe.call_args[0][0]), ["students are registering", "pay fees"])
+
     def test_fuzzy_match_score_identical(self):
         """Test fuzzy matching with identical strings."""
         score = fuzzy_match_score("hello world", "hello world")
@@ -368,5 +439,909 @@ class TestNLPAgent(unittest.TestCase):
         if score >= 0.1:
             self.assertIsNotNone(best_question)
 
+class TestTypoCorrector(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a corrector with a small FAQ vocabulary."""
+        self.corrector = TypoCorrector(
+            COMMON_TYPOS,
+            vocabulary=["registration", "transcript", "tuition", "installments", "attendce", "classes"]
+        )
+
+    def test_corrects_unseen_misspellings(self):
+        """Test that misspellings outside the curated map are corrected."""
+        self.assertEqual(self.corrector.correct("registraton deadline"), "registration deadline")
+        self.assertEqual(self.corrector.correct("my transcipt?"), "my transcript?")
+        self.assertEqual(self.corrector.correct("tution fees"), "tuition fees")
+
+    def test_curated_map_takes_precedence(self):
+        """Test that curated corrections still apply, including short words."""
+        self.assertEqual(self.corrector.correct("clas fee"), "class fees")
+
+    def test_known_typos_are_not_targets(self):
+        """Test that curated misspellings in the vocabulary are not suggested."""
+        self.assertNotIn("attendce", self.corrector.counts)
+        self.assertEqual(self.corrector.correct_word("attendence"), "attendence")
+
+    def test_short_and_known_words_unchanged(self):
+        """Test that short words and vocabulary words are left alone."""
+        self.assertEqual(self.corrector.correct("The classes are here"), "The classes are here")
+
+    def test_distance_bounded_by_length(self):
+        """Test that short words only accept a single edit."""
+        self.assertEqual(self.corrector.correct_word("tuitn"), "tuitn")
+        self.assertEqual(self.corrector.correct_word("instllmnts"), "installments")
+
+    def test_from_file(self):
+        """Test loading the vocabulary from a word list file."""
+        fd, path = tempfile.mkstemp(suffix='.txt')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write("semester 5\nscholarship\n")
+            corrector = TypoCorrector.from_file(path)
+            self.assertEqual(corrector.correct("scholarhip semestre"), "scholarship semester")
+            self.assertEqual(corrector.counts["semester"], 5)
+        finally:
+            os.unlink(path)
+
+class TestTypoDictionary(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a corrector whose FAQ vocabulary has near misses of valid query words."""
+        self.corrector = TypoCorrector(
+            COMMON_TYPOS,
+            vocabulary=["there", "exam", "school", "breaks", "deadline", "attendance", "attendence",
+                        "readmission", "helo"],
+            dictionary=frozenset(["these", "there", "exams", "exam", "schools", "school", "break",
+                                  "breaks", "deadlines", "deadline", "attendance", "hello"])
+        )
+
+    def test_dictionary_words_not_rewritten(self):
+        """Test that valid words are kept even when a FAQ word is one edit away."""
+        text = "these exams schools break deadlines"
+        self.assertEqual(self.corrector.correct(text), text)
+
+    def test_faq_misspellings_are_not_targets(self):
+        """Test that FAQ near misses of real words are kept as typed but never suggested."""
+        self.assertEqual(self.corrector.correct_word("attendanse"), "attendance")
+        self.assertEqual(self.corrector.correct_word("attendence"), "attendence")
+        self.assertNotIn("attendence", self.corrector.counts)
+        self.assertNotIn("helo", self.corrector.counts)
+
+    def test_domain_words_stay_targets(self):
+        """Test that FAQ words missing from the dictionary but not near one are still targets."""
+        self.assertEqual(self.corrector.correct_word("readmision"), "readmission")
+
+    def test_default_word_list(self):
+        """Test that the bundled English word list covers common words."""
+        words = load_word_list(TYPO_VOCABULARY_PATH)
+        self.assertTrue({"these", "exams", "schools", "break", "deadlines"} <= words)
+        self.assertEqual(load_word_list(""), frozenset())
+
+    def test_indexes_keep_their_own_vocabulary(self):
+        """Test that building an index does not change corrections elsewhere."""
+        first = PatternIndex(["Scholarship deadline?"], encoder=CountingEncoder())
+        key = next(iter(first.exact_index))
+        PatternIndex(["Scholarshap deadline?", "Semester break"], encoder=CountingEncoder())
+
+        self.assertEqual(first.correct("scholarshap"), "scholarship")
+        self.assertEqual(correct_common_typos("scholarhip"), "scholarhip")
+        self.assertEqual(list(first.exact_index), [key])
+
+class TestLazyResource(unittest.TestCase):
+
+    def test_loads_on_first_use_only(self):
+        """Test that the loader runs once, on first attribute access."""
+        loader = MagicMock(return_value=MagicMock(lang="en"))
+        resource = LazyResource(loader)
+
+        self.assertFalse(resource.loaded)
+        loader.assert_not_called()
+
+        self.assertEqual(resource.lang, "en")
+        self.assertEqual(resource.lang, "en")
+        loader.assert_called_once()
+        self.assertTrue(resource.loaded)
+
+    def test_concurrent_first_use_loads_once(self):
+        """Test that racing threads share a single load."""
+        loaded = []
+
+        def slow_loader():
+            loaded.append(1)
+            return object()
+
+        resource = LazyResource(slow_loader)
+        threads = [threading.Thread(target=resource.get) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(loaded), 1)
+
+    def test_private_attribute_probe_does_not_load(self):
+        """Test that introspection of private names does not load the model."""
+        loader = MagicMock()
+        resource = LazyResource(loader)
+        self.assertFalse(hasattr(resource, "_is_coroutine"))
+        loader.assert_not_called()
+
+    def test_failed_load_is_remembered(self):
+        """Test that a failed load is re-raised without retrying until the interval passes."""
+        now = [0.0]
+        loader = MagicMock(side_effect=[OSError("offline"), "model"])
+        resource = LazyResource(loader, retry_interval=60, timer=lambda: now[0])
+
+        for _ in range(3):
+            with self.assertRaises(OSError):
+                resource.get()
+        loader.assert_called_once()
+
+        now[0] = 61.0
+        self.assertEqual(resource.get(), "model")
+        self.assertEqual(loader.call_count, 2)
+
+    def test_failed_model_shared_by_indexes(self):
+        """Test that new indexes do not retry a model load that just failed."""
+        loader = MagicMock(side_effect=OSError("offline"))
+        encoder = LazyResource(loader)
+        for patterns in (["library hours"], ["library hours", "exam dates"]):
+            index = PatternIndex(patterns, encoder=encoder)
+            with self.assertLogs("nlp_agent", level="WARNING"):
+                self.assertFalse(index.semantic_available())
+        loader.assert_called_once()
+
+    def test_index_recovers_when_model_loads_later(self):
+        """Test that an index falls back to BM25 while the model is down and switches back after a retry."""
+        now = [0.0]
+        encoder = CountingEncoder()
+        loader = MagicMock(side_effect=[OSError("offline"), encoder])
+        index = PatternIndex(["library opening hours", "exam timetable"],
+                             encoder=LazyResource(loader, retry_interval=60, timer=lambda: now[0]))
+
+        with self.assertLogs("nlp_agent", level="WARNING"):
+            lexical = index.semantic_scores("library hours")
+        np.testing.assert_allclose(lexical, index.lexical.scores("library hours"))
+        self.assertFalse(index.semantic_available())
+        self.assertFalse(index.prepared)
+
+        now[0] = 61.0
+        self.assertTrue(index.semantic_available())
+        index.prepare()
+        self.assertTrue(index.prepared)
+        query = encoder.encode("library hours", normalize_embeddings=True)
+        np.testing.assert_allclose(index.semantic_scores("library hours"), index.embeddings @ query, rtol=1e-6)
+        self.assertEqual(loader.call_count, 2)
+
+    def test_warmup_encodes_once(self):
+        """Test that warmup triggers a model encode."""
+        with patch('nlp_agent.model') as mock_model:
+            warmup()
+            mock_model.encode.assert_called_once()
+
+class TestLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a cache driven by a fake clock."""
+        self.now = 0.0
+        self.cache = LRUCache(maxsize=2, ttl=10, timer=lambda: self.now)
+
+    def test_get_counts_hits_and_misses(self):
+        """Test that lookups update the hit and miss counters."""
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.put("a", 1)
+        self.assertEqual(self.cache.get("a"), 1)
+
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_evicts_least_recently_used(self):
+        """Test that the least recently used key is evicted when full."""
+        self.cache.put("a", 1)
+        self.cache.put("b", 2)
+        self.cache.get("a")
+        self.cache.put("c", 3)
+
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(len(self.cache), 2)
+
+    def test_entries_expire_after_ttl(self):
+        """Test that entries older than the TTL are treated as misses."""
+        self.cache.put("a", 1)
+        self.now = 11
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_clear_resets_counters(self):
+        """Test that clear drops entries and counters."""
+        self.cache.put("a", 1)
+        self.cache.get("a")
+        self.cache.clear()
+        self.assertEqual(self.cache.stats()["hits"], 0)
+        self.assertEqual(len(self.cache), 0)
+
+class TestEmbeddingStore(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a temporary cache directory."""
+        self.cache_dir = tempfile.mkdtemp()
+        self.store = EmbeddingStore(os.path.join(self.cache_dir, "faq_embeddings"))
+        self.patterns = ["How do I register?", "What are the fees?"]
+        self.encoder = CountingEncoder()
+        self.encoder.model_id = "counting-encoder"
+
+    def tearDown(self):
+        """Remove the temporary cache directory."""
+        shutil.rmtree(self.cache_dir)
+
+    def test_save_and_load_memory_mapped(self):
+        """Test that a saved matrix is loaded back memory-mapped."""
+        matrix = np.eye(2, 4, dtype=np.float32)
+        content_hash = pattern_content_hash(self.patterns)
+        self.store.save(matrix, "model-a", content_hash)
+
+        loaded = self.store.load("model-a", content_hash)
+
+        self.assertIsInstance(loaded, np.memmap)
+        np.testing.assert_array_equal(loaded, matrix)
+
+    def test_load_rejects_stale_manifest(self):
+        """Test that a different model or pattern hash forces a rebuild."""
+        content_hash = pattern_content_hash(self.patterns)
+        self.store.save(np.eye(2, 4, dtype=np.float32), "model-a", content_hash)
+
+        self.assertIsNone(self.store.load("model-b", content_hash))
+        self.assertIsNone(self.store.load("model-a", pattern_content_hash(["changed"])))
+
+    def test_old_manifest_never_pairs_with_new_matrix(self):
+        """Test that a manifest read before a save cannot load the newer matrix."""
+        old_hash = pattern_content_hash(self.patterns)
+        self.store.save(np.eye(2, 4, dtype=np.float32), "model-a", old_hash)
+        with open(self.store.manifest_path, encoding="utf-8") as f:
+            old_manifest = f.read()
+        new_hash = pattern_content_hash(["changed", "patterns"])
+        self.store.save(np.ones((2, 4), dtype=np.float32), "model-a", new_hash)
+
+        # A reader that saw the old manifest
+        with open(self.store.manifest_path, "w", encoding="utf-8") as f:
+            f.write(old_manifest)
+        self.assertIsNone(self.store.load("model-a", old_hash))
+        expected = ["faq_embeddings.json", os.path.basename(self.store.matrix_path("model-a", new_hash))]
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), sorted(expected))
+
+    def test_load_missing_files(self):
+        """Test that a missing cache is reported as a miss."""
+        self.assertIsNone(self.store.load("model-a", "hash"))
+
+    def test_index_reuses_persisted_embeddings(self):
+        """Test that a second index loads embeddings without encoding."""
+        first = PatternIndex(self.patterns, encoder=self.encoder, store=self.store)
+        expected = np.array(first.embeddings)
+
+        fresh_encoder = CountingEncoder()
+        fresh_encoder.model_id = "counting-encoder"
+        second = PatternIndex(self.patterns, encoder=fresh_encoder, store=self.store)
+
+        np.testing.assert_array_equal(second.embeddings, expected)
+        self.assertEqual(fresh_encoder.calls, 0)
+
+class TestPatternIndex(unittest.TestCase):
+
+    def setUp(self):
+        """Set up an index backed by a deterministic encoder."""
+        self.faq = [
+            {"intent": "fees", "patterns": ["How much are the tuition fees?", "What do classes cost?"],
+             "response": "Fees are listed on the portal."},
+            {"intent": "register", "patterns": ["How do I register for classes?"],
+             "response": "Register through the student portal."},
+        ]
+        self.encoder = CountingEncoder()
+        self.index = PatternIndex.from_faq(self.faq, encoder=self.encoder)
+
+    def test_reuse_embeddings_encodes_only_new_patterns(self):
+        """Test that a rebuilt index copies unchanged rows and encodes the rest in one call."""
+        self.index.embeddings
+        calls = self.encoder.calls
+        faq = [dict(item) for item in self.faq]
+        faq[1] = dict(faq[1], patterns=["Where do I sign up?"] + faq[1]["patterns"])
+        rebuilt = PatternIndex.from_faq(faq, encoder=self.encoder)
+
+        self.assertEqual(rebuilt.reuse_embeddings(self.index), 1)
+        self.assertEqual(self.encoder.calls, calls + 1)
+        fresh = PatternIndex.from_faq(faq, encoder=CountingEncoder())
+        np.testing.assert_allclose(rebuilt.embeddings, fresh.embeddings, rtol=1e-6)
+
+    def test_reuse_embeddings_needs_same_encoder(self):
+        """Test that rows are not borrowed from an index built with another encoder."""
+        self.index.embeddings
+        other = PatternIndex.from_faq(self.faq, encoder=CountingEncoder())
+        self.assertIsNone(other.reuse_embeddings(self.index))
+
+    def test_from_faq_collects_patterns_and_responses(self):
+        """Test that every pattern is indexed with its response."""
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.response_for("How do I register for classes?"),
+                         "Register through the student portal.")
+        self.assertEqual(self.index.intent_for("What do classes cost?"), "fees")
+
+    def test_embeddings_are_normalized_float32(self):
+        """Test the pattern matrix is a normalized float32 array."""
+        embeddings = self.index.embeddings
+        self.assertEqual(embeddings.dtype, np.float32)
+        self.assertEqual(embeddings.shape, (3, self.encoder.dim))
+        np.testing.assert_allclose(np.linalg.norm(embeddings, axis=1), 1.0, rtol=1e-5)
+
+    def test_repeated_query_served_from_cache(self):
+        """Test that a repeated query skips encoding and scoring."""
+        first = self.index.rank("How can I register for classes")
+        calls = self.encoder.calls
+        second = self.index.rank("how can I  register for classes")
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.encoder.calls, calls)
+        self.assertEqual(self.index.cache_stats()["results"]["hits"], 1)
+
+    def test_query_embeddings_shared_between_indexes(self):
+        """Test that a query embedding is reused by another index."""
+        query_embedding_cache.clear()
+        other = PatternIndex(["What do classes cost?"], encoder=self.encoder)
+        self.index.best_match("tuition cost")
+        other.best_match("tuition cost")
+        self.assertEqual(query_embedding_cache.stats()["hits"], 1)
+
+    def test_patterns_encoded_once(self):
+        """Test that repeated queries only encode the query itself."""
+        self.index.best_match("register for classes")
+        calls_after_first = self.encoder.calls
+        self.index.best_match("tuition fees")
+        self.assertEqual(self.encoder.calls, calls_after_first + 1)
+
+    def test_best_match_exact_pattern(self):
+        """Test that an exact pattern is returned with a high score."""
+        best_question, score = self.index.best_match("How do I register for classes?")
+        self.assertEqual(best_question, "How do I register for classes?")
+        self.assertGreater(score, 0.9)
+
+    def test_get_best_match_accepts_index(self):
+        """Test that get_best_match can score against a shared index."""
+        best_question, _ = get_best_match("How much are the tuition fees?", self.index)
+        self.assertEqual(best_question, "How much are the tuition fees?")
+
+    def test_preprocessed_patterns_cached(self):
+        """Test that preprocessed pattern text is computed once per index."""
+        with patch('nlp_agent.preprocess_batch', return_value=["a", "b", "c"]) as mock_batch:
+            self.assertEqual(self.index.preprocessed, ["a", "b", "c"])
+            self.assertEqual(self.index.preprocessed, ["a", "b", "c"])
+            mock_batch.assert_called_once_with(self.index.patterns)
+
+    def test_hybrid_scorer_matches_pairwise_functions(self):
+        """Test that batch fuzzy and overlap scores equal the pairwise helpers."""
+        patterns = self.index.patterns + ["Hello hello world", ""]
+        scorer = HybridScorer(patterns)
+        query = "How do I REGISTER for my classes?"
+
+        expected_fuzzy = [fuzzy_match_score(query, p) for p in patterns]
+        expected_overlap = [token_overlap(query, p) for p in patterns]
+
+        np.testing.assert_allclose(scorer.fuzzy_scores(query), expected_fuzzy)
+        np.testing.assert_allclose(scorer.overlap_scores(query), expected_overlap)
+
+    def test_hybrid_scores_return_vector(self):
+        """Test that hybrid scores are a vector aligned with the patterns."""
+        scores, semantic = self.index.hybrid_scores("register for classes")
+        self.assertEqual(scores.shape, (3,))
+        self.assertEqual(semantic.shape, (3,))
+        self.assertEqual(self.index.patterns[int(np.argmax(scores))], "How do I register for classes?")
+
+    def test_rank_returns_sorted_top_k(self):
+        """Test that rank returns the best match followed by runner-ups."""
+        ranked = self.index.rank("How can I register for my classes", k=2)
+        self.assertEqual(len(ranked), 2)
+        self.assertEqual(ranked[0][0], "How do I register for classes?")
+        self.assertGreaterEqual(ranked[0][1], ranked[1][1])
+
+    def test_exact_match_skips_the_model(self):
+        """Test that literal pattern text is answered without encoding."""
+        encoder = CountingEncoder()
+        index = PatternIndex.from_faq(self.faq, encoder=encoder)
+
+        self.assertEqual(index.best_match("how do I register for classes"),
+                         ("How do I register for classes?", 1.0))
+        self.assertEqual(index.rank("What do classes COST?!"), [("What do classes cost?", 1.0)])
+        self.assertEqual(encoder.calls, 0)
+        self.assertEqual(index.cache_stats()["exact"]["hits"], 2)
+
+    def test_exact_match_after_typo_correction(self):
+        """Test that a corrected typo can still hit the exact index."""
+        encoder = CountingEncoder()
+        index = PatternIndex(["What is the attendance policy?", "is attendce mandatory"], encoder=encoder)
+
+        self.assertEqual(index.best_match("What is the attendce policy"),
+                         ("What is the attendance policy?", 1.0))
+        self.assertEqual(index.best_match("Is attendance mandatory?"),
+                         ("is attendce mandatory", 1.0))
+        self.assertEqual(encoder.calls, 0)
+
+    def test_rank_applies_min_score(self):
+        """Test that rank drops candidates below min_score."""
+        ranked = self.index.rank("How do I register for classes?", k=3, min_score=0.9)
+        self.assertEqual([p for p, _ in ranked], ["How do I register for classes?"])
+
+    def test_rank_matches_single_pattern_scores(self):
+        """Test that one ranking pass agrees with scoring each pattern alone."""
+        query = "what does a class cost"
+        ranked = dict(self.index.rank(query, k=3))
+        for pattern in self.index.patterns:
+            _, score = get_best_match(query, PatternIndex([pattern], encoder=self.encoder))
+            self.assertAlmostEqual(ranked[pattern], score, places=5)
+
+    def test_empty_index(self):
+        """Test that an empty index returns no match."""
+        index = PatternIndex([], encoder=self.encoder)
+        self.assertEqual(index.best_match("anything"), (None, 0))
+
+class TestApproximateSearch(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a set of FAQ-like patterns."""
+        self.patterns = [
+            "How much are the tuition fees?", "What do classes cost?", "Payment help",
+            "Can I pay in installments?", "Where is the library?", "Library opening hours",
+            "How do I reset my password?", "I forgot my portal password", "Contact the registrar",
+            "When does the semester start?", "Exam timetable", "Where can I park?",
+        ]
+
+    def test_ivf_probing_everything_matches_exact(self):
+        """Test that an IVF index probing every list ranks like exact search."""
+        exact = PatternIndex(self.patterns, encoder=CountingEncoder())
+        ivf = PatternIndex(self.patterns, encoder=CountingEncoder(), vector_index="ivf",
+                           candidates=len(self.patterns), vector_index_options={"nlist": 3, "nprobe": 3})
+
+        for query in ("what is the tuition cost", "library hours", "password reset help"):
+            self.assertEqual(ivf.rank(query, k=3), exact.rank(query, k=3))
+        self.assertEqual(type(ivf.vector_index).__name__, "IVFIndex")
+
+    def test_ivf_scores_only_candidates(self):
+        """Test that patterns outside the candidate set score zero."""
+        index = PatternIndex(self.patterns, encoder=CountingEncoder(), vector_index="ivf",
+                             candidates=2, vector_index_options={"nlist": 2, "nprobe": 2})
+        scores = index.scores("where is the library")
+
+        self.assertEqual(len(scores), len(self.patterns))
+        self.assertLessEqual(np.count_nonzero(scores), 2)
+        self.assertIn(index.rank("where is the library", k=1)[0][0], self.patterns[4:6])
+
+    def test_hybrid_scorer_rows_match_full_scores(self):
+        """Test that scoring a subset of rows gives the same values as the full pass."""
+        scorer = HybridScorer(self.patterns)
+        semantic = np.linspace(0, 1, len(self.patterns))
+        rows = np.array([5, 0, 9])
+
+        full = scorer.score("library opening time", semantic)
+        np.testing.assert_allclose(scorer.score("library opening time", semantic[rows], rows), full[rows])
+
+class TestStagedRanking(unittest.TestCase):
+
+    def setUp(self):
+        """Set up an index over the shipped FAQ with a small rerank depth."""
+        with open(os.path.join(os.path.dirname(__file__), '..', 'data', 'faq.json'), encoding='utf-8') as f:
+            self.faq = json.load(f)
+        self.index = PatternIndex.from_faq(self.faq, encoder=CountingEncoder(dim=64), cache_size=0, rerank_depth=2)
+        self.queries = [
+            "how much is tuition", "library opening", "reset password portal", "when do exams start",
+            "can I pay later", "where is the registrar office", "hello", "zzqx unknown thing",
+        ] + [" ".join(pattern.split()[1:]) or pattern for pattern in self.index.patterns[::5]]
+        # Literal pattern text short-circuits to the exact index; compare only scored queries
+        self.queries = [query for query in self.queries if normalize_query(query) not in self.index.exact_index]
+
+    def full_rank(self, query, k):
+        """Rank by scoring every pattern, as before the staged pipeline."""
+        scores = self.index.scores(query)
+        ranked = []
+        for i in np.argsort(-scores, kind="stable"):
+            if len(ranked) == k:
+                break
+            if self.index.patterns[i] not in [pattern for pattern, _ in ranked]:
+                ranked.append((self.index.patterns[i], float(scores[i])))
+        return ranked
+
+    def test_fuzzy_bound_is_upper_bound(self):
+        """Test that the character-count bound never undercuts the fuzzy score."""
+        scorer = self.index.scorer
+        for query in self.queries:
+            self.assertTrue(np.all(scorer.fuzzy_bounds(query) >= scorer.fuzzy_scores(query)))
+
+    def test_staged_rank_matches_full_scoring(self):
+        """Test that pruning returns the same top matches and scores as full scoring."""
+        for query in self.queries:
+            self.assertEqual(self.index.rank(query, k=3), self.full_rank(query, 3))
+
+    def test_staged_best_match_and_intents_match_full_scoring(self):
+        """Test that best_match and rank_intents agree with the full score vector."""
+        for query in self.queries:
+            scores = self.index.scores(query)
+            self.assertAlmostEqual(self.index.best_match(query, threshold=0)[1], float(scores.max()))
+            expected = self.index.table.aggregate(scores, "max")
+            for match in self.index.rank_intents(query, k=3):
+                self.assertEqual(match.score, expected[match.intent_id])
+
+    def test_stage_timings_reported(self):
+        """Test that each ranked query records retrieve and rerank timings."""
+        self.index.stage_stats.clear()
+        self.index.rank("how much is tuition", k=3)
+        self.index.best_match("library opening")
+        stats = self.index.stage_stats.stats()
+
+        self.assertEqual(stats["queries"], 2)
+        self.assertGreater(stats["retrieve_ms"], 0)
+        self.assertGreater(stats["rerank_ms"], 0)
+        self.assertLess(stats["reranked"], len(self.index.patterns))
+
+class TestBM25Index(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a small tokenized corpus."""
+        self.docs = [
+            lexical_terms("How much are the tuition fees?"),
+            lexical_terms("Where is the library?"),
+            lexical_terms("Library opening hours on the weekend"),
+            lexical_terms("How do I reset my password?"),
+        ]
+        self.index = BM25Index(self.docs)
+
+    def test_rare_terms_weigh_more(self):
+        """Test that idf favours rare terms over common ones."""
+        self.assertGreater(self.index.idf["password"], self.index.idf["the"])
+        self.assertGreater(self.index.idf["library"], self.index.idf["the"])
+
+    def test_scores_only_matching_documents(self):
+        """Test that documents without query terms score zero."""
+        scores = self.index.raw_scores("library hours")
+        self.assertEqual(int(np.argmax(scores)), 2)
+        self.assertEqual(scores[0], 0)
+        self.assertEqual(scores[3], 0)
+
+    def test_shorter_document_wins_equal_match(self):
+        """Test length normalization: the same match counts more in a shorter document."""
+        scores = self.index.raw_scores("library")
+        self.assertGreater(scores[1], scores[2])
+
+    def test_normalized_scores(self):
+        """Test that scaled scores stay in [0, 1] and unmatched words lower them."""
+        full = self.index.scores("reset password")
+        partial = self.index.scores("reset password zzqx")
+
+        self.assertTrue(np.all((full >= 0) & (full <= 1)))
+        self.assertGreater(full[3], 0.5)
+        self.assertLess(partial[3], full[3])
+        np.testing.assert_allclose(self.index.scores("reset password", rows=[3, 0]), full[[3, 0]])
+
+    def test_empty_query_and_corpus(self):
+        """Test that empty inputs score zero rather than failing."""
+        np.testing.assert_array_equal(self.index.scores(""), np.zeros(4))
+        self.assertEqual(len(BM25Index([]).scores("library")), 0)
+
+class TestLexicalFallback(unittest.TestCase):
+
+    def setUp(self):
+        """Set up FAQ patterns with an encoder whose model cannot be loaded."""
+        self.patterns = ["How much are the tuition fees?", "Where is the library?", "How do I reset my password?"]
+        self.responses = {
+            self.patterns[0]: "Fees are listed on the portal.",
+            self.patterns[1]: "The library is in building B.",
+            self.patterns[2]: "Use the forgot password link on the portal.",
+        }
+
+        def offline():
+            raise OSError("model not downloaded")
+        self.offline = LazyResource(offline)
+
+    def test_falls_back_to_bm25_without_model(self):
+        """Test that matching keeps working lexically when the model will not load."""
+        index = PatternIndex(self.patterns, self.responses, encoder=self.offline)
+
+        with self.assertLogs("nlp_agent", level="WARNING"):
+            pattern, score = index.best_match("where can I find the library", threshold=0.3)
+        self.assertFalse(index.semantic_available())
+        self.assertEqual(pattern, "Where is the library?")
+        self.assertEqual(index.rank("forgot my password link", k=1)[0][0], "How do I reset my password?")
+
+    def test_responses_are_indexed(self):
+        """Test that words from a pattern's response also match it."""
+        index = PatternIndex(self.patterns, self.responses, encoder=self.offline)
+        with self.assertLogs("nlp_agent", level="WARNING"):
+            scores = index.semantic_scores("building B")
+        self.assertEqual(int(np.argmax(scores)), 1)
+
+    def test_lexical_weight_blends_signals(self):
+        """Test that lexical_weight mixes BM25 into the semantic signal."""
+        dense = PatternIndex(self.patterns, self.responses, encoder=CountingEncoder())
+        blended = PatternIndex(self.patterns, self.responses, encoder=CountingEncoder(), lexical_weight=0.5)
+        lexical = blended.lexical.scores("library")
+
+        np.testing.assert_allclose(
+            blended.semantic_scores("library"), 0.5 * dense.semantic_scores("library") + 0.5 * lexical)
+        self.assertTrue(dense.semantic_available())
+
+class TestQuantizedIndex(unittest.TestCase):
+
+    def setUp(self):
+        """Set up float32 and int8 indexes over the shipped FAQ and paraphrased test queries."""
+        with open(os.path.join(os.path.dirname(__file__), '..', 'data', 'faq.json'), encoding='utf-8') as f:
+            self.faq = json.load(f)
+        self.encoder = CountingEncoder(dim=64)
+        self.exact = PatternIndex.from_faq(self.faq, encoder=self.encoder, cache_size=0)
+        # Drop one word from each pattern so queries are not literal matches
+        self.queries = [" ".join(pattern.split()[1:]) or pattern for pattern in self.exact.patterns]
+
+    def test_int8_top1_agreement(self):
+        """Test that int8 scoring picks the float32 best match on nearly all FAQ queries."""
+        quantized = PatternIndex.from_faq(self.faq, encoder=self.encoder, cache_size=0, precision="int8")
+        agree = [quantized.best_match(q, 0)[0] == self.exact.best_match(q, 0)[0] for q in self.queries]
+
+        self.assertGreaterEqual(sum(agree) / len(agree), 0.95)
+        self.assertIsInstance(quantized.matrix, Int8Matrix)
+
+    def test_rescoring_restores_float32_scores(self):
+        """Test that float32 rescoring of the top rows gives float32 results for them."""
+        rescored = PatternIndex.from_faq(self.faq, encoder=self.encoder, cache_size=0, precision="int8", rescore=10)
+        for query in self.queries[:20]:
+            semantic = rescored.semantic_scores(query)
+            best = int(np.argmax(semantic))
+            self.assertAlmostEqual(semantic[best], float(self.exact.semantic_scores(query)[best]), places=6)
+
+    def test_float32_released_without_rescoring(self):
+        """Test that only the int8 matrix is kept, and reloads still reuse its rows."""
+        quantized = PatternIndex.from_faq(self.faq, encoder=self.encoder, cache_size=0, precision="int8")
+        quantized.prepare()
+        self.assertIsNone(quantized._embeddings)
+        self.assertEqual(quantized.embeddings.shape, self.exact.embeddings.shape)
+
+        faq = self.faq + [{"intent": "new", "patterns": ["Is there a gym on campus?"], "response": "Yes."}]
+        reloaded = PatternIndex.from_faq(faq, encoder=self.encoder, cache_size=0, precision="int8")
+        calls = self.encoder.calls
+        self.assertEqual(reloaded.reuse_embeddings(quantized), 1)
+        self.assertEqual(self.encoder.calls, calls + 1)
+        np.testing.assert_array_equal(reloaded.matrix.codes[:len(quantized)], quantized.matrix.codes)
+
+    def test_reuse_from_int8_is_not_persisted(self):
+        """Test that dequantized rows are never saved as float32 embeddings."""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.encoder.model_id = "counting"
+        store = EmbeddingStore(os.path.join(cache_dir, "faq_embeddings"))
+        quantized = PatternIndex.from_faq(self.faq, encoder=self.encoder, store=store, precision="int8")
+        quantized.prepare()
+
+        faq = self.faq + [{"intent": "new", "patterns": ["Is there a gym on campus?"], "response": "Yes."}]
+        reloaded = PatternIndex.from_faq(faq, encoder=self.encoder, store=store, precision="int8")
+        self.assertEqual(reloaded.reuse_embeddings(quantized), 1)
+        self.assertIsNone(store.load("counting", pattern_content_hash(reloaded.patterns)))
+
+        as_float = PatternIndex.from_faq(faq, encoder=self.encoder, store=store)
+        self.assertIsNone(as_float.reuse_embeddings(quantized))
+
+    def test_int8_ivf_lists_are_quantized(self):
+        """Test that an int8 index with IVF keeps no float32 copy of the embeddings."""
+        ivf = PatternIndex.from_faq(self.faq, encoder=self.encoder, cache_size=0, precision="int8",
+                                    vector_index="ivf", vector_index_options={"nlist": 4, "nprobe": 4})
+        ivf.prepare()
+
+        self.assertIsNone(ivf._embeddings)
+        self.assertIsInstance(ivf.vector_index.vectors, Int8Matrix)
+        agree = [ivf.best_match(q, 0)[0] == self.exact.best_match(q, 0)[0] for q in self.queries]
+        self.assertGreaterEqual(sum(agree) / len(agree), 0.95)
+
+    def test_unknown_precision(self):
+        """Test that an unsupported precision is rejected."""
+        with self.assertRaises(ValueError):
+            PatternIndex(["hello"], encoder=self.encoder, precision="float16")
+
+class TestEncoderBackends(unittest.TestCase):
+
+    def test_torch_backend(self):
+        """Test that the default backend loads the sentence transformer."""
+        with patch('nlp_agent.load_sentence_transformer', return_value="st") as loader:
+            self.assertEqual(load_encoder("torch"), "st")
+            loader.assert_called_once()
+
+    def test_onnx_backend_falls_back_to_torch(self):
+        """Test that a missing ONNX export logs a warning and uses PyTorch."""
+        empty = tempfile.mkdtemp()
+        try:
+            with patch('nlp_agent.ONNX_MODEL_DIR', empty), \
+                    patch('nlp_agent.load_sentence_transformer', return_value="st"):
+                with self.assertLogs("nlp_agent", level="WARNING"):
+                    self.assertEqual(load_encoder("onnx"), "st")
+        finally:
+            shutil.rmtree(empty, ignore_errors=True)
+
+    @unittest.skipUnless(importlib.util.find_spec("onnxruntime"), "onnxruntime is needed to load the export")
+    def test_corrupt_onnx_model_falls_back_to_torch(self):
+        """Test that an unreadable model.onnx logs a warning and uses PyTorch."""
+        model_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, model_dir, ignore_errors=True)
+        with open(os.path.join(model_dir, "model.onnx"), "wb") as f:
+            f.write(b"not a protobuf")
+        with open(os.path.join(model_dir, "encoder.json"), "w", encoding="utf-8") as f:
+            json.dump({"model": "all-MiniLM-L6-v2", "max_length": 256, "pad_id": 0, "pad_token": "[PAD]"}, f)
+
+        with patch('nlp_agent.ONNX_MODEL_DIR', model_dir), \
+                patch('nlp_agent.load_sentence_transformer', return_value="st"):
+            with self.assertLogs("nlp_agent", level="WARNING"):
+                self.assertEqual(load_encoder("onnx"), "st")
+
+    def test_any_onnx_load_error_falls_back_to_torch(self):
+        """Test that errors of any type while loading the export fall back to PyTorch."""
+        with patch('nlp_agent.OnnxEncoder', side_effect=Exception("tokenizer.json: No such file")), \
+                patch('nlp_agent.load_sentence_transformer', return_value="st"):
+            with self.assertLogs("nlp_agent", level="WARNING"):
+                self.assertEqual(load_encoder("onnx"), "st")
+
+    def test_unknown_backend(self):
+        """Test that an unsupported backend name is rejected."""
+        with self.assertRaises(ValueError):
+            load_encoder("tensorflow")
+
+@unittest.skipUnless(
+    importlib.util.find_spec("onnxruntime") and importlib.util.find_spec("onnx"),
+    "onnxruntime and onnx are needed for the ONNX encoder")
+class TestOnnxEncoder(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Export a small randomly initialized BERT sentence model to ONNX."""
+        import torch
+        from transformers import BertConfig, BertModel, BertTokenizerFast
+        from sentence_transformers import SentenceTransformer, models
+
+        cls.texts = [
+            "How much are the tuition fees?", "Where is the library?", "reset password",
+            "Can I pay my fees in installments over the semester?", "",
+        ]
+        cls.model_dir = tempfile.mkdtemp()
+        source = os.path.join(cls.model_dir, "source")
+        os.makedirs(source)
+        words = sorted({word for text in cls.texts for word in lexical_terms(text)})
+        vocab_path = os.path.join(source, "vocab.txt")
+        with open(vocab_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words))
+        BertTokenizerFast(vocab_file=vocab_path, do_lower_case=True).save_pretrained(source)
+        torch.manual_seed(0)
+        config = BertConfig(vocab_size=5 + len(words), hidden_size=32, num_hidden_layers=2,
+                            num_attention_heads=4, intermediate_size=64)
+        BertModel(config).save_pretrained(source)
+
+        transformer = models.Transformer(source, max_seq_length=16)
+        cls.sentence_model = SentenceTransformer(
+            modules=[transformer, models.Pooling(32, "mean")], device="cpu")
+        cls.export_dir = export_onnx_model(os.path.join(cls.model_dir, "onnx"), cls.sentence_model, quantize=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Remove the exported model."""
+        shutil.rmtree(cls.model_dir, ignore_errors=True)
+
+    def test_embeddings_match_pytorch(self):
+        """Test embedding parity between the ONNX export and the PyTorch model."""
+        report = compare_encoders(self.sentence_model, OnnxEncoder(self.export_dir), self.texts, repeats=2)
+
+        self.assertGreater(report["min_cosine"], 0.9999)
+        self.assertLess(report["max_abs_diff"], 1e-4)
+        self.assertGreater(report["reference_ms"], 0)
+        self.assertGreater(report["candidate_ms"], 0)
+
+    def test_quantized_model_stays_close(self):
+        """Test that the dynamically quantized export keeps embeddings close."""
+        report = compare_encoders(self.sentence_model, OnnxEncoder(self.export_dir, quantized=True), self.texts, repeats=1)
+        self.assertGreater(report["min_cosine"], 0.95)
+
+    def test_encode_interface(self):
+        """Test single/batch shapes, padding and normalization like SentenceTransformer.encode."""
+        encoder = OnnxEncoder(self.export_dir)
+        batch = encoder.encode(self.texts, normalize_embeddings=True, batch_size=2)
+
+        self.assertEqual(batch.shape, (len(self.texts), 32))
+        self.assertEqual(batch.dtype, np.float32)
+        np.testing.assert_allclose(np.linalg.norm(batch, axis=1), 1, rtol=1e-5)
+        # Padding inside a batch must not change a text's embedding
+        np.testing.assert_allclose(encoder.encode(self.texts[2], normalize_embeddings=True), batch[2], atol=1e-5)
+        self.assertEqual(encoder.model_id.split(":")[-1], "onnx")
+
+    def test_pattern_index_with_onnx_encoder(self):
+        """Test that the ONNX encoder plugs into PatternIndex."""
+        index = PatternIndex(self.texts[:4], encoder=OnnxEncoder(self.export_dir))
+        self.assertEqual(index.rank("Where is the library?", k=1)[0][0], "Where is the library?")
+        self.assertEqual(index.semantic_scores("library").shape, (4,))
+
+class TestIntentTable(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a FAQ where one pattern belongs to two intents."""
+        self.faq = [
+            {"intent": "fees", "patterns": ["How much are the tuition fees?", "What do classes cost?", "Payment help"],
+             "response": "Fees are listed on the portal."},
+            {"intent": "installments", "patterns": ["Can I pay in installments?", "Payment help"],
+             "response": "Yes, in three installments."},
+            {"intent": "empty", "patterns": [], "response": "Nothing to match."},
+        ]
+        self.patterns, self.table = IntentTable.from_faq(self.faq)
+
+    def test_from_faq_stores_each_response_once(self):
+        """Test the pattern->intent array lines up with the patterns."""
+        self.assertEqual(self.table.names, ["fees", "installments", "empty"])
+        self.assertEqual(len(self.table.responses), 3)
+        self.assertEqual(self.table.pattern_intents.dtype, np.int32)
+        self.assertEqual(self.table.pattern_intents.tolist(), [0, 0, 0, 1, 1])
+        self.assertEqual(len(self.patterns), 5)
+
+    def test_aggregate_max_and_mean(self):
+        """Test per-intent reductions, with -inf for intents without patterns."""
+        scores = np.array([0.2, 0.8, 0.5, 0.4, 0.6])
+        np.testing.assert_allclose(self.table.aggregate(scores, "max"), [0.8, 0.6, -np.inf])
+        np.testing.assert_allclose(self.table.aggregate(scores, "mean"), [0.5, 0.5, -np.inf])
+        with self.assertRaises(ValueError):
+            self.table.aggregate(scores, "median")
+
+    def test_best_rows(self):
+        """Test that each intent reports its highest-scoring pattern row."""
+        scores = np.array([0.2, 0.8, 0.5, 0.4, 0.6])
+        self.assertEqual(self.table.best_rows(scores).tolist(), [1, 4, -1])
+
+    def test_from_mappings_groups_by_response(self):
+        """Test that plain pattern->response dicts still form one intent per answer."""
+        table = IntentTable.from_mappings(["a", "b", "c"], {"a": "x", "b": "y", "c": "x"})
+        self.assertEqual(table.pattern_intents.tolist(), [0, 1, 0])
+        self.assertEqual(table.responses, ["x", "y"])
+
+    def test_shared_pattern_keeps_both_intents(self):
+        """Test that a pattern used by two intents no longer overwrites one of them."""
+        index = PatternIndex(self.patterns, encoder=CountingEncoder(), table=self.table)
+        matches = index.rank_intents("payment help please", k=3)
+
+        self.assertEqual({match.name for match in matches[:2]}, {"fees", "installments"})
+        self.assertEqual(index.response_for("Payment help"), "Fees are listed on the portal.")
+        self.assertNotIn("empty", [match.name for match in matches])
+
+    def test_shared_pattern_options_answer_by_intent(self):
+        """Test that "Did you mean" options sharing a pattern still map to their own answers."""
+        index = PatternIndex(self.patterns, encoder=CountingEncoder(), table=self.table)
+        matches = index.rank_intents("payment help please", k=2)
+
+        self.assertEqual([match.pattern for match in matches], ["Payment help", "Payment help"])
+        self.assertEqual(len({match.intent_id for match in matches}), 2)
+        answers = {index.table.responses[match.intent_id] for match in matches}
+        self.assertEqual(answers, {"Fees are listed on the portal.", "Yes, in three installments."})
+
+    def test_rank_intents_one_entry_per_intent(self):
+        """Test that intent ranking agrees with pattern ranking on the best match."""
+        index = PatternIndex(self.patterns, encoder=CountingEncoder(), table=self.table)
+        intents = index.rank_intents("what does tuition cost", k=3)
+        patterns = index.rank("what does tuition cost", k=1)
+
+        self.assertEqual(len({match.intent_id for match in intents}), len(intents))
+        self.assertEqual(intents[0].pattern, patterns[0][0])
+        self.assertAlmostEqual(intents[0].score, patterns[0][1])
+        self.assertEqual(index.table.responses[intents[0].intent_id], "Fees are listed on the portal.")
+
+    def test_rank_intents_mean_and_min_score(self):
+        """Test the mean aggregate and the score cut-off."""
+        index = PatternIndex(self.patterns, encoder=CountingEncoder(), table=self.table)
+        by_max = index.rank_intents("what does tuition cost", k=3, aggregate="max")
+        by_mean = index.rank_intents("what does tuition cost", k=3, aggregate="mean")
+
+        self.assertLessEqual(by_mean[0].score, by_max[0].score)
+        self.assertEqual(index.rank_intents("what does tuition cost", k=3, min_score=2.0), [])
+
+    def test_rank_intents_exact_match(self):
+        """Test that literal pattern text resolves straight to its intent."""
+        index = PatternIndex(self.patterns, encoder=CountingEncoder(), table=self.table)
+        match, = index.rank_intents("Can I pay in installments?")
+        self.assertEqual((match.name, match.score), ("installments", 1.0))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
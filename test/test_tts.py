@@ -0,0 +1,225 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import wave
+import io
+from unittest.mock import patch
+
+# Add the src directory to the path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from tts import (
+    TTSService, SilenceEngine, GTTSEngine, DiskAudioStore, MemoryAudioStore,
+    get_engine, get_store, audio_key, remove_legacy_audio
+)
+
+class CountingEngine(SilenceEngine):
+    """Offline engine that counts calls and can be made to block or fail"""
+
+    def __init__(self, fail=False):
+        self.calls = 0
+        self.fail = fail
+        self.release = threading.Event()
+        self.release.set()
+
+    def synthesize(self, text, lang):
+        self.release.wait(5)
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError("no network")
+        return super().synthesize(text, lang)
+
+class TestTTSService(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a service with an offline engine and a temporary cache."""
+        self.cache_dir = tempfile.mkdtemp()
+        self.engine = CountingEngine()
+        self.service = TTSService(engine=self.engine, store=DiskAudioStore(self.cache_dir))
+
+    def tearDown(self):
+        """Stop the service and remove the cache."""
+        self.service.shutdown()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_request_renders_audio_file(self):
+        """Test that a request produces readable audio stored in the cache directory."""
+        data = self.service.request("Fees are listed on the portal.").result(5)
+
+        self.assertEqual(self.service.get("Fees are listed on the portal."), data)
+        self.assertEqual(os.listdir(self.cache_dir), [self.service.name_for("Fees are listed on the portal.")])
+        with wave.open(io.BytesIO(data)) as audio:
+            self.assertGreater(audio.getnframes(), 0)
+
+    def test_cached_audio_not_rendered_again(self):
+        """Test that the same text is synthesized only once."""
+        self.service.request("Hello there").result(5)
+        self.service.request("Hello there").result(5)
+
+        other = TTSService(engine=self.engine, store=DiskAudioStore(self.cache_dir))
+        other.request("Hello there").result(5)
+        other.shutdown()
+
+        self.assertEqual(self.engine.calls, 1)
+
+    def test_concurrent_requests_share_one_job(self):
+        """Test that in-flight requests for the same text are deduplicated."""
+        self.engine.release.clear()
+        first = self.service.request("Hello there")
+        second = self.service.request("Hello there")
+
+        self.assertIs(first, second)
+        self.assertTrue(self.service.is_pending("Hello there"))
+        self.assertIsNone(self.service.get("Hello there"))
+
+        self.engine.release.set()
+        first.result(5)
+        self.assertFalse(self.service.is_pending("Hello there"))
+        self.assertEqual(self.engine.calls, 1)
+
+    def test_key_includes_language(self):
+        """Test that the same text in another language is cached separately."""
+        self.service.request("Hello", "en").result(5)
+        self.service.request("Hello", "fr").result(5)
+
+        self.assertNotEqual(self.service.name_for("Hello", "en"), self.service.name_for("Hello", "fr"))
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+        self.assertEqual(audio_key("Hello", "fr"), (audio_key("Hello", "en")[0], "fr"))
+
+    def test_failed_render_not_cached(self):
+        """Test that an engine error surfaces on the future and is retried later."""
+        self.engine.fail = True
+        with self.assertRaises(ConnectionError):
+            self.service.request("Hello").result(5)
+        self.assertIsNone(self.service.get("Hello"))
+        self.assertFalse(self.service.is_pending("Hello"))
+
+        self.engine.fail = False
+        self.assertIsNotNone(self.service.request("Hello").result(5))
+        self.assertEqual(self.engine.calls, 2)
+
+    def test_prerender_distinct_texts(self):
+        """Test that prerendering queues each distinct text once."""
+        futures = self.service.prerender(["a b", "c d", "a b"])
+
+        self.assertEqual(len(futures), 2)
+        for future in futures:
+            future.result(5)
+        self.assertEqual(self.engine.calls, 2)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+class TestAudioStores(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a temporary audio directory."""
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the audio directory."""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_disk_store_evicts_least_recently_used(self):
+        """Test that the disk store stays under its cap, dropping the oldest unused file."""
+        store = DiskAudioStore(self.cache_dir, max_bytes=25)
+        store.put("a", b"x" * 10)
+        store.put("b", b"x" * 10)
+        store.get("a")  # a is now more recent than b
+        store.put("c", b"x" * 10)
+
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ["a", "c"])
+        self.assertEqual(store.total_bytes, 20)
+        self.assertIsNone(store.get("b"))
+
+    def test_disk_store_rewrite_does_not_double_count(self):
+        """Test that storing the same name twice keeps one file's worth of bytes."""
+        store = DiskAudioStore(self.cache_dir)
+        store.put("a", b"x" * 10)
+        store.put("a", b"x" * 10)
+        self.assertEqual(store.total_bytes, 10)
+        self.assertEqual(len(store), 1)
+
+    def test_disk_store_recovers_state_on_restart(self):
+        """Test that a new store picks up existing files and their sizes."""
+        first = DiskAudioStore(self.cache_dir)
+        first.put("a", b"x" * 10)
+        first.put("b", b"x" * 5)
+
+        second = DiskAudioStore(self.cache_dir, max_bytes=12)
+        self.assertEqual(second.total_bytes, 15)
+        self.assertEqual(second.get("b"), b"x" * 5)
+        second.put("c", b"x" * 2)
+        self.assertNotIn("a", second)
+        self.assertLessEqual(second.total_bytes, 12)
+
+    def test_disk_store_file_deleted_externally(self):
+        """Test that a missing file is a miss rather than an error."""
+        store = DiskAudioStore(self.cache_dir)
+        store.put("a", b"x" * 10)
+        os.remove(os.path.join(self.cache_dir, "a"))
+
+        self.assertIsNone(store.get("a"))
+        self.assertEqual(store.total_bytes, 0)
+
+    def test_memory_store_evicts_least_recently_used(self):
+        """Test that the in-memory store keeps bytes under its cap."""
+        store = MemoryAudioStore(max_bytes=25)
+        store.put("a", b"x" * 10)
+        store.put("b", b"x" * 10)
+        store.get("a")
+        store.put("c", b"x" * 10)
+
+        self.assertIn("a", store)
+        self.assertNotIn("b", store)
+        self.assertEqual(store.get("c"), b"x" * 10)
+        self.assertEqual(store.total_bytes, 20)
+
+    def test_service_with_memory_store(self):
+        """Test that the service works without touching the disk."""
+        service = TTSService(engine=SilenceEngine(), store=MemoryAudioStore())
+        data = service.request("Hello").result(5)
+        service.shutdown()
+        self.assertEqual(service.get("Hello"), data)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_get_store_by_name(self):
+        """Test that the configured store kind is honoured."""
+        self.assertIsInstance(get_store("memory"), MemoryAudioStore)
+        with self.assertRaises(ValueError):
+            get_store("cloud")
+
+    def test_remove_legacy_audio(self):
+        """Test that only old per-answer mp3 files are removed."""
+        for name in ("response_1234.mp3", "response_abcd.mp3", "keep.mp3", "response_notes.txt"):
+            open(os.path.join(self.cache_dir, name), "w").close()
+
+        self.assertEqual(remove_legacy_audio(self.cache_dir), 2)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ["keep.mp3", "response_notes.txt"])
+
+class TestEngines(unittest.TestCase):
+
+    def test_get_engine_by_name(self):
+        """Test that engines are looked up by name."""
+        self.assertIsInstance(get_engine("silence"), SilenceEngine)
+        self.assertIsInstance(get_engine("gtts"), GTTSEngine)
+        with self.assertRaises(ValueError):
+            get_engine("missing")
+
+    def test_silence_engine_length_follows_text(self):
+        """Test that the offline engine produces longer audio for longer text."""
+        engine = SilenceEngine()
+        short = wave.open(io.BytesIO(engine.synthesize("hi", "en"))).getnframes()
+        long = wave.open(io.BytesIO(engine.synthesize("a much longer reply", "en"))).getnframes()
+        self.assertGreater(long, short)
+
+    def test_gtts_engine_returns_bytes(self):
+        """Test that the gTTS engine collects the MP3 stream in memory."""
+        with patch('gtts.gTTS') as mock_gtts:
+            mock_gtts.return_value.write_to_fp.side_effect = lambda fp: fp.write(b"ID3")
+            self.assertEqual(GTTSEngine().synthesize("hello", "en"), b"ID3")
+            mock_gtts.assert_called_once_with(text="hello", lang="en")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import unittest
+import os
+import sys
+import numpy as np
+
+# Add the src directory to the path to import modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from vector_index import ExactIndex, IVFIndex, Int8Matrix, build_vector_index, recall_at_k, top1_agreement
+
+def clustered_embeddings(n=2000, dim=32, clusters=40, seed=0):
+    """Normalized vectors scattered around a few topics, like FAQ paraphrases"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    vectors = centers[rng.integers(clusters, size=n)] + 0.3 * rng.normal(size=(n, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+class TestExactIndex(unittest.TestCase):
+
+    def test_search_returns_best_rows_first(self):
+        """Test that exact search ranks rows by inner product."""
+        embeddings = np.eye(4, dtype=np.float32)
+        query = np.array([0.1, 0.9, 0.4, 0.0], dtype=np.float32)
+        rows, scores = ExactIndex(embeddings).search(query, 2)
+
+        self.assertEqual(rows.tolist(), [1, 2])
+        np.testing.assert_allclose(scores, [0.9, 0.4])
+
+    def test_ties_keep_row_order(self):
+        """Test that equal scores come back lowest row first."""
+        embeddings = np.array([[1, 0], [0, 1], [1, 0], [1, 0]], dtype=np.float32)
+        rows, _ = ExactIndex(embeddings).search(np.array([1, 0], dtype=np.float32), 2)
+        self.assertEqual(rows.tolist(), [0, 2])
+
+    def test_empty_index(self):
+        """Test that an index without rows returns no results."""
+        rows, scores = ExactIndex(np.zeros((0, 0), dtype=np.float32)).search(np.zeros(0), 3)
+        self.assertEqual(len(rows), 0)
+        self.assertEqual(len(scores), 0)
+
+class TestIVFIndex(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a clustered corpus and held-out queries near it."""
+        self.embeddings = clustered_embeddings()
+        self.queries = clustered_embeddings(n=50, seed=1)
+        self.exact = ExactIndex(self.embeddings)
+
+    def test_lists_cover_every_row_once(self):
+        """Test that each row lands in exactly one inverted list."""
+        index = IVFIndex(self.embeddings, nlist=16)
+
+        self.assertEqual(sorted(index.order.tolist()), list(range(len(self.embeddings))))
+        self.assertEqual(index.offsets[-1], len(self.embeddings))
+        self.assertEqual(index.centroids.shape, (16, 32))
+
+    def test_recall_at_k(self):
+        """Test that probing a quarter of the lists keeps recall@10 high."""
+        index = IVFIndex(self.embeddings, nlist=32, nprobe=8)
+        self.assertGreaterEqual(recall_at_k(index, self.exact, self.queries, k=10), 0.9)
+
+    def test_recall_grows_with_nprobe(self):
+        """Test the recall/latency knob: more probes, at least as good recall."""
+        low = IVFIndex(self.embeddings, nlist=32, nprobe=1)
+        high = IVFIndex(self.embeddings, nlist=32, nprobe=16)
+        self.assertLessEqual(recall_at_k(low, self.exact, self.queries), recall_at_k(high, self.exact, self.queries))
+
+    def test_probing_every_list_is_exact(self):
+        """Test that nprobe == nlist returns the exact results and scores."""
+        index = IVFIndex(self.embeddings, nlist=16, nprobe=16)
+        for query in self.queries[:10]:
+            rows, scores = index.search(query, 5)
+            exact_rows, exact_scores = self.exact.search(query, 5)
+            self.assertEqual(rows.tolist(), exact_rows.tolist())
+            np.testing.assert_allclose(scores, exact_scores, rtol=1e-5)
+
+    def test_small_corpus(self):
+        """Test that tiny and empty corpora still build and search."""
+        index = IVFIndex(self.embeddings[:3], nlist=8)
+        self.assertEqual(index.nlist, 3)
+        self.assertEqual(len(index.search(self.queries[0], 10)[0]), 3)
+
+        empty = IVFIndex(np.zeros((0, 32), dtype=np.float32))
+        self.assertEqual(len(empty.search(self.queries[0], 10)[0]), 0)
+
+    def test_int8_lists(self):
+        """Test that an index built from int8 codes stores codes and keeps recall."""
+        quantized = Int8Matrix.from_float(self.embeddings)
+        index = IVFIndex(quantized, nlist=32, nprobe=8)
+
+        self.assertIsInstance(index.vectors, Int8Matrix)
+        self.assertEqual(sorted(index.order.tolist()), list(range(len(self.embeddings))))
+        self.assertGreaterEqual(recall_at_k(index, self.exact, self.queries, k=10), 0.85)
+
+    def test_build_by_name(self):
+        """Test that backends are selected by name."""
+        self.assertIsInstance(build_vector_index(self.embeddings, "exact"), ExactIndex)
+        self.assertIsInstance(build_vector_index(self.embeddings, "ivf", nlist=4), IVFIndex)
+        with self.assertRaises(ValueError):
+            build_vector_index(self.embeddings, "hnsw")
+
+class TestInt8Matrix(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a float32 matrix and its int8 quantization."""
+        self.embeddings = clustered_embeddings(n=500, dim=64)
+        self.quantized = Int8Matrix.from_float(self.embeddings)
+
+    def test_storage_is_a_quarter(self):
+        """Test that codes are int8 with one float32 scale per row."""
+        self.assertEqual(self.quantized.codes.dtype, np.int8)
+        self.assertEqual(self.quantized.scales.shape, (500,))
+        self.assertLess(self.quantized.nbytes, self.embeddings.nbytes / 3.5)
+
+    def test_dequantize_error_within_half_step(self):
+        """Test that each component is off by at most half a quantization step."""
+        error = np.abs(self.quantized.dequantize() - self.embeddings)
+        self.assertTrue(np.all(error <= self.quantized.scales[:, None] / 2 + 1e-7))
+        np.testing.assert_array_equal(Int8Matrix.from_float(self.quantized.dequantize()).codes, self.quantized.codes)
+
+    def test_matmul_close_to_float(self):
+        """Test that quantized inner products track the float32 ones, across blocks."""
+        query = self.embeddings[7]
+        self.quantized.block_rows = 128
+        np.testing.assert_allclose(self.quantized @ query, self.embeddings @ query, atol=0.02)
+        np.testing.assert_allclose(self.quantized.dequantize([3, 7]), self.quantized.dequantize()[[3, 7]])
+
+    def test_top1_agreement(self):
+        """Test that quantization keeps the best row for nearly every query."""
+        queries = clustered_embeddings(n=200, dim=64, seed=1)
+        self.assertEqual(top1_agreement(self.embeddings, self.embeddings, queries), 1.0)
+        self.assertGreaterEqual(top1_agreement(self.embeddings, self.quantized, queries), 0.95)
+
+    def test_zero_rows_and_empty_matrix(self):
+        """Test that all-zero rows and empty matrices quantize without dividing by zero."""
+        quantized = Int8Matrix.from_float(np.zeros((2, 4), dtype=np.float32))
+        np.testing.assert_array_equal(quantized @ np.ones(4, dtype=np.float32), [0, 0])
+        self.assertEqual(len(Int8Matrix.from_float(np.zeros((0, 4), dtype=np.float32)) @ np.ones(4)), 0)
+
+if __name__ == '__main__':
+    unittest.main()